@@ -0,0 +1,82 @@
+"""Benchmark incremental PNG encoding (PngPatcher) against a plain Image.save.
+
+Draws a run of flyers on a template the way a batch does, encodes each one
+both ways, checks that the two files decode to the same pixels and reports
+the time and size of each.
+
+Example:
+    python benchmark_png.py "dist/Untitled design (2).jpg" --flyers 50
+"""
+import argparse
+import io
+import statistics
+import time
+import zlib
+
+from PIL import Image
+
+from flyer_final import DEFAULT_RENDER_SETTINGS, FlyerRenderer, PngPatcher, load_base_image
+
+
+def check_stream(data):
+    """Inflate the IDAT stream, so zlib verifies the combined Adler-32, and check every chunk CRC."""
+    offset, idat = 8, []
+    while offset < len(data):
+        length = int.from_bytes(data[offset:offset + 4], "big")
+        kind = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        if zlib.crc32(kind + body) != int.from_bytes(data[offset + 8 + length:offset + 12 + length], "big"):
+            raise ValueError(f"bad CRC in {kind!r} chunk")
+        if kind == b"IDAT":
+            idat.append(body)
+        offset += 12 + length
+    zlib.decompress(b"".join(idat))
+
+
+def run_benchmark(background, font, flyers):
+    settings = dict(DEFAULT_RENDER_SETTINGS, background=background, font_path=font)
+    renderer = FlyerRenderer(settings, background=load_base_image(settings))
+    start = time.perf_counter()
+    patcher = PngPatcher(renderer.background)
+    setup = time.perf_counter() - start
+    plain_times, patched_times, plain_sizes, patched_sizes = [], [], [], []
+    for index in range(flyers):
+        image = renderer.background.copy()
+        boxes = renderer.draw_into(image, f"Customer {index}", f"+91 90000 {index:05d}")
+
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        plain_times.append(time.perf_counter() - start)
+        plain = buffer.getvalue()
+
+        start = time.perf_counter()
+        patched = patcher.encode(image, boxes)
+        patched_times.append(time.perf_counter() - start)
+
+        check_stream(patched)
+        if Image.open(io.BytesIO(patched)).tobytes() != Image.open(io.BytesIO(plain)).tobytes():
+            raise SystemExit(f"Flyer {index}: patched PNG decodes differently from Image.save")
+        plain_sizes.append(len(plain))
+        patched_sizes.append(len(patched))
+
+    width, height = renderer.background.size
+    print(f"Template {width}x{height} {renderer.background.mode}, {flyers} flyers, all decode identically")
+    print(f"Template setup: {setup * 1000:.0f} ms")
+    for label, times, sizes in (("Image.save", plain_times, plain_sizes), ("PngPatcher", patched_times, patched_sizes)):
+        print(f"{label:<11} median {statistics.median(times) * 1000:7.1f} ms, "
+              f"mean size {statistics.mean(sizes) / 1024:7.0f} KB")
+    print(f"Speed-up: {statistics.median(plain_times) / statistics.median(patched_times):.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("background", help="Template image")
+    parser.add_argument("--font", default="font/Roboto-Regular.ttf")
+    parser.add_argument("--flyers", type=int, default=20)
+    args = parser.parse_args()
+    run_benchmark(args.background, args.font, args.flyers)
+
+
+if __name__ == "__main__":
+    main()
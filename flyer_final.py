@@ -1,14 +1,31 @@
 import os
 import re
+import ast
 import time
 import base64
+import csv
+import hashlib
+import io
+import json
+import math
+import mmap
 import random
+import shutil
+import sqlite3
+import struct
+import subprocess
+import tempfile
+import unicodedata
+import weakref
+import zlib
+import multiprocessing
 from typing import List, Tuple, Dict
 from pathlib import Path
 import customtkinter as ctk
-from PIL import Image, ImageDraw, ImageFont, ImageTk
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont, ImageOps, ImageTk, features
 from tkinter import filedialog, messagebox, colorchooser, Toplevel
 import pandas as pd
+import numpy as np
 import sys
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -21,7 +38,13 @@ from selenium.webdriver.common.action_chains import ActionChains
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
 import threading
 import queue
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from xml.sax.saxutils import escape, quoteattr
+import xml.etree.ElementTree as ElementTree
+from functools import lru_cache
 
 
 class GenerationProgressModal(ctk.CTkToplevel):
@@ -86,6 +109,239 @@ class GenerationProgressModal(ctk.CTkToplevel):
         self.status_label.configure(text="Cancelling...")
         self.cancel_button.configure(state="disabled")
 
+class ContactSheetWindow(ctk.CTkToplevel):
+    """Scrollable grid of flyer thumbnails; tiles are rendered as they scroll into view."""
+    
+    POLL_MS = 30
+    
+    def __init__(self, master, sheet, contacts):
+        super().__init__(master)
+        self.title(f"Contact Sheet ({len(contacts)} rows)")
+        self.geometry("1100x800")
+        self.transient(master)
+        
+        self.sheet = sheet
+        self.contacts = contacts
+        self.columns = 0
+        self.futures = {}
+        self.photos = {}
+        self.started = time.perf_counter()
+        tile_width, tile_height = sheet.tile_size
+        self.cell_size = (tile_width + sheet.GAP, tile_height + sheet.LABEL_HEIGHT + sheet.GAP)
+        
+        self.status_label = ctk.CTkLabel(self, text=f"Rendering {len(contacts)} thumbnails...")
+        self.status_label.pack(pady=5)
+        
+        frame = ctk.CTkFrame(self)
+        frame.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.canvas = ctk.CTkCanvas(frame, bg="white", highlightthickness=0)
+        self.scrollbar = ctk.CTkScrollbar(frame, command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        
+        self.canvas.bind("<Configure>", self._layout)
+        self.canvas.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+        self.protocol("WM_DELETE_WINDOW", self._close)
+        self._poll_job = self.after(self.POLL_MS, self._poll)
+    
+    def _cell(self, index):
+        cell_width, cell_height = self.cell_size
+        return (self.sheet.GAP + (index % self.columns) * cell_width,
+                self.sheet.GAP + (index // self.columns) * cell_height)
+    
+    def _layout(self, event):
+        """Lay the tiles out for the current width; only rebuilds when the column count changes."""
+        columns = max(1, (event.width - self.sheet.GAP) // self.cell_size[0])
+        if columns != self.columns:
+            self.columns = columns
+            self.canvas.delete("all")
+            tile_width, tile_height = self.sheet.tile_size
+            for index, contact in enumerate(self.contacts):
+                x, y = self._cell(index)
+                self.canvas.create_rectangle(x, y, x + tile_width, y + tile_height, fill="#e5e5e5", outline="")
+                self.canvas.create_text(x, y + tile_height + 3, anchor="nw", text=f"Row {contact[0]}")
+            for index, photo in self.photos.items():
+                self.canvas.create_image(*self._cell(index), anchor="nw", image=photo)
+            rows = -(-len(self.contacts) // columns)
+            self.canvas.configure(scrollregion=(0, 0, columns * self.cell_size[0] + self.sheet.GAP,
+                                                rows * self.cell_size[1] + self.sheet.GAP))
+        self._load_visible()
+    
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._load_visible()
+    
+    def _load_visible(self):
+        """Queue renders for the visible tiles plus one screen ahead and behind."""
+        if not self.columns:
+            return
+        height = self.canvas.winfo_height()
+        top = self.canvas.canvasy(0) - height
+        bottom = self.canvas.canvasy(height) + height
+        cell_height = self.cell_size[1]
+        first = max(0, int(top // cell_height)) * self.columns
+        last = min(len(self.contacts), (int(bottom // cell_height) + 1) * self.columns)
+        for index in range(first, last):
+            if index not in self.futures:
+                self.futures[index] = self.sheet.submit(self.contacts[index])
+    
+    def _poll(self):
+        """Place finished tiles on the canvas."""
+        for index, future in self.futures.items():
+            if index in self.photos or not future.done():
+                continue
+            try:
+                self.photos[index] = ImageTk.PhotoImage(future.result())
+            except Exception as e:
+                self.photos[index] = None
+                x, y = self._cell(index)
+                self.canvas.create_text(x + 4, y + 4, anchor="nw", text=f"Failed:\n{e}", fill="red",
+                                        width=self.sheet.tile_size[0] - 8)
+                continue
+            self.canvas.create_image(*self._cell(index), anchor="nw", image=self.photos[index])
+        self.status_label.configure(
+            text=f"{len(self.photos)} of {len(self.contacts)} thumbnails rendered "
+                 f"({time.perf_counter() - self.started:.1f}s). Scroll to load more."
+            if len(self.photos) < len(self.contacts) else
+            f"{len(self.contacts)} thumbnails rendered"
+        )
+        if len(self.photos) < len(self.contacts):
+            self._poll_job = self.after(self.POLL_MS, self._poll)
+    
+    def _close(self):
+        self.after_cancel(self._poll_job)
+        self.sheet.close()
+        self.destroy()
+
+
+class FontGalleryWindow(ctk.CTkToplevel):
+    """Every available font drawing the same text; samples load as they scroll into view."""
+    
+    POLL_MS = 30
+    LABEL_WIDTH = 220
+    
+    def __init__(self, master, samples, fonts, text, color, selected=None, on_select=None):
+        super().__init__(master)
+        self.title(f"Fonts ({len(fonts)})")
+        self.geometry("760x640")
+        self.transient(master)
+        
+        self.samples = samples
+        self.fonts = fonts
+        self.color = color
+        self.on_select = on_select
+        self.selected = next((index for index, (_, path) in enumerate(fonts) if path == selected), None)
+        self.row_height = FontSampleCache.row_height()
+        self.futures = {}
+        self.photos = {}
+        self._poll_job = None
+        
+        top = ctk.CTkFrame(self, fg_color="transparent")
+        top.pack(fill="x", padx=10, pady=5)
+        ctk.CTkLabel(top, text="Sample text:").pack(side="left")
+        self.text = ctk.StringVar(value=text)
+        entry = ctk.CTkEntry(top, textvariable=self.text)
+        entry.pack(side="left", fill="x", expand=True, padx=5)
+        entry.bind("<Return>", lambda e: self._reload())
+        ctk.CTkButton(top, text="Update", width=70, command=self._reload).pack(side="left")
+        self.status_label = ctk.CTkLabel(self, text="Click a font to use it", text_color="gray")
+        self.status_label.pack()
+        
+        frame = ctk.CTkFrame(self)
+        frame.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.canvas = ctk.CTkCanvas(frame, bg="white", highlightthickness=0)
+        self.scrollbar = ctk.CTkScrollbar(frame, command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_scroll,
+                              scrollregion=(0, 0, 0, len(fonts) * self.row_height))
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        
+        self.canvas.bind("<Configure>", lambda e: self._load_visible())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+        self.protocol("WM_DELETE_WINDOW", self._close)
+        self._reload()
+    
+    def _reload(self):
+        """Redraw the list for the current sample text; cached samples appear at once."""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.photos = {}
+        self.canvas.delete("all")
+        for index, (label, _) in enumerate(self.fonts):
+            y = index * self.row_height
+            if index == self.selected:
+                self.canvas.create_rectangle(0, y, 4000, y + self.row_height, fill="#dbe9ff", outline="", tags="selected")
+            self.canvas.create_text(8, y + self.row_height // 2, anchor="w", text=label, width=self.LABEL_WIDTH - 16)
+        self._load_visible()
+    
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._load_visible()
+    
+    def _load_visible(self):
+        """Queue samples for the visible rows plus one screen ahead and behind; drop the rest of the queue."""
+        height = self.canvas.winfo_height()
+        first = max(0, int((self.canvas.canvasy(0) - height) // self.row_height))
+        last = min(len(self.fonts), int((self.canvas.canvasy(height) + height) // self.row_height) + 1)
+        for index in list(self.futures):
+            if not first <= index < last and index not in self.photos and self.futures[index].cancel():
+                del self.futures[index]
+        text = self.text.get()
+        for index in range(first, last):
+            if index not in self.futures:
+                self.futures[index] = self.samples.submit(self.fonts[index][1], text, color=self.color)
+        if self._poll_job is None:
+            self._poll_job = self.after(self.POLL_MS, self._poll)
+    
+    def _poll(self):
+        """Place finished samples on the canvas."""
+        self._poll_job = None
+        waiting = False
+        for index, future in self.futures.items():
+            if index in self.photos:
+                continue
+            if not future.done():
+                waiting = True
+                continue
+            y = index * self.row_height + self.row_height // 2
+            try:
+                self.photos[index] = ImageTk.PhotoImage(future.result())
+            except Exception as e:
+                self.photos[index] = None
+                self.canvas.create_text(self.LABEL_WIDTH, y, anchor="w", text=f"Can't load: {e}", fill="red")
+                continue
+            self.canvas.create_image(self.LABEL_WIDTH, y, anchor="w", image=self.photos[index])
+        if waiting:
+            self._poll_job = self.after(self.POLL_MS, self._poll)
+    
+    def _on_click(self, event):
+        index = int(self.canvas.canvasy(event.y) // self.row_height)
+        if not 0 <= index < len(self.fonts):
+            return
+        self.selected = index
+        self.canvas.delete("selected")
+        y = index * self.row_height
+        self.canvas.tag_lower(self.canvas.create_rectangle(0, y, 4000, y + self.row_height, fill="#dbe9ff",
+                                                           outline="", tags="selected"))
+        self.status_label.configure(text=f"Using {self.fonts[index][0]}")
+        if self.on_select:
+            self.on_select(self.fonts[index][0])
+    
+    def _close(self):
+        if self._poll_job is not None:
+            self.after_cancel(self._poll_job)
+        for future in self.futures.values():
+            future.cancel()
+        self.destroy()
+
+
 class WhatsAppAutomation:
     """Handles WhatsApp Web automation using Selenium with multi-instance support."""
     
@@ -477,9 +733,11 @@ class WhatsAppAutomation:
             else:
                 # Use a command-line tool for Linux/macOS
                 import subprocess
+                import mimetypes
                 try:
                     # Try xclip for Linux
-                    subprocess.run(['xclip', '-selection', 'clipboard', '-t', 'image/png', '-i', image_path],  
+                    mime_type = mimetypes.guess_type(image_path)[0] or 'image/png'
+                    subprocess.run(['xclip', '-selection', 'clipboard', '-t', mime_type, '-i', image_path],  
                                      check=True, capture_output=True)
                     return True
                 except (subprocess.CalledProcessError, FileNotFoundError):
@@ -741,170 +999,4041 @@ class ModalProgress(ctk.CTkToplevel):
         self.close_button.configure(state="normal")
         
 
-class ModernFlyerGeneratorApp:
-    """Enhanced flyer generation application with coordinate-based positioning and improved styling."""
-    
+DEFAULT_RENDER_SETTINGS = {
+    "background": "",
+    "font_path": "arial.ttf",
+    "font_size": 36,
+    "text_color": "#000000",
+    "shadow_color": "#808080",
+    "bold": False,
+    "italic": False,
+    "underline": False,
+    "shadow": False,
+    "name_pos": (500, 1900),
+    "phone_pos": (490, 1970),
+    # "auto", "on" or "off"; see uses_large_image_mode
+    "large_image": "auto",
+    # Fonts tried in order for characters the main font has no glyph for
+    "fallback_fonts": [],
+    # Contact photos: the data column holding image paths, and the (x, y, width, height) slot
+    "photo_column": "",
+    "photo_box": None,
+    "photo_shape": "circle",
+    "photo_radius": 24,
+    # Static layers (logos, badges, fixed text) flattened into the base image; see flatten_overlays
+    "overlays": [],
+    # Wrapped text boxes filled from data columns: {"column", "box": [x, y, w, h], "align",
+    # "line_spacing", "max_lines", optional "font_size" and "color"}; see FlyerRenderer.paragraph_fields
+    "paragraphs": [],
+    # "png", "png8" (palette, see PaletteMapper), "jpeg" or "webp"; JPEG and WebP can be held
+    # under max_bytes (0 = no limit).
+    # "svg" and "html" write text documents over a shared background, see VectorFlyerWriter
+    "output_format": "png",
+    "quality": 90,
+    "max_bytes": 0,
+    "allow_downscale": False,
+    "embed_fonts": False,
+    # Pick each field's text and shadow colour from the background under it; see LuminanceTable
+    "auto_contrast": False,
+}
+
+ELLIPSIS = "\u2026"
+
+# Backgrounds above this many pixels are rendered without extra full-size copies
+LARGE_IMAGE_PIXELS = 40_000_000
+
+
+def flyer_filename(name, extension="png", suffix=""):
+    """Return the output file name used for a contact's flyer."""
+    sanitized_name = re.sub(r'[^a-zA-Z0-9]', '', name)
+    return f"{sanitized_name}_flyer{suffix}.{extension}"
+
+
+# Output formats: settings value -> (Pillow format, file extension)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "png"),
+    "png8": ("PNG", "png"),
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+}
+
+# Document formats and their extensions
+VECTOR_FORMATS = {
+    "svg": "svg",
+    "html": "html",
+}
+
+
+def output_extension(output_format):
+    """The file extension of flyers in ``output_format``."""
+    if output_format in VECTOR_FORMATS:
+        return VECTOR_FORMATS[output_format]
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return OUTPUT_FORMATS[output_format][1]
+
+
+class JpegPatcher:
+    """Encodes JPEG flyers by re-encoding only the rows their text touches.
+
+    The template (the flattened background) is encoded once as a baseline
+    JPEG with a restart marker after every row of MCUs, which makes each
+    row's entropy-coded data independent of the others. A flyer is then
+    the template's rows with just the bands under its dirty boxes encoded
+    afresh and spliced in, the restart markers renumbered to match. The
+    result is byte for byte what a full encode with restart markers would
+    give, and the background outside the text never goes through the
+    encoder again.
+    """
+
+    RESTART_MARKERS = [bytes((0xFF, 0xD0 + index)) for index in range(8)]
+    # Bands this many MCU rows apart or closer are encoded together
+    MERGE_GAP = 2
+
+    def __init__(self, background, quality):
+        self.quality = quality
+        self.size = background.size
+        self.header, self.tables, self.mcu_height, self.rows = self._parse(self._encode(background))
+
+    def _encode(self, image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.quality, restart_marker_rows=1)
+        return buffer.getvalue()
+
+    @classmethod
+    def _parse(cls, data):
+        """
+        Split a JPEG into (header, tables, MCU height, entropy-coded rows).
+        Raises ValueError unless it is a single-scan baseline JPEG with a
+        restart marker after every MCU row.
+        """
+        if data[:2] != b"\xff\xd8":
+            raise ValueError("not a JPEG")
+        offset, tables, frame, interval = 2, [], None, 0
+        while True:
+            if data[offset] != 0xFF:
+                raise ValueError("corrupt marker")
+            marker = data[offset + 1]
+            length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+            segment = data[offset:offset + 2 + length]
+            offset += 2 + length
+            if marker in (0xDB, 0xC4):
+                tables.append(segment)
+            elif marker == 0xC0:
+                frame = segment
+            elif 0xC1 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                raise ValueError("not a baseline JPEG")
+            elif marker == 0xDD:
+                interval = struct.unpack(">H", segment[4:6])[0]
+            elif marker == 0xDA:
+                break
+        if frame is None:
+            raise ValueError("no baseline frame header")
+        height, width = struct.unpack(">HH", frame[5:9])
+        factors = [frame[11 + 3 * index] for index in range(frame[9])]
+        mcu_width = 8 * max(factor >> 4 for factor in factors)
+        mcu_height = 8 * max(factor & 0x0F for factor in factors)
+        if not data.endswith(b"\xff\xd9"):
+            raise ValueError("scan does not end the file")
+        rows = re.split(b"\xff[\xd0-\xd7]", data[offset:-2])
+        if interval != -(-width // mcu_width) or len(rows) != -(-height // mcu_height):
+            raise ValueError("restart markers are not one per MCU row")
+        return data[:offset], tables, mcu_height, rows
+
+    def _bands(self, boxes):
+        """The (first, end) MCU row ranges covering ``boxes``, merged where they are close."""
+        spans = []
+        for box in boxes:
+            box = _clip_box(box, self.size)
+            if box:
+                spans.append((box[1] // self.mcu_height, -(-box[3] // self.mcu_height)))
+        bands = []
+        for first, end in sorted(spans):
+            if bands and first <= bands[-1][1] + self.MERGE_GAP:
+                bands[-1][1] = max(bands[-1][1], end)
+            else:
+                bands.append([first, end])
+        return bands
+
+    def encode(self, image, boxes):
+        """The JPEG bytes of ``image``, which must differ from the template only inside ``boxes``."""
+        rows = list(self.rows)
+        for first, end in self._bands(boxes):
+            top, bottom = first * self.mcu_height, min(self.size[1], end * self.mcu_height)
+            header, tables, _, band = self._parse(self._encode(image.crop((0, top, self.size[0], bottom))))
+            if tables != self.tables:
+                raise ValueError("band encoded with different tables")
+            rows[first:end] = band
+        parts = [self.header]
+        for index, row in enumerate(rows):
+            parts.append(row)
+            parts.append(self.RESTART_MARKERS[index % 8])
+        parts[-1] = b"\xff\xd9"
+        return b"".join(parts)
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+
+def _adler32_combine(first, second, second_length):
+    """The Adler-32 of two pieces of data joined, from each piece's checksum (as zlib's adler32_combine)."""
+    base = 65521
+    remainder = second_length % base
+    low = (first & 0xFFFF) + (second & 0xFFFF) + base - 1
+    high = remainder * (first & 0xFFFF) % base + (first >> 16) + (second >> 16) + base - remainder
+    return (high % base) << 16 | (low % base)
+
+
+class PngPatcher:
+    """Encodes PNG flyers by recompressing only the bands of rows their text touches.
+
+    The template is split into bands of BAND_ROWS scanlines. Each band is
+    filtered without looking above its first row and deflated by a fresh compressor ending in a sync flush, so its
+    compressed bytes stand alone and can follow any other band's. Every
+    band is written as its own IDAT chunk, which keeps the chunk CRCs
+    per band too; the zlib header, the closing empty block and the
+    Adler-32 (combined from per-band checksums) go in chunks of their
+    own. A flyer then only pays for filtering and deflating its dirty
+    bands.
+    """
+
+    BAND_ROWS = 16
+    LEVEL = 6
+    # Mode: (PNG colour type, bytes per pixel)
+    COLOR_TYPES = {"L": (0, 1), "LA": (4, 2), "RGB": (2, 3), "RGBA": (6, 4), "P": (3, 1)}
+    SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+    def __init__(self, background):
+        if background.mode not in self.COLOR_TYPES:
+            raise ValueError(f"no incremental PNG for {background.mode} images")
+        self.mode = background.mode
+        self.size = width, height = background.size
+        color_type, self.bytes_per_pixel = self.COLOR_TYPES[self.mode]
+        header = [self.SIGNATURE, _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))]
+        if self.mode == "P":
+            header.append(_png_chunk(b"PLTE", bytes(background.getpalette())))
+        elif background.info.get("icc_profile"):
+            # As Image.save, which carries the profile over
+            header.append(_png_chunk(b"iCCP", b"ICC Profile\0\0" + zlib.compress(background.info["icc_profile"])))
+        header.append(_png_chunk(b"IDAT", b"\x78\x9c"))
+        self.header = b"".join(header)
+        self.bands = [self._band(background, index) for index in range(-(-height // self.BAND_ROWS))]
+
+    def _filter(self, rows):
+        """
+        Filter a band's scanlines, each with whichever PNG filter leaves the smallest
+        sum of absolute values (as libpng does). The band's first row may only use
+        None or Sub, so no band ever refers to the row above it.
+        """
+        step = self.bytes_per_pixel
+        raw = rows.astype(np.int16)
+        left = np.zeros_like(raw)
+        left[:, step:] = raw[:, :-step]
+        up = np.zeros_like(raw)
+        up[1:] = raw[:-1]
+        up_left = np.zeros_like(raw)
+        up_left[1:, step:] = raw[:-1, :-step]
+        # Paeth picks whichever of left, up and up-left is closest to left + up - up_left
+        distance_left, distance_up, distance_corner = (np.abs(up - up_left), np.abs(left - up_left),
+                                                       np.abs(left + up - 2 * up_left))
+        paeth = np.where((distance_left <= distance_up) & (distance_left <= distance_corner), left,
+                         np.where(distance_up <= distance_corner, up, up_left))
+        # Filter types 0-4: None, Sub, Up, Average, Paeth
+        candidates = np.empty((5,) + raw.shape, dtype=np.uint8)
+        candidates[0] = rows
+        for kind, prediction in enumerate((left, up, (left + up) >> 1, paeth), 1):
+            np.subtract(raw, prediction, out=candidates[kind], casting="unsafe")
+        costs = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2)
+        costs[2:, 0] = np.iinfo(costs.dtype).max
+        choice = costs.argmin(axis=0)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = choice
+        filtered[:, 1:] = candidates[choice, np.arange(rows.shape[0])]
+        return filtered.tobytes()
+
+    def _band(self, image, index):
+        """The (IDAT chunk, Adler-32, length) of one band's filtered scanlines."""
+        top = index * self.BAND_ROWS
+        bottom = min(self.size[1], top + self.BAND_ROWS)
+        rows = np.asarray(image.crop((0, top, self.size[0], bottom))).reshape(bottom - top, -1)
+        data = self._filter(rows)
+        compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return _png_chunk(b"IDAT", compressed), zlib.adler32(data), len(data)
+
+    def encode(self, image, boxes):
+        """The PNG bytes of ``image``, which must differ from the template only inside ``boxes``."""
+        if image.mode != self.mode:
+            raise ValueError(f"flyer is {image.mode}, template is {self.mode}")
+        bands = list(self.bands)
+        for box in boxes:
+            box = _clip_box(box, self.size)
+            if box:
+                for index in range(box[1] // self.BAND_ROWS, -(-box[3] // self.BAND_ROWS)):
+                    if bands[index] is self.bands[index]:
+                        bands[index] = self._band(image, index)
+        checksum = 1
+        for _, adler, length in bands:
+            checksum = _adler32_combine(checksum, adler, length)
+        # An empty final block ends the deflate stream the bands left open
+        trailer = _png_chunk(b"IDAT", b"\x03\x00" + struct.pack(">I", checksum)) + _png_chunk(b"IEND", b"")
+        return b"".join([self.header] + [chunk for chunk, _, _ in bands] + [trailer])
+
+
+class PerImageCache:
+    """Values derived from an image, kept for as long as the image lives.
+
+    PIL images don't hash, so entries are keyed by the image's identity
+    (plus an optional extra key) and dropped when the image is collected.
+    """
+
     def __init__(self):
-        try:
-            ctk.set_appearance_mode("system")
-            ctk.set_default_color_theme("blue")
-        except AttributeError:
-            pass
+        self._entries = {}
+        self._lock = threading.Lock()
 
-        # Create main window
-        self.root = ctk.CTk()
-        self.root.title("Enhanced Flyer Generator with WhatsApp")
-        self.root.geometry("1500x950")
+    def get(self, image, build, extra=()):
+        """The value cached for ``image`` and ``extra``, calling ``build()`` to make it on first use."""
+        key = (id(image), extra)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is image:
+                return entry[1]
+        value = build()
+        with self._lock:
+            self._entries[key] = (weakref.ref(image), value)
+        weakref.finalize(image, self._entries.pop, key, None)
+        return value
 
-        # Configure grid layout
-        self.root.grid_columnconfigure(1, weight=1)
-        self.root.grid_rowconfigure(0, weight=1)
 
-        # State variables
-        self.bg_image_path = ctk.StringVar()
-        self.data_path = ctk.StringVar()
-        self.output_dir = ctk.StringVar()
-        
-        self.font_size = ctk.StringVar(value="36")
-        self.text_color = ctk.StringVar(value="#000000")
-        self.selected_font = ctk.StringVar()
-        
-        # Enhanced WhatsApp variables
-        self.whatsapp_message = ctk.StringVar(value="Hi {name}! Here's your personalized flyer.")
-        self.use_custom_message = ctk.BooleanVar(value=False)
-        self.image_caption = ctk.StringVar(value="Your personalized flyer!")
-        self.use_custom_caption = ctk.BooleanVar(value=False)
-        
-        # Text styling variables
-        self.text_bold = ctk.BooleanVar(value=False)
-        self.text_italic = ctk.BooleanVar(value=False)
-        self.text_underline = ctk.BooleanVar(value=False)
-        self.text_shadow = ctk.BooleanVar(value=False)
-        self.shadow_color = ctk.StringVar(value="#808080")
-        
-        self.name_x = ctk.StringVar(value="500")
-        self.name_y = ctk.StringVar(value="1900")
-        self.phone_x = ctk.StringVar(value="490")
-        self.phone_y = ctk.StringVar(value="1970")
-        
-        # WhatsApp automation - now using multi-instance manager
-        self.whatsapp_manager = WhatsAppAutomationManager(num_instances=4)  # Changed from 2 to 4
-        self.whatsapp_automation = self.whatsapp_manager.instances[0]  # For backward compatibility
-        
-        # Store the original image size for coordinate calculation
-        self.original_image_size = (0, 0)
-        self.scale_factor = 1.0
-        self.progress_modal = None
+class PaletteMapper:
+    """Maps flyers drawn on one template to an 8-bit palette.
 
-        # Define application folders
-        self.BASE_DIR = Path(__file__).parent
-        self.FONT_FOLDER = self.BASE_DIR / "fonts"
-        
-        # Create folders if they don't exist
-        self.FONT_FOLDER.mkdir(exist_ok=True)
-        
-        # Load all font files
-        self.font_options = []
-        for ext in ['*.ttf', '*.TTF', '*.otf', '*.OTF']:
-            self.font_options.extend([f.name for f in self.FONT_FOLDER.glob(ext)])
-        
-        # Add system fonts fallback
-        if not self.font_options:
-            self.font_options = ["arial.ttf", "calibri.ttf", "times.ttf", "helvetica.ttf"]
+    The palette is worked out once per template: its exact colours when
+    there are few enough (flat designs), otherwise a median-cut palette,
+    with the text colours always added as exact entries and any spare
+    entries spent on text-over-background blends. A 64x64x64
+    lookup table of the nearest entry for every colour is built with it,
+    so mapping a flyer is an array lookup over the pixels its text
+    changed, with no quantize() per flyer. Unchanged pixels keep the
+    template's own indices, so no seams appear around the text.
+    """
 
-        # Set default font
-        if self.font_options:
-            self.selected_font.set(str(self.FONT_FOLDER / self.font_options[0]))
+    LEVELS = 64
+    _mappers = PerImageCache()
+
+    def __init__(self, background, colors=()):
+        self.check(background)
+        rgb = background.convert("RGB")
+        self.rgb = np.asarray(rgb)
+        extras = list(dict.fromkeys(ImageColor.getrgb(color)[:3] for color in colors))[:64]
+        budget = 256 - len(extras)
+        counts = rgb.getcolors(budget)
+        if counts is not None:
+            palette = [color for _, color in sorted(counts, reverse=True)]
+            keys = self._keys(np.array(palette, dtype=np.int32))
+            order = np.argsort(keys)
+            # Every template pixel finds its exact entry
+            indices = order[np.searchsorted(keys[order], self._keys(self.rgb.astype(np.int32)))]
         else:
-            self.selected_font.set("arial.ttf")
+            quantized = rgb.quantize(budget, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+            used = int(np.asarray(quantized).max()) + 1
+            palette = [tuple(quantized.getpalette()[3 * index:3 * index + 3]) for index in range(used)]
+            indices = np.asarray(quantized)
+        template_colors = len(palette)
+        palette += [color for color in extras if color not in palette]
+        inks = len(palette)
+        palette += self._blends(palette, extras, 256 - len(palette))
+        self.palette = np.array(palette, dtype=np.uint8)
+        self.lookup = self._nearest_table(self.palette)
+        # Exact colours must map to themselves, whatever else shares their cell: blends
+        # give way to template colours, and those to the text colours
+        order = np.r_[inks:len(palette), :template_colors, template_colors:inks]
+        self.lookup[self._cells(self.palette[order])] = order
+        self.template = Image.fromarray(indices.astype(np.uint8), "P")
+        self.template.putpalette(self.palette.tobytes())
 
-        self._setup_ui()
-        self.root.bind("<Configure>", self._on_resize)
-        self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
+    @staticmethod
+    def check(background):
+        """Raise ValueError if ``background`` can't be given a palette (it has transparency)."""
+        if background.mode in ("RGBA", "LA") and background.getchannel("A").getextrema()[0] < 255:
+            raise ValueError("Palette (png8) output needs an opaque background; use PNG for templates with transparency.")
 
-    def _on_closing(self):
-        """Handle application closing."""
-        self.whatsapp_manager.close_all()
-        self.root.destroy()
+    @staticmethod
+    def _blends(palette, inks, count):
+        """
+        Up to ``count`` mixes of each ink with the commonest template colours, for
+        anti-aliased text edges when a flat template leaves palette entries spare.
+        """
+        blends = []
+        for fraction in (0.5, 0.25, 0.75):
+            for base in palette:
+                for ink in inks:
+                    blend = tuple(int(round(b + (i - b) * fraction)) for b, i in zip(base, ink))
+                    if blend not in palette and blend not in blends:
+                        blends.append(blend)
+        return blends[:count]
 
-    def _load_background_image(self):
-        """Opens a file dialog for the user to select a background image."""
-        file_path = filedialog.askopenfilename(
-            filetypes=[("Image files", "*.jpg *.jpeg *.png *.gif *.bmp")]
-        )
-        if file_path:
-            self.bg_image_path.set(file_path)
-            self._update_preview()
-    
-    def _load_data_file(self):
-        """Opens a file dialog to select a data file (CSV or XLSX)."""
-        file_path = filedialog.askopenfilename(
-            filetypes=[("Data files", "*.csv *.xlsx")]
-        )
-        if file_path:
-            self.data_path.set(file_path)
-    
-    def _select_output_dir(self):
-        """Opens a directory dialog for the user to select an output folder."""
-        dir_path = filedialog.askdirectory()
-        if dir_path:
-            self.output_dir.set(dir_path)
-    
-    def _choose_color(self):
-        """Opens a color chooser dialog for selecting the text color."""
-        color = colorchooser.askcolor(title="Choose text color")[1]
-        if color:
-            self.text_color.set(color)
-            self._update_preview()
-    
-    def _choose_shadow_color(self):
-        """Opens a color chooser dialog for selecting the shadow color."""
-        color = colorchooser.askcolor(title="Choose shadow color")[1]
-        if color:
-            self.shadow_color.set(color)
-            self._update_preview()
-    
-    def _on_resize(self, event):
-        """Handles window resizing by updating the flyer preview."""
-        if self.bg_image_path.get():
-            self._update_preview()
-    
-    def _update_coordinates(self):
-        """Update preview when coordinates change."""
-        self._update_preview()
-    
-    def _update_preview(self):
+    @staticmethod
+    def _keys(colors):
+        return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+    @classmethod
+    def _nearest_table(cls, palette):
+        """For every cell of the lookup grid, the index of the nearest palette entry."""
+        step = 256 // cls.LEVELS
+        levels = np.arange(cls.LEVELS, dtype=np.float32) * step + step / 2
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 3)
+        entries = palette.astype(np.float32)
+        norms = (entries * entries).sum(axis=1)
+        table = np.empty(len(grid), dtype=np.uint8)
+        for start in range(0, len(grid), 16384):
+            cells = grid[start:start + 16384]
+            # |cell - entry|^2 without the |cell|^2 term, which is the same for every entry
+            table[start:start + 16384] = (norms - 2 * cells @ entries.T).argmin(axis=1)
+        return table
+
+    @classmethod
+    def of(cls, background, colors=()):
+        """The mapper for a template and text colours, built on first use and kept while the template lives."""
+        return cls._mappers.get(background, lambda: cls(background, colors), tuple(colors))
+
+    def _cells(self, pixels):
+        levels = pixels.astype(np.int32) // (256 // self.LEVELS)
+        return (levels[..., 0] * self.LEVELS + levels[..., 1]) * self.LEVELS + levels[..., 2]
+
+    def _lookup(self, pixels):
+        return self.lookup[self._cells(pixels)]
+
+    def map(self, image, boxes=None):
         """
-        Updates the preview image on the canvas by drawing a full preview
-        image in memory using PIL and then displaying it.
+        The P image of a flyer drawn on the template. With ``boxes`` (where the flyer
+        may differ from the template) only those regions are looked up.
         """
-        if not self.bg_image_path.get() or not os.path.exists(self.bg_image_path.get()):
-            self.status_label.configure(text="Please select a background image.", text_color="orange")
+        if image.size != self.template.size:
+            indexed = Image.fromarray(self._lookup(np.asarray(image.convert("RGB"))), "P")
+            indexed.putpalette(self.palette.tobytes())
+            return indexed
+        if boxes is None:
+            boxes = [(0, 0) + image.size]
+        indexed = self.template.copy()
+        for box in boxes:
+            box = _clip_box(box, image.size)
+            if not box:
+                continue
+            left, top, right, bottom = box
+            pixels = np.asarray(image.crop(box).convert("RGB"))
+            changed = (pixels != self.rgb[top:bottom, left:right]).any(axis=-1)
+            if changed.any():
+                current = np.asarray(indexed.crop(box))
+                indexed.paste(Image.fromarray(np.where(changed, self._lookup(pixels), current), "P"), box[:2])
+        return indexed
+
+
+class FlyerEncoder:
+    """Encodes flyers as PNG, JPEG or WebP, the last two optionally under a byte limit.
+
+    With ``max_bytes`` each flyer gets the highest quality (up to
+    ``quality``) that fits, found by binary search. Flyers from one
+    template compress alike, so the search starts from the quality that
+    worked for the previous flyer: usually one encode confirms it, and
+    a fuller search only runs when a flyer no longer fits or fits with
+    plenty of room to spare. Without a limit it is a plain encode.
+
+    After ``prepare`` with the template, flyers whose dirty boxes are known
+    go through a PngPatcher or JpegPatcher instead, as long as a patched
+    JPEG meets the limit. Palette PNGs ("png8") are mapped through the
+    template's PaletteMapper first.
+    """
+
+    MIN_QUALITY = 20
+    # Encodes this far under the limit try a higher quality again
+    HEADROOM = 0.9
+    DOWNSCALE_ATTEMPTS = 4
+
+    def __init__(self, output_format="jpeg", quality=90, max_bytes=0, allow_downscale=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.format = OUTPUT_FORMATS[output_format][0]
+        if self.format == "PNG" and max_bytes:
+            raise ValueError("A maximum file size needs JPEG or WebP output.")
+        self.palette = output_format == "png8"
+        self.mapper = None
+        self.quality = min(100, max(self.MIN_QUALITY, int(quality)))
+        self.max_bytes = int(max_bytes or 0)
+        self.allow_downscale = allow_downscale
+        self.start = self.quality
+        # Relative growth in bytes per quality step, refined by every search
+        self.slope = 0.04
+        self.flyers = 0
+        self.encodes = 0
+        self.patcher = None
+        self.patched = 0
+
+    def prepare(self, background, colors=()):
+        """
+        Encode the template ``background`` once for patching flyers drawn on it (see
+        PngPatcher and JpegPatcher); ``colors`` are the text colours palette output must
+        include. Must be called before anything is drawn on ``background``. WebP, or a
+        template that can't be patched, keeps full encodes.
+        """
+        self.patcher = None
+        if self.palette:
+            self.mapper = PaletteMapper.of(background, colors)
+            background = self.mapper.template
+        if self.format not in ("PNG", "JPEG"):
+            return
+        try:
+            patcher = PngPatcher(background) if self.format == "PNG" else JpegPatcher(background, self.quality)
+        except (ValueError, OSError, IndexError, struct.error) as e:
+            print(f"{self.format} patching unavailable ({e}); encoding every flyer in full.")
+            return
+        if self.format == "PNG":
+            self.patcher = patcher
             return
+        template_bytes = len(patcher.header) + sum(len(row) + 2 for row in patcher.rows)
+        if not self.max_bytes or template_bytes <= self.max_bytes * self.HEADROOM:
+            self.patcher = patcher
 
+    @classmethod
+    def from_settings(cls, settings):
+        """The encoder for a settings dictionary, or None for document output."""
+        if settings["output_format"] in VECTOR_FORMATS:
+            if settings["max_bytes"]:
+                raise ValueError("A maximum file size needs JPEG or WebP output.")
+            return None
+        return cls(settings["output_format"], settings["quality"], settings["max_bytes"], settings["allow_downscale"])
+
+    def _encode(self, image, quality):
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.format, quality=quality)
+        self.encodes += 1
+        return buffer.getvalue()
+
+    def _search(self, image, fits, fails, failed_size=None, step=1):
+        """
+        The highest quality that fits, as (quality, data), or None. ``fits`` is a
+        (quality, data) known to fit, or None; ``fails`` is a quality known not to fit
+        (of ``failed_size`` bytes), or one above the maximum. The first probe is
+        ``step`` away from the known point, then strides double until the answer is
+        bracketed and bisected.
+        """
+        while fits is None:
+            quality = max(self.MIN_QUALITY, fails - step)
+            data = self._encode(image, quality)
+            if len(data) <= self.max_bytes:
+                fits, step = (quality, data), 1
+            elif quality == self.MIN_QUALITY:
+                return None
+            else:
+                fails, failed_size, step = quality, len(data), step * 2
+        galloping, next_step = True, 1
+        while fits[0] + 1 < fails:
+            quality = min(fits[0] + step, fails - 1) if galloping else (fits[0] + fails) // 2
+            data = self._encode(image, quality)
+            if len(data) <= self.max_bytes:
+                fits = (quality, data)
+                step, next_step = next_step, next_step * 2
+            else:
+                fails, failed_size, galloping = quality, len(data), False
+        if failed_size:
+            # Bytes grow roughly exponentially with quality; remember the rate for the next estimate
+            slope = math.log(failed_size / len(fits[1])) / (fails - fits[0])
+            self.slope = min(0.3, max(0.002, slope))
+        return fits
+
+    def encode(self, image, boxes=None):
+        """
+        Return the encoded bytes of one flyer; raises ValueError if it can't be made to fit.
+        ``boxes`` are the regions where ``image`` differs from the prepared template, if known.
+        """
+        self.flyers += 1
+        if self.palette:
+            if self.mapper is None:
+                self.mapper = PaletteMapper(image)
+            image = self.mapper.map(image, boxes)
+        if self.patcher is not None and boxes is not None and image.size == self.patcher.size:
+            try:
+                data = self.patcher.encode(image, boxes)
+            except (ValueError, OSError, IndexError, struct.error) as e:
+                print(f"{self.format} patching failed ({e}); encoding every flyer in full.")
+                self.patcher = None
+            else:
+                self.encodes += 1
+                if not self.max_bytes or len(data) <= self.max_bytes:
+                    self.patched += 1
+                    return data
+        if self.format == "PNG":
+            # Alpha and all, as Image.save would write it
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            self.encodes += 1
+            return buffer.getvalue()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if not self.max_bytes:
+            return self._encode(image, self.quality)
+
+        for _ in range(self.DOWNSCALE_ATTEMPTS + 1):
+            data = self._encode(image, self.start)
+            if len(data) > self.max_bytes:
+                step = math.ceil(math.log(len(data) / self.max_bytes) / self.slope)
+                found = self._search(image, None, self.start, len(data), max(1, step))
+            elif len(data) < self.max_bytes * self.HEADROOM and self.start < self.quality:
+                step = int(math.log(self.max_bytes / len(data)) / self.slope)
+                found = self._search(image, (self.start, data), self.quality + 1, step=max(1, step))
+            else:
+                found = (self.start, data)
+            if found is not None:
+                self.start = found[0]
+                return found[1]
+            if not self.allow_downscale:
+                break
+            # Pixels, and roughly bytes, shrink with the square of the scale
+            smallest = self._encode(image, self.MIN_QUALITY)
+            scale = min(0.95, (self.max_bytes / len(smallest)) ** 0.5 * 0.95)
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                 Image.Resampling.LANCZOS)
+            self.start = self.quality
+        raise ValueError(f"could not fit under {self.max_bytes} bytes"
+                         + ("" if self.allow_downscale else "; allow downscaling or raise the limit"))
+
+
+def save_flyer(image, path, encoder=None, boxes=None):
+    """
+    Write a flyer image, first detaching ``path`` if it is a hard link shared with other flyers.
+    With an ``encoder`` (see FlyerEncoder.from_settings) the file is written in its format;
+    ``boxes``, the regions drawn on the template, let it patch rather than re-encode.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    if encoder is None:
+        image.save(path)
+        return
+    data = encoder.encode(image, boxes)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _reflink(source, target):
+    """Clone ``source`` into ``target`` sharing data blocks (Linux btrfs/XFS only)."""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def materialize_duplicate(source, target, mode):
+    """
+    Make ``target`` hold the same flyer as ``source`` and return the method used.
+    Hard links and reflinks fall back to a plain copy where the filesystem refuses them.
+    """
+    if mode == "index":
+        return "index"
+    if os.path.lexists(target):
+        os.remove(target)
+    if mode == "hardlink":
         try:
-            # Create a temporary image with the preview data, just like the final flyer
-            preview_image = self._draw_flyer("Coreprix", "+91 90000 XXXXX")
-            if not preview_image:
-                self.status_label.configure(text="Failed to generate preview image.", text_color="red")
-                return
+            os.link(source, target)
+            return "hardlink"
+        except OSError:
+            pass
+    elif mode == "reflink":
+        try:
+            _reflink(source, target)
+            return "reflink"
+        except (OSError, ImportError):
+            if os.path.lexists(target):
+                os.remove(target)
+    shutil.copyfile(source, target)
+    return "copy"
 
-            canvas_width = self.preview_canvas.winfo_width()
-            canvas_height = self.preview_canvas.winfo_height()
 
-            if canvas_width <= 1 or canvas_height <= 1:
-                self.root.after(50, self._update_preview)
-                return
+@lru_cache(maxsize=4)
+def _load_background_cached(path, mtime, size):
+    return Image.open(path).convert("RGBA")
 
-            img_width, img_height = preview_image.size
-            self.scale_factor = min(canvas_width / img_width, canvas_height / img_height)
-            new_width = int(img_width * self.scale_factor)
-            new_height = int(img_height * self.scale_factor)
-            
-            # Resize the pre-rendered Pillow image to fit the canvas
-            resized_preview_image = preview_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convert to a format Tkinter can display
+
+def load_background(path):
+    """Decode a background image once and reuse it until the file changes.
+
+    The returned image is shared between callers and must be treated as read-only.
+    """
+    stat = os.stat(path)
+    return _load_background_cached(os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def image_size(path):
+    """Return an image's (width, height) from its header without decoding pixels."""
+    with Image.open(path) as image:
+        return image.size
+
+
+def uses_large_image_mode(settings):
+    """Whether a batch should render in large-image mode (see LARGE_IMAGE_PIXELS)."""
+    mode = settings.get("large_image", "auto")
+    if mode in ("on", "off"):
+        return mode == "on"
+    width, height = image_size(settings["background"])
+    return width * height > LARGE_IMAGE_PIXELS
+
+
+def decode_background(path):
+    """Decode a background once, uncached and in the file's own colour mode.
+
+    Large-image batches publish the result with MappedBackground, which
+    converts it band by band, so no second full-size copy is ever made.
+    """
+    with Image.open(path) as image:
+        image.load()
+        return image
+
+
+@lru_cache(maxsize=8)
+def _load_preview_cached(path, mtime, file_size, size):
+    with Image.open(path) as image:
+        # Let the JPEG decoder scale down by a power of two while decoding
+        image.draft("RGB", size)
+        return image.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
+
+
+def load_preview_background(path, size):
+    """Decode a background straight to preview size without a full-resolution copy."""
+    stat = os.stat(path)
+    return _load_preview_cached(os.path.abspath(path), stat.st_mtime, stat.st_size, tuple(size))
+
+
+OVERLAY_TYPES = ("image", "text")
+
+
+def template_files(settings):
+    """Every file a template's flyers depend on, besides the data file."""
+    files = [settings["background"], settings["font_path"], *settings["fallback_fonts"]]
+    for layer in settings.get("overlays") or []:
+        files += [layer[key] for key in ("path", "font_path") if layer.get(key)]
+    return files
+
+
+def flatten_overlays(image, settings, scale=1.0):
+    """
+    Composite the static overlay layers of ``settings`` onto ``image`` in place and return it.
+
+    Each layer is a dict. Image layers: {"type": "image", "path", "position": [x, y],
+    optional "size": [w, h] and "opacity": 0-1}. Text layers: {"type": "text", "text",
+    "position": [x, y], optional "font_path", "font_size" and "color", which default
+    to the flyer's own font and colour}. ``scale`` draws them for a resized background.
+    """
+    draw = None
+    for layer in settings.get("overlays") or []:
+        kind = layer.get("type", "image")
+        x, y = (int(round(value * scale)) for value in layer["position"])
+        if kind == "image":
+            with Image.open(layer["path"]) as source:
+                overlay = source.convert("RGBA")
+            width, height = layer.get("size") or overlay.size
+            size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+            if size != overlay.size:
+                overlay = overlay.resize(size, Image.Resampling.LANCZOS)
+            opacity = layer.get("opacity", 1.0)
+            if opacity < 1:
+                overlay.putalpha(overlay.getchannel("A").point(lambda alpha: int(alpha * opacity)))
+            if image.mode == "RGBA":
+                # Keeps the base opaque, unlike paste() with a mask
+                image.alpha_composite(overlay, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
+            else:
+                image.paste(overlay, (x, y), overlay)
+        elif kind == "text":
+            font_size = max(1, int(round(layer.get("font_size", settings["font_size"]) * scale)))
+            font = ImageFont.truetype(layer.get("font_path") or settings["font_path"], font_size)
+            draw = draw or ImageDraw.Draw(image)
+            draw.text((x, y), layer["text"], font=font, fill=layer.get("color") or settings["text_color"])
+        else:
+            raise ValueError(f"Unknown overlay type: {kind}")
+    return image
+
+
+@lru_cache(maxsize=4)
+def _load_base_cached(key):
+    settings, size = json.loads(key)[:2]
+    if size is None:
+        base, scale = load_background(settings["background"]).copy(), 1.0
+    else:
+        base = load_preview_background(settings["background"], size).copy()
+        scale = size[0] / image_size(settings["background"])[0]
+    return flatten_overlays(base, settings, scale)
+
+
+def load_base_image(settings, size=None):
+    """
+    The background with the template's static overlays flattened on, at full size or
+    at preview ``size``. Flattening happens once per template and is cached until a
+    layer or file changes, so overlays add nothing to the cost of each flyer.
+    The returned image is shared and must be treated as read-only.
+    """
+    if not settings.get("overlays"):
+        if size is None:
+            return load_background(settings["background"])
+        return load_preview_background(settings["background"], size)
+    relevant = {key: settings[key] for key in ("background", "overlays", "font_path", "font_size", "text_color")}
+    signatures = [(os.path.getmtime(path), os.path.getsize(path)) if os.path.exists(path) else None
+                  for path in template_files(settings)]
+    return _load_base_cached(json.dumps([relevant, size and list(size), signatures], sort_keys=True))
+
+
+# Unicode blocks whose scripts need shaping, with the language tag raqm should use
+COMPLEX_SCRIPTS = (
+    (0x0590, 0x05FF, "he"),
+    (0x0600, 0x06FF, "ar"),
+    (0x0750, 0x077F, "ar"),
+    (0x0900, 0x097F, "hi"),
+    (0x0980, 0x09FF, "bn"),
+    (0x0A00, 0x0A7F, "pa"),
+    (0x0A80, 0x0AFF, "gu"),
+    (0x0B00, 0x0B7F, "or"),
+    (0x0B80, 0x0BFF, "ta"),
+    (0x0C00, 0x0C7F, "te"),
+    (0x0C80, 0x0CFF, "kn"),
+    (0x0D00, 0x0D7F, "ml"),
+    (0x0D80, 0x0DFF, "si"),
+    (0xFB50, 0xFDFF, "ar"),
+    (0xFE70, 0xFEFF, "ar"),
+)
+
+# Letters used in Urdu but not in Arabic, to tell the two apart
+URDU_LETTERS = frozenset("ٹڈڑںےۓہھ")
+
+HAS_RAQM = features.check_feature("raqm")
+_warned_no_raqm = False
+
+
+@lru_cache(maxsize=65536)
+def text_layout(text):
+    """
+    Return the (direction, language) that ``text`` should be shaped with, or
+    None when basic layout renders it correctly (Latin and other simple scripts).
+    """
+    if text.isascii():
+        return None
+    direction = "ltr"
+    language = None
+    for char in text:
+        code = ord(char)
+        if code < 0x0590:
+            continue
+        if language is None:
+            for first, last, tag in COMPLEX_SCRIPTS:
+                if first <= code <= last:
+                    language = tag
+                    break
+        if unicodedata.bidirectional(char) in ("R", "AL"):
+            direction = "rtl"
+    if language is None and direction == "ltr":
+        return None
+    if language == "ar" and not URDU_LETTERS.isdisjoint(text):
+        language = "ur"
+    return direction, language
+
+
+class ShapedRunCache:
+    """Rasterized text runs keyed by (font, size, text, direction, language).
+
+    Bold and shadow draw the same run several times per flyer and sheets
+    repeat names, so each run is shaped and rasterized once and then pasted.
+    The cache is bounded by the total size of the stored masks.
+    """
+
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, font, text, layout=None):
+        """
+        Return (mask, bbox) for a run: an "L" coverage mask and its box relative
+        to the text origin. ``layout`` is a (direction, language) pair or None.
+        """
+        key = (getattr(font, "path", id(font)), getattr(font, "size", None),
+               getattr(font, "layout_engine", None), text, layout)
+        with self._lock:
+            run = self._runs.get(key)
+            if run is not None:
+                self._runs.move_to_end(key)
+                return run
+
+        options = {} if layout is None else {"direction": layout[0], "language": layout[1]}
+        left, top, right, bottom = font.getbbox(text, **options)
+        mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font, **options)
+        run = (mask, (left, top, right, bottom))
+
+        with self._lock:
+            if key not in self._runs:
+                self._runs[key] = run
+                self.size += mask.width * mask.height
+                while self.size > self.max_bytes and len(self._runs) > 1:
+                    old_mask, _ = self._runs.popitem(last=False)[1]
+                    self.size -= old_mask.width * old_mask.height
+        return run
+
+
+# Shared by every renderer in the process, so runs survive setting changes such as a moved field
+SHAPED_RUNS = ShapedRunCache()
+
+
+def _cmap_format4(data, start, covered):
+    seg_count = struct.unpack_from(">H", data, start + 6)[0] // 2
+    ends = struct.unpack_from(f">{seg_count}H", data, start + 14)
+    starts = struct.unpack_from(f">{seg_count}H", data, start + 16 + 2 * seg_count)
+    deltas = struct.unpack_from(f">{seg_count}h", data, start + 16 + 4 * seg_count)
+    range_offsets_at = start + 16 + 6 * seg_count
+    range_offsets = struct.unpack_from(f">{seg_count}H", data, range_offsets_at)
+    for i in range(seg_count):
+        first, last = starts[i], ends[i]
+        if first > last or first == 0xFFFF:
+            continue
+        codes = np.arange(first, last + 1)
+        if range_offsets[i] == 0:
+            glyphs = (codes + deltas[i]) & 0xFFFF
+        else:
+            # Glyph ids are read relative to this segment's idRangeOffset entry
+            glyphs_at = range_offsets_at + 2 * i + range_offsets[i]
+            glyphs = np.frombuffer(data, dtype=">u2", count=len(codes), offset=glyphs_at).astype(np.int64)
+            glyphs = np.where(glyphs != 0, (glyphs + deltas[i]) & 0xFFFF, 0)
+        covered[codes[glyphs != 0]] = True
+
+
+def _cmap_format12(data, start, covered):
+    groups = struct.unpack_from(">I", data, start + 12)[0]
+    for i in range(groups):
+        first, last, glyph = struct.unpack_from(">III", data, start + 16 + 12 * i)
+        last = min(last, len(covered) - 1)
+        if glyph == 0:
+            # The first code point maps to .notdef
+            first += 1
+        if first <= last:
+            covered[first:last + 1] = True
+
+
+def read_cmap_coverage(path):
+    """
+    Read a TrueType/OpenType font's Unicode cmap (formats 4 and 12) and return
+    a bitset with one bit per code point, set for every character with a glyph.
+    Collections (.ttc) are read from their first face.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    font_at = struct.unpack_from(">I", data, 12)[0] if data[:4] == b"ttcf" else 0
+    table_count = struct.unpack_from(">H", data, font_at + 4)[0]
+    cmap_at = None
+    for i in range(table_count):
+        tag, _, table_at, _ = struct.unpack_from(">4sIII", data, font_at + 12 + 16 * i)
+        if tag == b"cmap":
+            cmap_at = table_at
+    if cmap_at is None:
+        raise ValueError(f"{os.path.basename(path)} has no cmap table")
+
+    covered = np.zeros(0x110000, dtype=bool)
+    subtable_count = struct.unpack_from(">H", data, cmap_at + 2)[0]
+    for i in range(subtable_count):
+        platform, encoding, offset = struct.unpack_from(">HHI", data, cmap_at + 4 + 8 * i)
+        if platform != 0 and not (platform == 3 and encoding in (1, 10)):
+            continue
+        start = cmap_at + offset
+        table_format = struct.unpack_from(">H", data, start)[0]
+        if table_format == 4:
+            _cmap_format4(data, start, covered)
+        elif table_format == 12:
+            _cmap_format12(data, start, covered)
+    return np.packbits(covered, bitorder="little").tobytes()
+
+
+class FontCoverage:
+    """Which code points a font has glyphs for, as a compact bitset.
+
+    The bitset is built from the font's cmap once and cached on disk,
+    zlib-compressed and keyed by the font file's path, size and mtime, so
+    later runs answer coverage questions without parsing or rendering.
+    """
+
+    CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "flyer_automation", "font_coverage")
+
+    def __init__(self, bits):
+        self.bits = bits
+
+    def covers(self, char):
+        code = ord(char)
+        return bool(self.bits[code >> 3] >> (code & 7) & 1)
+
+    def missing(self, text):
+        """Return the characters of ``text`` this font has no glyph for."""
+        return {char for char in text if not self.covers(char)}
+
+    @classmethod
+    def build(cls, path, mtime_ns, size):
+        key = hashlib.sha1(f"{path}|{mtime_ns}|{size}".encode("utf-8")).hexdigest()[:20]
+        cache_path = os.path.join(cls.CACHE_DIR, f"{key}.cov")
+        try:
+            with open(cache_path, "rb") as f:
+                return cls(zlib.decompress(f.read()))
+        except (OSError, zlib.error):
+            pass
+        bits = read_cmap_coverage(path)
+        try:
+            os.makedirs(cls.CACHE_DIR, exist_ok=True)
+            with open(cache_path, "wb") as f:
+                f.write(zlib.compress(bits, 9))
+        except OSError:
+            # A read-only home only costs a cmap parse per process
+            pass
+        return cls(bits)
+
+
+@lru_cache(maxsize=32)
+def _font_coverage_cached(path, mtime_ns, size):
+    return FontCoverage.build(path, mtime_ns, size)
+
+
+def font_coverage(path):
+    """Return the FontCoverage of a font file, read once per process and cached on disk."""
+    stat = os.stat(path)
+    return _font_coverage_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def uncovered_characters(text, coverages):
+    """Return the characters of ``text`` that none of the given FontCoverage objects has."""
+    missing = {char for char in text if not char.isspace()}
+    for coverage in coverages:
+        if not missing:
+            break
+        missing = coverage.missing(missing)
+    return missing
+
+
+class PhotoSlotCache:
+    """Contact photos fitted and masked to the photo slot.
+
+    Each source is decoded once (JPEG draft mode lets the decoder skip most
+    of a large photo's pixels), fitted to the slot and masked. Results are
+    kept in an in-memory LRU and on disk, keyed by a hash of the source
+    file plus the slot geometry, so rows sharing a photo or logo only pay
+    for a paste.
+    """
+
+    CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "flyer_automation", "photo_slots")
+    MEMORY_SLOTS = 256
+    SHAPES = ("circle", "rounded")
+    # Masks are drawn this many times larger and scaled down for smooth edges
+    SUPERSAMPLE = 4
+
+    def __init__(self, size, shape="circle", radius=24, cache_dir=None):
+        if shape not in self.SHAPES:
+            raise ValueError(f"Unknown photo shape: {shape}")
+        self.size = (max(1, int(size[0])), max(1, int(size[1])))
+        self.shape = shape
+        self.radius = max(0, int(radius))
+        self.cache_dir = cache_dir or self.CACHE_DIR
+        self.mask = self._make_mask()
+        self._slots = OrderedDict()
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def _make_mask(self):
+        width, height = self.size
+        scale = self.SUPERSAMPLE
+        mask = Image.new("L", (width * scale, height * scale), 0)
+        draw = ImageDraw.Draw(mask)
+        if self.shape == "circle":
+            draw.ellipse((0, 0, width * scale - 1, height * scale - 1), fill=255)
+        else:
+            draw.rounded_rectangle((0, 0, width * scale - 1, height * scale - 1), radius=self.radius * scale, fill=255)
+        return mask.resize(self.size, Image.Resampling.LANCZOS)
+
+    def _source_hash(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            sha = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            digest = self._hashes[key] = sha.hexdigest()
+        return digest
+
+    def get(self, path):
+        """Return the slot image (RGBA, slot-sized) for a source photo."""
+        digest = self._source_hash(path)
+        key = f"{digest}_{self.size[0]}x{self.size[1]}_{self.shape}_{self.radius}"
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                self._slots.move_to_end(key)
+                return slot
+
+        cache_path = os.path.join(self.cache_dir, f"{key}.png")
+        try:
+            with Image.open(cache_path) as cached:
+                slot = cached.convert("RGBA")
+        except OSError:
+            slot = self._compose(path)
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Write then rename so concurrent workers never read a partial file
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"
+                slot.save(temp_path, format="PNG")
+                os.replace(temp_path, cache_path)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._slots[key] = slot
+            while len(self._slots) > self.MEMORY_SLOTS:
+                self._slots.popitem(last=False)
+        return slot
+
+    def _compose(self, path):
+        with Image.open(path) as source:
+            source.draft("RGB", self.size)
+            source = ImageOps.exif_transpose(source).convert("RGBA")
+        slot = ImageOps.fit(source, self.size, Image.Resampling.LANCZOS)
+        slot.putalpha(ImageChops.multiply(slot.getchannel("A"), self.mask))
+        return slot
+
+    def placeholder(self):
+        """A grey slot for previews, where no contact photo is available."""
+        slot = Image.new("RGBA", self.size, (190, 190, 190, 255))
+        slot.putalpha(self.mask)
+        return slot
+
+
+def _union_box(boxes):
+    """Return the smallest box containing all given (left, top, right, bottom) boxes."""
+    boxes = [box for box in boxes if box]
+    if not boxes:
+        return None
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+class RowFilter:
+    """A row filter such as ``city == 'Pune' and segment in ('gold', 'silver')``.
+
+    The expression uses Python syntax but only column names, string and number
+    literals, comparisons, ``in``/``not in`` and ``and``/``or``/``not`` are
+    allowed. Sources push it down: SQLite gets it as a WHERE clause, Parquet
+    row groups whose statistics rule it out are skipped, and CSV/XLSX rows are
+    masked while reading. Every source shares one reading of a cell: its text
+    with surrounding spaces trimmed, and for number literals the number that
+    text spells. Missing values and blank cells behave like SQL NULL, as does
+    text that is not a number in a numeric comparison, so they never match a
+    comparison, negated or not.
+    """
+
+    OPERATORS = {ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=",
+                 ast.In: "in", ast.NotIn: "not in"}
+    SQL_OPERATORS = {"==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">=", "in": "IN", "not in": "NOT IN"}
+    FLIPPED = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+    # Cells read as numbers: digits with an optional sign, point and exponent
+    NUMBER_CHARS = "0-9.eE+-"
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        try:
+            tree = ast.parse(self.expression, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid filter {expression!r}: {e.msg}")
+        self.tree = self._parse(tree.body)
+        self.columns = sorted(self._columns(self.tree))
+
+    def __repr__(self):
+        return f"RowFilter({self.expression!r})"
+
+    def _literal(self, node):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            value = self._literal(node.operand)
+            if isinstance(value, str):
+                raise ValueError(f"Invalid filter {self.expression!r}: cannot negate a string")
+            return -value
+        if isinstance(node, ast.Constant) and type(node.value) in (str, int, float):
+            return node.value
+        raise ValueError(f"Invalid filter {self.expression!r}: expected a string or number, "
+                         f"got {ast.unparse(node)!r}")
+
+    def _parse(self, node):
+        """Turn the syntax tree into ("and"|"or", parts), ("not", part) or ("cmp", column, op, value)."""
+        if isinstance(node, ast.BoolOp):
+            return ("and" if isinstance(node.op, ast.And) else "or", [self._parse(value) for value in node.values])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return ("not", self._parse(node.operand))
+        if isinstance(node, ast.Compare):
+            # a < b < c means a < b and b < c
+            operands = [node.left] + node.comparators
+            parts = [self._comparison(left, op, right)
+                     for left, op, right in zip(operands, node.ops, operands[1:])]
+            return parts[0] if len(parts) == 1 else ("and", parts)
+        raise ValueError(f"Invalid filter {self.expression!r}: unsupported expression {ast.unparse(node)!r}")
+
+    def _comparison(self, left, op, right):
+        op = self.OPERATORS.get(type(op))
+        if op is None:
+            raise ValueError(f"Invalid filter {self.expression!r}: use ==, !=, <, <=, >, >=, in or not in")
+        if op in ("in", "not in"):
+            if not isinstance(left, ast.Name) or not isinstance(right, (ast.Tuple, ast.List, ast.Set)):
+                raise ValueError(f"Invalid filter {self.expression!r}: write 'column in (value, ...)'")
+            return ("cmp", left.id.lower(), op, tuple(self._literal(value) for value in right.elts))
+        if isinstance(right, ast.Name) and not isinstance(left, ast.Name):
+            left, right, op = right, left, self.FLIPPED[op]
+        if not isinstance(left, ast.Name):
+            raise ValueError(f"Invalid filter {self.expression!r}: each comparison needs a column name")
+        return ("cmp", left.id.lower(), op, self._literal(right))
+
+    def _columns(self, node):
+        if node[0] == "cmp":
+            return {node[1]}
+        parts = node[1] if node[0] in ("and", "or") else [node[1]]
+        return set().union(*(self._columns(part) for part in parts))
+
+    def check_columns(self, columns):
+        """Raise ValueError if the filter names a column that ``columns`` lacks."""
+        missing = [column for column in self.columns if column not in set(columns)]
+        if missing:
+            raise ValueError(f"Filter column(s) {', '.join(missing)} not found. "
+                             f"Available columns: {', '.join(columns)}")
+
+    def to_sql(self, node=None):
+        """The filter as an SQL condition with ? placeholders; returns (clause, parameters)."""
+        node = self.tree if node is None else node
+        if node[0] == "cmp":
+            _, column, op, value = node
+            name = '"' + column.replace('"', '""') + '"'
+            text = f"NULLIF(TRIM({name}), '')"
+            number = (f"CASE WHEN {text} GLOB '*[0-9]*' AND {text} NOT GLOB '*[^{self.NUMBER_CHARS}]*' "
+                      f"THEN CAST({text} AS REAL) END")
+            if op in ("in", "not in"):
+                # NULL for a missing cell, so that NOT keeps it out as well
+                numbers = [literal for literal in value if not isinstance(literal, str)]
+                strings = [literal for literal in value if isinstance(literal, str)]
+                tests = [f"COALESCE({expression} IN ({', '.join('?' * len(literals))}), 0)"
+                         for expression, literals in ((number, numbers), (text, strings)) if literals]
+                found = " OR ".join(tests) or "0"
+                if op == "not in":
+                    found = f"NOT ({found})"
+                return f"CASE WHEN {text} IS NOT NULL THEN {found} END", numbers + strings
+            expression = text if isinstance(value, str) else number
+            return f"{expression} {self.SQL_OPERATORS[op]} ?", [value]
+        if node[0] == "not":
+            clause, parameters = self.to_sql(node[1])
+            return f"NOT ({clause})", parameters
+        clauses, parameters = [], []
+        for part in node[1]:
+            clause, values = self.to_sql(part)
+            clauses.append(f"({clause})")
+            parameters += values
+        return f" {node[0].upper()} ".join(clauses), parameters
+
+    @staticmethod
+    def _compare(values, op, value):
+        if op == "==":
+            return values == value
+        if op == "!=":
+            return values != value
+        if op == "<":
+            return values < value
+        if op == "<=":
+            return values <= value
+        if op == ">":
+            return values > value
+        return values >= value
+
+    def _evaluate(self, node, df):
+        """Three-valued evaluation: returns (matches, known) boolean arrays, unknown being SQL NULL."""
+        if node[0] == "cmp":
+            _, column, op, value = node
+            values = df[column]
+            is_numeric = pd.api.types.is_numeric_dtype(values)
+            text = values.astype(str).str.strip()
+            present = values.notna().to_numpy()
+            if not is_numeric:
+                # CSV is read without NA parsing, so its empty cells arrive as blank text
+                present &= (text != "").to_numpy()
+            literals = value if op in ("in", "not in") else (value,)
+            numbers = [literal for literal in literals if not isinstance(literal, str)]
+            strings = [literal for literal in literals if isinstance(literal, str)]
+            # Numbers compare with the numeric reading of a cell, strings with its text
+            numeric = None
+            if numbers and is_numeric:
+                numeric = values
+            elif numbers:
+                looks_numeric = text.str.fullmatch(f"[{self.NUMBER_CHARS}]*[0-9][{self.NUMBER_CHARS}]*")
+                numeric = pd.to_numeric(text.where(looks_numeric), errors="coerce")
+            if op in ("in", "not in"):
+                matches = np.zeros(len(df), dtype=bool)
+                if numbers:
+                    matches |= numeric.isin(numbers).to_numpy()
+                if strings:
+                    matches |= text.isin(strings).to_numpy()
+                if op == "not in":
+                    matches = ~matches
+            elif numbers:
+                present &= numeric.notna().to_numpy()
+                matches = self._compare(numeric, op, value).to_numpy()
+            else:
+                matches = self._compare(text, op, value).to_numpy()
+            return matches & present, present
+        if node[0] == "not":
+            matches, known = self._evaluate(node[1], df)
+            return ~matches & known, known
+        results = [self._evaluate(part, df) for part in node[1]]
+        matches, known = results[0]
+        for part_matches, part_known in results[1:]:
+            if node[0] == "and":
+                known = (known & part_known) | (known & ~matches) | (part_known & ~part_matches)
+                matches = matches & part_matches
+            else:
+                known = (known & part_known) | matches | part_matches
+                matches = matches | part_matches
+        return matches, known
+
+    def mask(self, df):
+        """Boolean Series selecting the rows of ``df`` that match."""
+        self.check_columns(list(df.columns))
+        matches, _ = self._evaluate(self.tree, df)
+        return pd.Series(matches, index=df.index)
+
+    def may_match(self, ranges, node=None):
+        """
+        False if no row can match, given ``ranges`` mapping columns to their (min, max),
+        e.g. from Parquet row group statistics. Columns without a range may hold anything.
+        """
+        node = self.tree if node is None else node
+        if node[0] == "and":
+            return all(self.may_match(ranges, part) for part in node[1])
+        if node[0] == "or":
+            return any(self.may_match(ranges, part) for part in node[1])
+        if node[0] == "not" or node[1] not in ranges:
+            return True
+        _, column, op, value = node
+        low, high = ranges[column]
+        if isinstance(low, str) and (low != low.strip() or high != high.strip()):
+            # Cells are compared trimmed, which can move them outside the raw bounds
+            return True
+        try:
+            if op == "==":
+                return low <= value <= high
+            if op == "!=":
+                return not low == high == value
+            if op == "<":
+                return low < value
+            if op == "<=":
+                return low <= value
+            if op == ">":
+                return high > value
+            if op == ">=":
+                return high >= value
+            if op == "in":
+                return any(low <= item <= high for item in value)
+        except TypeError:
+            pass
+        return True
+
+
+class ContactValidator:
+    """Reads contact sheets and normalizes names and phone numbers column-wise.
+
+    Phone numbers are cleaned on a NumPy matrix of character codes and names
+    are normalized once per distinct value, so even very large sheets are
+    validated without a Python loop over the rows.
+    """
+
+    MISSING_VALUES = ['', 'nan', 'none', 'null', 'nat', '<na>']
+    NATIONAL_DIGITS = 10
+    PHONE_TEXT_WIDTH = 32
+    REPORT_NAME = "rejected_rows.csv"
+    UNCOVERED_REPORT_NAME = "uncovered_rows.csv"
+    SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+    DEFAULT_TABLE = "contacts"
+    CSV_CHUNK_ROWS = 100_000
+
+    def __init__(self, default_country_code="+91"):
+        self.country_digits = re.sub(r'\D', '', str(default_country_code))
+        if not self.country_digits:
+            raise ValueError(f"Invalid default country code: {default_country_code!r}")
+        self.country_codes = np.array([ord(c) for c in self.country_digits], dtype=np.uint32)
+
+    def read(self, path, row_filter=None, table=None):
+        """
+        Read a .csv, .xlsx, SQLite (.db/.sqlite) or .parquet file, keeping CSV cells as text
+        and other cells as their raw values. Only rows matching ``row_filter`` (a RowFilter)
+        are returned; the index keeps each row's position in the whole source, so reported
+        row numbers stay those of the file. ``table`` names the SQLite table to read.
+        """
+        lowered = path.lower()
+        if lowered.endswith('.csv'):
+            if row_filter is None:
+                df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            else:
+                # Filter chunk by chunk so only matching rows are ever held in memory
+                chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=self.CSV_CHUNK_ROWS)
+                df = pd.concat([self._filtered(chunk, row_filter) for chunk in chunks])
+        elif lowered.endswith('.xlsx'):
+            df = self._filtered(pd.read_excel(path, dtype=object), row_filter)
+        elif lowered.endswith(self.SQLITE_EXTENSIONS):
+            df = self._read_sqlite(path, row_filter, table)
+        elif lowered.endswith('.parquet'):
+            df = self._read_parquet(path, row_filter)
+        else:
+            raise ValueError("Unsupported file type. Please select a .csv, .xlsx, .db/.sqlite or .parquet file.")
+        df.columns = df.columns.astype(str).str.lower().str.strip()
+        return df
+
+    @staticmethod
+    def _filtered(df, row_filter):
+        if row_filter is None:
+            return df
+        df.columns = df.columns.astype(str).str.lower().str.strip()
+        return df[row_filter.mask(df)]
+
+    def _read_sqlite(self, path, row_filter, table):
+        """Read a table, letting SQLite apply the filter (and any index on its columns)."""
+        if not os.path.isfile(path):
+            raise ValueError(f"Database not found: {path}")
+        with sqlite3.connect(f"file:{Path(path).resolve().as_posix()}?mode=ro", uri=True) as connection:
+            try:
+                tables = [row[0] for row in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'")]
+            except sqlite3.DatabaseError as e:
+                raise ValueError(f"Could not read {path}: {e}")
+            if table is None:
+                if len(tables) == 1:
+                    table = tables[0]
+                elif self.DEFAULT_TABLE in tables:
+                    table = self.DEFAULT_TABLE
+                else:
+                    raise ValueError(f"Choose a table to read: {', '.join(tables) or 'the database has none'}.")
+            elif table not in tables:
+                raise ValueError(f"Table '{table}' not found. Available tables: {', '.join(tables)}")
+
+            name = '"' + table.replace('"', '""') + '"'
+            columns = [row[1].lower().strip() for row in connection.execute(f"PRAGMA table_info({name})")]
+            where, parameters = "", []
+            if row_filter is not None:
+                row_filter.check_columns(columns)
+                clause, parameters = row_filter.to_sql()
+                where = f" WHERE {clause}"
+            try:
+                # rowid keeps row numbers stable whatever the filter; views and WITHOUT ROWID tables lack it
+                df = pd.read_sql_query(f"SELECT rowid AS __rowid__, * FROM {name}{where} ORDER BY rowid",
+                                       connection, params=parameters)
+                df.index = pd.Index(df.pop("__rowid__").astype("int64") - 1)
+            except (pd.errors.DatabaseError, sqlite3.OperationalError):
+                df = pd.read_sql_query(f"SELECT * FROM {name}{where}", connection, params=parameters)
+        return df
+
+    @staticmethod
+    def _read_parquet(path, row_filter):
+        """Read the row groups whose column statistics allow a match, then filter their rows."""
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading .parquet files needs pyarrow (pip install pyarrow).")
+        try:
+            parquet = pq.ParquetFile(path)
+        except (OSError, pq.lib.ArrowException) as e:
+            raise ValueError(f"Could not read {path}: {e}")
+        metadata = parquet.metadata
+        names = [metadata.schema.column(i).name.lower().strip() for i in range(metadata.num_columns)]
+        if row_filter is not None:
+            row_filter.check_columns(names)
+
+        frames, offset = [], 0
+        for group in range(metadata.num_row_groups):
+            group_data = metadata.row_group(group)
+            ranges = {}
+            for i, column in enumerate(names):
+                statistics = group_data.column(i).statistics
+                if statistics is not None and statistics.has_min_max:
+                    ranges[column] = (statistics.min, statistics.max)
+            if row_filter is None or row_filter.may_match(ranges):
+                df = parquet.read_row_group(group).to_pandas(ignore_metadata=True)
+                df = df.drop(columns=[c for c in df.columns if str(c).startswith("__index_level_")])
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                frames.append(ContactValidator._filtered(df, row_filter))
+            offset += group_data.num_rows
+        if not frames:
+            return parquet.schema_arrow.empty_table().to_pandas(ignore_metadata=True)
+        return pd.concat(frames)
+
+    def _char_codes(self, text):
+        """
+        Return a (rows, PHONE_TEXT_WIDTH) matrix of ASCII codes for a text column.
+        Longer values become empty rows and non-ASCII characters become 255.
+        """
+        width = self.PHONE_TEXT_WIDTH
+        chars = np.asarray(text.to_numpy(), dtype=str)
+        if chars.dtype.itemsize // 4 > width:
+            chars = np.where(np.char.str_len(chars) > width, '', chars)
+        chars = chars.astype(f'<U{width}')
+        codes = chars.view(np.uint32).reshape(len(chars), width)
+        return np.minimum(codes, 255).astype(np.uint8)
+
+    def _as_text(self, column):
+        """
+        Stringify a column, turning Excel floats like 919000000000.0 or 9.19e+11 into digits.
+        Returns the stripped text and its character code matrix.
+        """
+        text = column.astype(str)
+        codes = self._char_codes(text)
+        is_space = (codes == ord(' ')) | (codes == ord('\t'))
+        last = np.maximum((codes != 0).sum(axis=1) - 1, 0)
+        padded = is_space[:, 0] | is_space[np.arange(len(codes)), last]
+        if padded.any():
+            text.loc[padded] = text[padded].str.strip()
+            codes[padded] = self._char_codes(text[padded])
+
+        float_chars = (codes == ord('.')) | (codes == ord('e')) | (codes == ord('E'))
+        numeric_chars = ((codes >= ord('0')) & (codes <= ord('9'))) | float_chars | (codes == 0) | (codes == ord('+')) | (codes == ord('-'))
+        floats = float_chars.any(axis=1) & numeric_chars.all(axis=1)
+        if floats.any():
+            numeric = pd.to_numeric(text[floats], errors='coerce')
+            integral = numeric[numeric.notna() & (numeric == numeric.round()) & (numeric > 0) & (numeric < 1e16)]
+            text.loc[integral.index] = integral.astype('int64').astype(str)
+            codes[text.index.get_indexer(integral.index)] = self._char_codes(text[integral.index])
+        return text, codes
+
+    def normalize_names(self, column):
+        """Collapse whitespace in names; missing names become empty strings."""
+        codes, uniques = pd.factorize(column.astype(str))
+        uniques = pd.Series(uniques).str.replace(r'\s+', ' ', regex=True).str.strip()
+        uniques = uniques.where(~uniques.str.lower().isin(self.MISSING_VALUES), '')
+        return pd.Series(uniques.to_numpy()[codes], index=column.index)
+
+    def normalize_phones(self, text):
+        """Convert phone text to E.164; numbers that cannot be normalized become empty strings."""
+        return self._normalize_codes(self._char_codes(text.astype(str).str.strip()), text.index)
+
+    def _normalize_codes(self, codes, index):
+        rows, width = codes.shape
+        is_digit = (codes >= ord('0')) & (codes <= ord('9'))
+        has_plus = codes[:, 0] == ord('+')
+
+        # Pack each row's digits to the left, keeping their order
+        lengths = is_digit.sum(axis=1)
+        target = np.cumsum(is_digit, axis=1, dtype=np.int8) - 1
+        row_index = np.broadcast_to(np.arange(rows)[:, None], codes.shape)
+        digits = np.zeros_like(codes)
+        digits[row_index[is_digit], target[is_digit]] = codes[is_digit]
+
+        def shift_left(amount):
+            for k in np.unique(amount[amount > 0]):
+                selected = amount == k
+                digits[selected, :-k] = digits[selected, k:]
+                digits[selected, -k:] = 0
+            return lengths - amount
+
+        # 00 is the international call prefix in most countries
+        international = ~has_plus & (digits[:, 0] == ord('0')) & (digits[:, 1] == ord('0'))
+        lengths = shift_left(np.where(international, 2, 0))
+        has_plus |= international
+
+        # Drop the trunk prefix of national numbers, e.g. 09000012345
+        leading_zeros = np.argmax(digits != ord('0'), axis=1)
+        lengths = shift_left(np.where(has_plus, 0, leading_zeros))
+
+        prefix = len(self.country_codes)
+        has_country = (digits[:, :prefix] == self.country_codes).all(axis=1) & (lengths > self.NATIONAL_DIGITS)
+        national = ~has_plus & ~has_country
+        digits[national, prefix:] = digits[national, :-prefix]
+        digits[national, :prefix] = self.country_codes
+        lengths = lengths + np.where(national, prefix, 0)
+
+        # E.164: a plus sign and 8 to 15 digits, not starting with 0
+        valid = (lengths >= 8) & (lengths <= 15) & (digits[:, 0] != ord('0'))
+        e164 = np.zeros((rows, 16), dtype=np.uint8)
+        e164[:, 0] = ord('+')
+        e164[:, 1:] = digits[:, :15]
+        e164 = e164.view('S16').ravel().astype('U16')
+        return pd.Series(np.where(valid, e164, ''), index=index, dtype=object)
+
+    def validate(self, df):
+        """
+        Split a contact table into valid and rejected rows.
+
+        Valid rows keep every column; ``name`` and ``number`` are cleaned for display and
+        ``phone`` holds the E.164 number. Rejected rows carry the spreadsheet row
+        number (header is row 1) and a reason.
+        """
+        if 'name' not in df.columns or 'number' not in df.columns:
+            raise ValueError(
+                f"The data file must contain 'name' and 'number' columns.\n"
+                f"Found columns: {', '.join(df.columns.tolist())}")
+
+        names = self.normalize_names(df['name'])
+        numbers, codes = self._as_text(df['number'])
+        phones = self._normalize_codes(codes, df.index)
+        no_digits = ~((codes >= ord('0')) & (codes <= ord('9'))).any(axis=1)
+        if no_digits.any():
+            missing = numbers[no_digits].str.lower().isin(self.MISSING_VALUES)
+            numbers.loc[missing[missing].index] = ''
+
+        reason = pd.Series('', index=df.index)
+        reason = reason.mask(phones == '', 'invalid number')
+        reason = reason.mask(numbers == '', 'missing number')
+        reason = reason.mask(names == '', 'missing name')
+        rejected_mask = reason != ''
+
+        valid = df.loc[~rejected_mask].copy()
+        valid['name'] = names[~rejected_mask]
+        valid['number'] = numbers[~rejected_mask]
+        valid['phone'] = phones[~rejected_mask]
+
+        rejected = pd.DataFrame({
+            'row': df.index[rejected_mask] + 2,
+            'name': df.loc[rejected_mask, 'name'].astype(str),
+            'number': df.loc[rejected_mask, 'number'].astype(str),
+            'reason': reason[rejected_mask],
+        })
+        return valid, rejected
+
+    def load(self, path, report_dir=None, row_filter=None, table=None):
+        """
+        Read and validate a contact file, writing a rejection report to ``report_dir`` if any rows fail.
+        ``row_filter`` and ``table`` are passed to read().
+        """
+        df = self.read(path, row_filter=row_filter, table=table)
+        if df.empty:
+            if row_filter is not None:
+                raise ValueError(f"No rows match the filter: {row_filter.expression}")
+            raise ValueError("The data file appears to be empty.")
+        valid, rejected = self.validate(df)
+        if report_dir and not rejected.empty:
+            rejected.to_csv(os.path.join(report_dir, self.REPORT_NAME), index=False)
+        return valid, rejected
+
+    def check_coverage(self, valid, font_paths, report_dir=None):
+        """
+        Find valid rows whose name has characters that none of ``font_paths`` can draw.
+        Such rows still render (with empty boxes), so they are reported rather than rejected.
+        Returns a DataFrame of row, name and the missing characters.
+        """
+        coverages = []
+        for path in font_paths:
+            try:
+                coverages.append(font_coverage(path))
+            except Exception as e:
+                print(f"Could not read the character map of {path}: {e}")
+        if not coverages:
+            return pd.DataFrame(columns=["row", "name", "missing"])
+
+        codes, uniques = pd.factorize(valid['name'])
+        missing = np.array(
+            ["".join(sorted(uncovered_characters(name, coverages))) for name in uniques] + [""], dtype=object
+        )[codes]
+        uncovered = missing != ""
+        report = pd.DataFrame({
+            "row": valid.index[uncovered] + 2,
+            "name": valid['name'].to_numpy()[uncovered],
+            "missing": missing[uncovered],
+        })
+        if report_dir and not report.empty:
+            report.to_csv(os.path.join(report_dir, self.UNCOVERED_REPORT_NAME), index=False)
+        return report
+
+
+def paragraph_columns(settings):
+    """The data columns feeding the paragraph boxes, in box order."""
+    return [spec["column"] for spec in settings.get("paragraphs") or []]
+
+
+def _column_values(valid, column, kind):
+    key = column.strip().lower()
+    if key not in valid.columns:
+        raise ValueError(f"{kind} column '{column}' was not found in the data file.")
+    return ["" if value is None or (isinstance(value, float) and np.isnan(value)) else str(value).strip()
+            for value in valid[key]]
+
+
+def batch_contacts(valid, photo_column="", base_dir="", text_columns=()):
+    """
+    Build the (row, name, number) tuples FlyerBatch renders from validated contacts.
+    With a ``photo_column`` each tuple gets the row's image path as a fourth item,
+    resolved against ``base_dir`` (normally the data file's folder); blank cells give "".
+    With ``text_columns`` (see paragraph_columns) tuples are (row, name, number, photo,
+    texts), texts holding the row's value for each column.
+    """
+    rows = valid.index + 2
+    if not photo_column and not text_columns:
+        return list(zip(rows, valid['name'], valid['number']))
+    photos = [""] * len(valid)
+    if photo_column:
+        photos = [os.path.join(base_dir, os.path.expanduser(value)) if value else ""
+                  for value in _column_values(valid, photo_column, "Photo")]
+    if not text_columns:
+        return list(zip(rows, valid['name'], valid['number'], photos))
+    texts = zip(*[_column_values(valid, column, "Text") for column in text_columns])
+    return list(zip(rows, valid['name'], valid['number'], photos, texts))
+
+
+@lru_cache(maxsize=64)
+def _luminance(color):
+    """A colour's luminance (0-255), on the same scale as Image.convert("L")."""
+    return ImageColor.getcolor(color, "L")
+
+
+class LuminanceTable:
+    """Summed-area tables of a background's luminance and squared luminance.
+
+    Built once per background image and shared by every renderer drawing on
+    it, after which the mean and spread of the background under any box
+    cost four lookups per table, whatever the box size and however many
+    fields and rows are drawn. Large templates are box-averaged down to
+    about MAX_PIXELS first, which is plenty for judging the area under text.
+    """
+
+    MAX_PIXELS = 1_000_000
+    _tables = PerImageCache()
+
+    def __init__(self, image):
+        gray = image.convert("L")
+        self.factor = max(1, math.ceil(math.sqrt(gray.width * gray.height / self.MAX_PIXELS)))
+        if self.factor > 1:
+            gray = gray.reduce(self.factor)
+        self.width, self.height = gray.size
+        values = np.asarray(gray, dtype=np.int64)
+        self.sums = np.zeros((self.height + 1, self.width + 1), dtype=np.int64)
+        self.squares = np.zeros_like(self.sums)
+        np.cumsum(values, axis=0).cumsum(axis=1, out=self.sums[1:, 1:])
+        np.cumsum(values * values, axis=0).cumsum(axis=1, out=self.squares[1:, 1:])
+
+    @classmethod
+    def of(cls, image):
+        """The table for ``image``, computed on first use and kept while the image lives."""
+        return cls._tables.get(image, lambda: cls(image))
+
+    def stats(self, box):
+        """Mean and standard deviation of the luminance (0-255) under ``box``, or None if it's off the image."""
+        left, top, right, bottom = box
+        factor = self.factor
+        left, top = max(0, int(left) // factor), max(0, int(top) // factor)
+        right, bottom = min(self.width, -(-int(right) // factor)), min(self.height, -(-int(bottom) // factor))
+        if left >= right or top >= bottom:
+            return None
+        count = (right - left) * (bottom - top)
+
+        def total(table):
+            return int(table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left])
+
+        mean = total(self.sums) / count
+        variance = max(0.0, total(self.squares) / count - mean * mean)
+        return mean, math.sqrt(variance)
+
+
+class FlyerRenderer:
+    """Draws flyer text onto a background from a plain settings dictionary.
+
+    The renderer holds no Tk state, so the same code runs in the GUI, in
+    generation threads and in worker processes.
+    """
+
+    # With auto_contrast: the least luminance difference (0-255) kept between text and
+    # the mean background under it, and the spread above which a field also gets a shadow
+    MIN_CONTRAST = 100
+    BUSY_DEVIATION = 48
+
+    def __init__(self, settings, background=None):
+        self.settings = dict(DEFAULT_RENDER_SETTINGS, **settings)
+        if background is None:
+            background = load_base_image(self.settings)
+        self.background = background
+        self.luminance = None
+        if self.settings["auto_contrast"]:
+            # Built before anything is drawn, as some paths draw on the background itself
+            self.luminance = LuminanceTable.of(background)
+        self.font = self._load_font(self.settings["font_size"])
+        self._shaping_fonts = {}
+        self._runs = {}
+        self._widths = {}
+        self._wraps = {}
+        self._paragraph_renderers = {}
+        self._load_fallbacks()
+        self.photos = None
+        if self.settings["photo_box"]:
+            _, _, width, height = self.settings["photo_box"]
+            self.photos = PhotoSlotCache(
+                (width, height), self.settings["photo_shape"], self.settings["photo_radius"]
+            )
+
+    @classmethod
+    def for_scale(cls, settings, scale, background):
+        """Build a renderer for a background resized by ``scale`` (e.g. a preview)."""
+        scaled = dict(settings)
+        scaled["font_size"] = max(1, int(round(settings["font_size"] * scale)))
+        for key in ("name_pos", "phone_pos"):
+            x, y = settings[key]
+            scaled[key] = (int(round(x * scale)), int(round(y * scale)))
+        if settings.get("photo_box"):
+            scaled["photo_box"] = tuple(max(1, int(round(value * scale))) for value in settings["photo_box"])
+            scaled["photo_radius"] = int(round(settings.get("photo_radius", 0) * scale))
+        scaled["paragraphs"] = [
+            dict(spec, box=[int(round(value * scale)) for value in spec["box"]],
+                 **({"font_size": max(1, int(round(spec["font_size"] * scale)))} if spec.get("font_size") else {}))
+            for spec in settings.get("paragraphs") or []
+        ]
+        return cls(scaled, background=background)
+
+    def _load_font(self, size):
+        try:
+            # Basic layout is enough (and fastest) for Latin; complex scripts use _shaping_for
+            return ImageFont.truetype(self.settings["font_path"], size, layout_engine=ImageFont.Layout.BASIC)
+        except Exception as e:
+            print(f"Font loading error: {e}. Using default font.")
+            return ImageFont.load_default()
+
+    def _load_fallbacks(self):
+        """Set up the font chain: the main font followed by the configured fallbacks."""
+        self.font_paths = [self.settings["font_path"]]
+        self.fonts = [self.font]
+        self.coverages = [None]
+        fallbacks = [path for path in self.settings["fallback_fonts"] if path]
+        if not fallbacks or not isinstance(self.font, ImageFont.FreeTypeFont):
+            return
+        try:
+            self.coverages[0] = font_coverage(self.font_paths[0])
+        except Exception as e:
+            print(f"Could not read the character map of {self.font_paths[0]}: {e}")
+            return
+        for path in fallbacks:
+            try:
+                font = ImageFont.truetype(path, self.settings["font_size"], layout_engine=ImageFont.Layout.BASIC)
+                coverage = font_coverage(path)
+            except Exception as e:
+                print(f"Fallback font error: {e}. Skipping {path}.")
+                continue
+            self.font_paths.append(path)
+            self.fonts.append(font)
+            self.coverages.append(coverage)
+
+    def _shaping_for(self, text, index=0):
+        """
+        Return (font, layout) to draw ``text`` with chain font ``index``: the raqm font
+        and the detected (direction, language) for complex scripts, or the basic font and None.
+        """
+        global _warned_no_raqm
+        layout = text_layout(text)
+        if layout is None:
+            return self.fonts[index], None
+        if not HAS_RAQM or not isinstance(self.fonts[index], ImageFont.FreeTypeFont):
+            if not _warned_no_raqm:
+                print("Complex-script text found but Pillow has no raqm support; using basic layout.")
+                _warned_no_raqm = True
+            return self.fonts[index], None
+        if index not in self._shaping_fonts:
+            self._shaping_fonts[index] = ImageFont.truetype(
+                self.font_paths[index], self.settings["font_size"], layout_engine=ImageFont.Layout.RAQM
+            )
+        return self._shaping_fonts[index], layout
+
+    def _font_index(self, char, current):
+        """The first font in the chain with a glyph for ``char`` (the main font if none has)."""
+        # Spaces, combining marks and joiners stay in the current run so clusters are not split
+        if char.isspace() or unicodedata.category(char) in ("Mn", "Mc", "Me", "Cf"):
+            if self.coverages[current].covers(char):
+                return current
+        for index, coverage in enumerate(self.coverages):
+            if coverage.covers(char):
+                return index
+        return 0
+
+    def split_runs(self, text):
+        """Split ``text`` into (run, font index) pieces, one per stretch drawn with the same font."""
+        if len(self.fonts) == 1:
+            return [(text, 0)]
+        runs = []
+        for char in text:
+            index = self._font_index(char, runs[-1][1] if runs else 0)
+            if runs and runs[-1][1] == index:
+                runs[-1][0].append(char)
+            else:
+                runs.append(([char], index))
+        return [("".join(chars), index) for chars, index in runs] or [(text, 0)]
+
+    def text_runs(self, text, measure=True):
+        """
+        Place the per-font runs of ``text`` on the main font's baseline.
+        Returns (runs, bbox): runs are (dx, dy, text, font, layout) relative to
+        the field position, bbox is their union. Measuring rasterizes the runs
+        (into SHAPED_RUNS, ready to draw); without ``measure`` bbox may be None.
+        """
+        placed = self._runs.get(text)
+        if placed is not None and (placed[1] is not None or not measure):
+            return placed
+        if placed is not None:
+            runs = placed[0]
+        else:
+            pieces = []
+            for run, index in self.split_runs(text):
+                font, layout = self._shaping_for(run, index)
+                pieces.append((run, index, font, layout))
+            if len(pieces) == 1 and pieces[0][1] == 0:
+                run, _, font, layout = pieces[0]
+                runs = [(0, 0, run, font, layout)]
+            else:
+                if (text_layout(text) or ("ltr",))[0] == "rtl":
+                    pieces.reverse()
+                ascent = self.font.getmetrics()[0]
+                runs = []
+                x = 0
+                for run, index, font, layout in pieces:
+                    options = {} if layout is None else {"direction": layout[0], "language": layout[1]}
+                    runs.append((x, ascent - font.getmetrics()[0], run, font, layout))
+                    x += int(round(font.getlength(run, **options)))
+
+        bbox = None
+        if measure:
+            boxes = []
+            for x, dy, run, font, layout in runs:
+                left, top, right, bottom = SHAPED_RUNS.get(font, run, layout)[1]
+                boxes.append((x + left, dy + top, x + right, dy + bottom))
+            bbox = _union_box(boxes)
+        placed = (runs, bbox)
+
+        if len(self._runs) >= 4096:
+            self._runs.clear()
+        self._runs[text] = placed
+        return placed
+
+    @staticmethod
+    def ink_box(runs):
+        """The union box of placed ``runs`` from font metrics alone, without rasterizing them."""
+        boxes = []
+        for x, dy, run, font, layout in runs:
+            options = {} if layout is None else {"direction": layout[0], "language": layout[1]}
+            left, top, right, bottom = font.getbbox(run, **options)
+            boxes.append((x + left, dy + top, x + right, dy + bottom))
+        return _union_box(boxes)
+
+    def text_width(self, text):
+        """Advance width of ``text`` across the font chain, memoized per renderer."""
+        width = self._widths.get(text)
+        if width is None:
+            width = 0
+            for run, index in self.split_runs(text):
+                font, layout = self._shaping_for(run, index)
+                options = {} if layout is None else {"direction": layout[0], "language": layout[1]}
+                width += font.getlength(run, **options)
+            if len(self._widths) >= 16384:
+                self._widths.clear()
+            self._widths[text] = width
+        return width
+
+    def _fit_prefix(self, word, width):
+        """The length of the longest prefix of ``word`` (at least one character) that fits ``width``."""
+        low, high = 1, len(word)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.text_width(word[:middle]) <= width:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def wrap_text(self, text, width, max_lines=0):
+        """
+        Break ``text`` into lines no wider than ``width`` pixels and return them as a tuple.
+        Line breaks in the text are kept and words wider than the box are split. With
+        ``max_lines`` the text is cut after that many lines and the last one ends in an
+        ellipsis. The renderer fixes font and size, so the memo key is (text, width, max_lines).
+        """
+        key = (text, width, max_lines)
+        lines = self._wraps.get(key)
+        if lines is not None:
+            return lines
+        space = self.text_width(" ")
+        lines = []
+        for paragraph in text.strip().replace("\r\n", "\n").split("\n"):
+            line, line_width = [], 0
+            for word in paragraph.split():
+                word_width = self.text_width(word)
+                if line and line_width + space + word_width <= width:
+                    line.append(word)
+                    line_width += space + word_width
+                    continue
+                if line:
+                    lines.append(" ".join(line))
+                while word_width > width and len(word) > 1:
+                    cut = self._fit_prefix(word, width)
+                    lines.append(word[:cut])
+                    word = word[cut:]
+                    word_width = self.text_width(word)
+                line, line_width = [word], word_width
+            lines.append(" ".join(line))
+        if max_lines and len(lines) > max_lines:
+            last = lines[max_lines - 1]
+            while last and self.text_width(last + ELLIPSIS) > width:
+                last = last[:-1].rstrip()
+            lines = lines[:max_lines - 1] + [last + ELLIPSIS]
+
+        lines = tuple(lines)
+        if len(self._wraps) >= 4096:
+            self._wraps.clear()
+        self._wraps[key] = lines
+        return lines
+
+    def _paragraph_renderer(self, spec):
+        """The renderer for a paragraph box: this one, or a copy with the box's own size and colour."""
+        font_size = spec.get("font_size") or self.settings["font_size"]
+        color = spec.get("color") or self.settings["text_color"]
+        if (font_size, color) == (self.settings["font_size"], self.settings["text_color"]):
+            return self
+        renderer = self._paragraph_renderers.get((font_size, color))
+        if renderer is None:
+            settings = dict(self.settings, font_size=font_size, text_color=color, paragraphs=[], photo_box=None)
+            renderer = self._paragraph_renderers[(font_size, color)] = FlyerRenderer(settings, background=self.background)
+        return renderer
+
+    def paragraph_fields(self, texts):
+        """
+        Lay out the paragraph boxes for one contact's ``texts`` (one per box, in order).
+        Returns (renderer, line, position) for every line to draw.
+        """
+        fields = []
+        for spec, text in zip(self.settings["paragraphs"], texts):
+            if not text:
+                continue
+            renderer = self._paragraph_renderer(spec)
+            x, y, width, height = spec["box"]
+            ascent, descent = renderer.font.getmetrics()
+            step = max(1, int(round((ascent + descent) * spec.get("line_spacing", 1.2))))
+            max_lines = spec.get("max_lines", 0)
+            if height:
+                # Lines that would overflow the box are cut like max_lines, with an ellipsis
+                fitting = max(1, (height - ascent - descent) // step + 1)
+                max_lines = min(max_lines, fitting) if max_lines else fitting
+            align = spec.get("align", "left")
+            for index, line in enumerate(renderer.wrap_text(text, width, max_lines)):
+                offset = 0
+                if align in ("center", "right"):
+                    offset = width - renderer.text_width(line)
+                    offset = offset // 2 if align == "center" else offset
+                fields.append((renderer, line, (x + int(round(offset)), y + index * step)))
+        return fields
+
+    def text_fields(self, name, phone):
+        """Return the (text, position) pairs drawn for one contact."""
+        return [
+            (name, tuple(self.settings["name_pos"])),
+            (phone, tuple(self.settings["phone_pos"])),
+        ]
+
+    def contrast_colors(self, box):
+        """
+        The (text colour, shadow colour, shadow) to use for a field covering ``box``
+        with auto_contrast. The configured text colour is kept while it stands out
+        from the mean background under the box, otherwise black or white is used;
+        the shadow takes a colour that stands out from the text, and is switched
+        on where the background is busy.
+        """
+        color, shadow_color, shadow = self.settings["text_color"], self.settings["shadow_color"], self.settings["shadow"]
+        stats = self.luminance.stats(box)
+        if stats is None:
+            return color, shadow_color, shadow
+        mean, deviation = stats
+        if abs(_luminance(color) - mean) < self.MIN_CONTRAST:
+            color = "#000000" if mean >= 128 else "#FFFFFF"
+        text_luminance = _luminance(color)
+        if abs(_luminance(shadow_color) - text_luminance) < self.MIN_CONTRAST:
+            shadow_color = "#000000" if text_luminance >= 128 else "#FFFFFF"
+        return color, shadow_color, shadow or deviation >= self.BUSY_DEVIATION
+
+    def layout_field(self, text, position, measure=True):
+        """
+        Lay out one text field with its effects, without drawing anything.
+        Returns (operations, box). Operations are ("text", xy, fill, text, font, layout)
+        and ("line", points, fill) tuples in drawing order; box covers every
+        pixel they may touch. Without ``measure`` (for callers that only want
+        the operations) nothing is rasterized and box is None.
+        """
+        x, y = position
+        font_size = self.settings["font_size"]
+        color, shadow_color, shadow = self.settings["text_color"], self.settings["shadow_color"], self.settings["shadow"]
+        runs, bbox = self.text_runs(text, measure)
+        if bbox is None:
+            # Only the underline and auto contrast need the ink extent of unmeasured text
+            bbox = self.ink_box(runs) if self.settings["underline"] or self.luminance else (0, 0, 0, 0)
+        left, top, right, bottom = bbox
+        if self.luminance:
+            color, shadow_color, shadow = self.contrast_colors((x + left, y + top, x + right, y + bottom))
+        operations = []
+        boxes = []
+
+        def add_text(dx, dy, fill):
+            for run_x, run_y, run, font, layout in runs:
+                operations.append(("text", (x + dx + run_x, y + dy + run_y), fill, run, font, layout))
+            boxes.append((x + dx + left, y + dy + top, x + dx + right, y + dy + bottom))
+
+        # Apply shadow effect
+        if shadow:
+            shadow_offset = max(2, font_size // 15)
+            add_text(shadow_offset, shadow_offset, shadow_color)
+
+        # Simulate bold by drawing text multiple times with slight offsets
+        if self.settings["bold"]:
+            for dx in range(1, 3):
+                for dy in range(1, 3):
+                    add_text(dx, dy, color)
+
+        # Draw main text
+        add_text(0, 0, color)
+
+        # Apply underline effect
+        if self.settings["underline"]:
+            text_width = right - left
+            text_height = bottom - top
+            underline_y = y + text_height + 2
+            underline_thickness = max(1, font_size // 20)
+            for i in range(underline_thickness):
+                operations.append(("line", [(x, underline_y + i), (x + text_width, underline_y + i)], color))
+            boxes.append((x, underline_y, x + text_width + 1, underline_y + underline_thickness))
+
+        if not measure:
+            return operations, None
+        left, top, right, bottom = _union_box(boxes)
+        # Pad by a pixel for anti-aliased glyph edges
+        return operations, (left - 1, top - 1, right + 1, bottom + 1)
+
+    def apply_text_effects(self, draw, text, position, origin=(0, 0)):
+        """Apply text effects like shadow, bold, underline, etc.
+
+        ``origin`` is subtracted from every coordinate, for drawing onto a
+        crop of the background. Returns the field's box in background
+        coordinates.
+        """
+        operations, box = self.layout_field(text, position)
+        ox, oy = origin
+        for operation in operations:
+            if operation[0] == "text":
+                _, (x, y), fill, run, font, layout = operation
+                mask, (left, top, right, bottom) = SHAPED_RUNS.get(font, run, layout)
+                if right > left and bottom > top:
+                    draw.bitmap((x - ox + left, y - oy + top), mask, fill=fill)
+            else:
+                _, points, fill = operation
+                draw.line([(x - ox, y - oy) for x, y in points], fill=fill, width=1)
+        return box
+
+    def ink_colors(self):
+        """Every colour text may be drawn in, for palette output."""
+        colors = [self.settings["text_color"]]
+        if self.settings["shadow"] or self.luminance:
+            colors.append(self.settings["shadow_color"])
+        if self.luminance:
+            colors += ["#000000", "#FFFFFF"]
+        colors += [spec["color"] for spec in self.settings["paragraphs"] if spec.get("color")]
+        return list(dict.fromkeys(colors))
+
+    def photo_box(self):
+        """The photo slot as a (left, top, right, bottom) box."""
+        x, y, width, height = self.settings["photo_box"]
+        return (x, y, x + width, y + height)
+
+    def paste_photo(self, image, photo):
+        """Paste a contact photo (a file path or a ready slot image) into the photo slot."""
+        slot = photo if isinstance(photo, Image.Image) else self.photos.get(photo)
+        box = self.photo_box()
+        image.paste(slot, box[:2], slot)
+        return box
+
+    def field_boxes(self, name, phone, photo=None, texts=()):
+        """Return the boxes a contact's text (and photo) will cover, without drawing it."""
+        boxes = [self.photo_box()] if photo and self.photos else []
+        boxes += [renderer.layout_field(line, position)[1] for renderer, line, position in self.paragraph_fields(texts)]
+        return boxes + [self.layout_field(text, position)[1] for text, position in self.text_fields(name, phone)]
+
+    def text_sprite(self, text, position):
+        """
+        Render one text field onto its own transparent layer.
+        Returns (sprite, box) where box is the sprite's place on the background.
+        """
+        left, top, right, bottom = self.layout_field(text, position)[1]
+        sprite = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+        self.apply_text_effects(ImageDraw.Draw(sprite), text, position, origin=(left, top))
+        return sprite, (left, top, right, bottom)
+
+    def draw_into(self, image, name, phone, photo=None, texts=()):
+        """Draw a contact's photo and text onto ``image`` in place and return the dirty boxes."""
+        boxes = [self.paste_photo(image, photo)] if photo and self.photos else []
+        draw = ImageDraw.Draw(image)
+        boxes += [renderer.apply_text_effects(draw, line, position)
+                  for renderer, line, position in self.paragraph_fields(texts)]
+        return boxes + [self.apply_text_effects(draw, text, position) for text, position in self.text_fields(name, phone)]
+
+    def draw(self, name, phone, photo=None, texts=()):
+        """Return a new flyer image for one contact."""
+        image = self.background.copy()
+        self.draw_into(image, name, phone, photo, texts)
+        return image
+
+
+def _clip_box(box, size):
+    width, height = size
+    left, top = max(0, box[0]), max(0, box[1])
+    right, bottom = min(width, box[2]), min(height, box[3])
+    if left < right and top < bottom:
+        return (left, top, right, bottom)
+    return None
+
+
+class WorkingCanvas:
+    """A private, reusable copy of a pristine background.
+
+    Text is drawn straight onto ``image``; afterwards only the dirty boxes are
+    copied back from the pristine background, so each flyer costs a copy of
+    its text regions instead of a copy of the whole template.
+    """
+
+    def __init__(self, pristine):
+        self.pristine = pristine
+        self.image = pristine.copy()
+
+    def prepare(self, boxes):
+        """Nothing to save: the pristine background is kept alongside."""
+
+    def restore(self, boxes):
+        for box in boxes:
+            region = _clip_box(box, self.image.size)
+            if region:
+                self.image.paste(self.pristine.crop(region), region)
+
+
+class PatchCanvas:
+    """Draws straight onto the only copy of a background.
+
+    For print-size templates a second full copy may not fit in memory, so
+    ``prepare`` saves just the regions about to be drawn over and
+    ``restore`` pastes them back after the flyer is saved.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._patches = []
+
+    def prepare(self, boxes):
+        self._patches = []
+        for box in boxes:
+            region = _clip_box(box, self.image.size)
+            if region:
+                self._patches.append((region, self.image.crop(region)))
+
+    def restore(self, boxes=None):
+        # Paste back in reverse so overlapping boxes end up with the original pixels
+        for region, patch in reversed(self._patches):
+            self.image.paste(patch, region)
+        self._patches = []
+
+
+class MappedBackground:
+    """Decoded background pixels published once in a memory-mapped file.
+
+    Worker processes attach to the file read-only, so the template occupies
+    physical memory once no matter how many workers render from it.
+    """
+
+    BAND_ROWS = 256
+
+    def __init__(self, image, directory=None):
+        width, height = image.size
+        fd, self.path = tempfile.mkstemp(prefix="flyer_bg_", suffix=".raw", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            # Write (and convert) in bands so publishing never needs a second full-size buffer
+            for top in range(0, height, self.BAND_ROWS):
+                f.write(image.crop((0, top, width, min(height, top + self.BAND_ROWS))).convert("RGBA").tobytes())
+        self.descriptor = (self.path, image.size, "RGBA")
+
+    @staticmethod
+    def attach(descriptor, copy_on_write=False):
+        """Map a published background and return it as a PIL image.
+
+        By default the image is read-only. With ``copy_on_write`` it can be
+        drawn on: only the touched pages become private to the process and
+        the file itself never changes.
+        """
+        path, size, mode = descriptor
+        access = mmap.ACCESS_COPY if copy_on_write else mmap.ACCESS_READ
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=access)
+        # The image keeps a reference to the mapping, which stays open for the worker's lifetime
+        image = Image.frombuffer(mode, size, mapping, "raw", mode, 0, 1)
+        if copy_on_write:
+            # frombuffer marks shared memory read-only; a private mapping is safe to write
+            image.readonly = 0
+        return image
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# Per-process state for rendering workers, set up once by _init_render_worker
+_render_worker = {}
+
+
+def _init_render_worker(settings, descriptor, large_image=False):
+    if large_image:
+        # Draw on the mapping itself instead of keeping a private full-size copy
+        background = MappedBackground.attach(descriptor, copy_on_write=True)
+        canvas = PatchCanvas(background)
+    else:
+        background = MappedBackground.attach(descriptor)
+        canvas = WorkingCanvas(background)
+    _render_worker["renderer"] = FlyerRenderer(settings, background=background)
+    _render_worker["canvas"] = canvas
+    _render_worker["encoder"] = FlyerEncoder.from_settings(dict(DEFAULT_RENDER_SETTINGS, **settings))
+    _render_worker["encoder"].prepare(background, _render_worker["renderer"].ink_colors())
+
+
+def _render_worker_jobs(jobs):
+    """Render a chunk of jobs inside a worker process.
+
+    Flyers are written to disk by the worker; only small status tuples travel
+    back to the parent.
+    """
+    renderer = _render_worker["renderer"]
+    canvas = _render_worker["canvas"]
+    encoder = _render_worker["encoder"]
+    results = []
+    for position, name, phone, photo, texts, path in jobs:
+        boxes = []
+        try:
+            boxes = renderer.field_boxes(name, phone, photo, texts)
+            canvas.prepare(boxes)
+            renderer.draw_into(canvas.image, name, phone, photo, texts)
+            save_flyer(canvas.image, path, encoder, boxes)
+            results.append((position, name, True, None))
+        except Exception as e:
+            results.append((position, name, False, str(e)))
+        finally:
+            canvas.restore(boxes)
+    return results
+
+
+class VectorFlyerWriter:
+    """Writes flyers as SVG or HTML documents over a shared background.
+
+    Each document references the background (flattened with any static
+    layers) and the fonts, which are written once to ``ASSET_DIR`` in the
+    output folder, and holds only the contact's positioned text. The text
+    comes from the same layout_field operations the raster renderer draws,
+    with the baseline at the field's y plus the font ascent, so effects,
+    fallback fonts and paragraph boxes land where they do in a PNG. With
+    fontTools installed the shared fonts are subset to the characters of
+    the batch; with ``embed_fonts`` every document carries its own subset
+    as a data URI instead, so it can be sent on its own.
+    """
+
+    ASSET_DIR = "flyer_assets"
+    WEB_IMAGE_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif"}
+    # Channel difference above which compare() counts a pixel as changed
+    DIFF_THRESHOLD = 64
+    # Share of changed pixels a checked document may have (antialiasing differs between rasterizers)
+    MAX_CHANGED = 0.005
+    EMBED_CACHE = 256
+
+    def __init__(self, settings, output_dir):
+        self.settings = dict(DEFAULT_RENDER_SETTINGS, **settings)
+        if self.settings["output_format"] not in VECTOR_FORMATS:
+            raise ValueError(f"Not a document format: {self.settings['output_format']}")
+        self.output_dir = output_dir
+        self.embed_fonts = self.settings["embed_fonts"]
+        self.renderer = FlyerRenderer(self.settings)
+        if not isinstance(self.renderer.font, ImageFont.FreeTypeFont):
+            raise ValueError("Document output needs a TrueType or OpenType font.")
+        self.width, self.height = self.renderer.background.size
+        self.background_href = None
+        self.font_hrefs = {}
+        self._families = {}
+        self._embedded = OrderedDict()
+
+    @staticmethod
+    def _font_tools():
+        try:
+            from fontTools import subset
+            return subset
+        except ImportError:
+            return None
+
+    def _href(self, path):
+        """A URL for ``path`` relative to the output folder."""
+        try:
+            relative = os.path.relpath(path, self.output_dir)
+        except ValueError:
+            # Another drive on Windows
+            return Path(os.path.abspath(path)).as_uri()
+        return quote(relative.replace(os.sep, "/"))
+
+    @staticmethod
+    def _write_asset(path, data):
+        # Write then rename, as shards may publish the same asset at once
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _subset(self, path, characters):
+        """``path``'s font cut down to ``characters``, as WOFF bytes."""
+        subset = self._font_tools()
+        options = subset.Options()
+        options.flavor = "woff"
+        options.notdef_outline = True
+        font = subset.load_font(path, options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=[ord(char) for char in characters])
+        subsetter.subset(font)
+        buffer = io.BytesIO()
+        subset.save_font(font, buffer, options)
+        return buffer.getvalue()
+
+    def prepare(self, jobs=()):
+        """Write the shared background, and the fonts unless they are embedded, for ``jobs``."""
+        os.makedirs(os.path.join(self.output_dir, self.ASSET_DIR), exist_ok=True)
+        source = self.settings["background"]
+        with Image.open(source) as image:
+            extension = self.WEB_IMAGE_FORMATS.get(image.format)
+        if extension and not self.settings["overlays"]:
+            # Ship the background file as it is, compression and all
+            with open(source, "rb") as f:
+                data = f.read()
+        else:
+            buffer = io.BytesIO()
+            self.renderer.background.save(buffer, format="PNG")
+            data, extension = buffer.getvalue(), ".png"
+        path = os.path.join(self.output_dir, self.ASSET_DIR, f"background-{hashlib.sha1(data).hexdigest()[:12]}{extension}")
+        if not os.path.exists(path):
+            self._write_asset(path, data)
+        self.background_href = self._href(path)
+        if self.embed_fonts:
+            if self._font_tools() is None:
+                raise ValueError("Embedding fonts needs fontTools (pip install fonttools).")
+            return
+
+        characters = set(ELLIPSIS)
+        for job in jobs:
+            characters.update(job["name"], job["phone"], *job["texts"])
+        subset = self._font_tools() is not None
+        for font_path in self.renderer.font_paths:
+            if subset:
+                data = self._subset(font_path, sorted(characters))
+                stem, extension = Path(font_path).stem, ".woff"
+            else:
+                with open(font_path, "rb") as f:
+                    data = f.read()
+                stem, extension = Path(font_path).stem, Path(font_path).suffix
+            # Named by content, so documents from earlier runs keep the subset they were written with
+            path = os.path.join(self.output_dir, self.ASSET_DIR, f"{stem}-{hashlib.sha1(data).hexdigest()[:12]}{extension}")
+            if not os.path.exists(path):
+                self._write_asset(path, data)
+            self.font_hrefs[font_path] = self._href(path)
+
+    def _family(self, font_path):
+        family = self._families.get(font_path)
+        if family is None:
+            family = self._families[font_path] = f"flyer-font-{len(self._families)}"
+        return family
+
+    def _embedded_font(self, font_path, characters):
+        key = (font_path, characters)
+        href = self._embedded.get(key)
+        if href is None:
+            data = base64.b64encode(self._subset(font_path, sorted(characters))).decode("ascii")
+            href = self._embedded[key] = f"data:font/woff;base64,{data}"
+            while len(self._embedded) > self.EMBED_CACHE:
+                self._embedded.popitem(last=False)
+        else:
+            self._embedded.move_to_end(key)
+        return href
+
+    def _photo_elements(self, photo):
+        x, y, width, height = self.settings["photo_box"]
+        if self.settings["photo_shape"] == "circle":
+            clip = f'<ellipse cx="{x + width / 2:g}" cy="{y + height / 2:g}" rx="{width / 2:g}" ry="{height / 2:g}"/>'
+        else:
+            radius = self.settings["photo_radius"]
+            clip = f'<rect x="{x}" y="{y}" width="{width}" height="{height}" rx="{radius}" ry="{radius}"/>'
+        return [
+            f'<clipPath id="photo-slot">{clip}</clipPath>',
+            f'<image xlink:href={quoteattr(self._href(photo))} x="{x}" y="{y}" width="{width}" height="{height}" '
+            f'preserveAspectRatio="xMidYMid slice" clip-path="url(#photo-slot)"/>',
+        ]
+
+    def document(self, name, phone, photo="", texts=()):
+        """The SVG (or HTML) text of one contact's flyer, with links relative to the output folder."""
+        if self.background_href is None:
+            raise RuntimeError("Call prepare() before writing documents.")
+        elements = [f'<image xlink:href={quoteattr(self.background_href)} width="{self.width}" height="{self.height}"/>']
+        if photo and self.renderer.photos:
+            elements += self._photo_elements(photo)
+
+        fields = list(self.renderer.paragraph_fields(texts))
+        fields += [(self.renderer, text, position) for text, position in self.renderer.text_fields(name, phone)]
+        classes = {}
+        used = {}
+        for renderer, text, position in fields:
+            for operation in renderer.layout_field(text, position, measure=False)[0]:
+                if operation[0] == "line":
+                    _, ((x1, y), (x2, _)), fill = operation
+                    elements.append(f'<rect x="{x1}" y="{y}" width="{x2 - x1 + 1}" height="1" fill={quoteattr(fill)}/>')
+                    continue
+                _, (x, y), fill, run, font, layout = operation
+                style = classes.setdefault((font.path, font.size), f"t{len(classes)}")
+                used.setdefault(font.path, set()).update(run)
+                extra = ""
+                if layout is not None:
+                    direction, language = layout
+                    extra = f' direction="{direction}"' + (f' xml:lang={quoteattr(language)}' if language else "")
+                    if direction == "rtl":
+                        # Right-to-left runs start at their right edge
+                        x += font.getlength(run, direction=direction, language=language)
+                elements.append(f'<text class="{style}" x="{x:g}" y="{y + font.getmetrics()[0]}" '
+                                f'fill={quoteattr(fill)}{extra}>{escape(run)}</text>')
+
+        rules = ["text{white-space:pre}"]
+        for font_path in used:
+            if self.embed_fonts:
+                href = self._embedded_font(font_path, frozenset(used[font_path]))
+            else:
+                href = self.font_hrefs[font_path]
+            rules.append(f"@font-face{{font-family:{self._family(font_path)};src:url({href})}}")
+        for (font_path, size), style in classes.items():
+            rules.append(f".{style}{{font-family:{self._family(font_path)};font-size:{size}px}}")
+        svg = (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+               f'width="{self.width}" height="{self.height}" viewBox="0 0 {self.width} {self.height}">\n'
+               f'<style>{"".join(rules)}</style>\n' + "\n".join(elements) + "\n</svg>\n")
+        if self.settings["output_format"] == "svg":
+            return svg
+        return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+                '<meta name="viewport" content="width=device-width, initial-scale=1">'
+                f'<title>{escape(name)}</title>'
+                '<style>body{margin:0}svg{display:block;max-width:100%;height:auto}</style>'
+                f'</head><body>\n{svg}</body></html>\n')
+
+    def write(self, path, name, phone, photo="", texts=()):
+        """Write one contact's document to ``path``, first detaching it if it is a shared hard link."""
+        data = self.document(name, phone, photo, texts).encode("utf-8")
+        try:
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def _resolve(self, href):
+        if href.startswith("file:"):
+            return unquote(urlparse(href).path)
+        return os.path.join(self.output_dir, unquote(href))
+
+    def rasterize(self, path):
+        """
+        Turn a written document back into an RGB image. cairosvg is used when it is
+        installed; otherwise the document's elements are drawn with Pillow from the
+        fonts and images it links or embeds, which checks everything the document
+        states (positions, baselines, sizes, colours, the shipped font subsets)
+        short of a browser's own text rendering. Returns (image, method), method
+        being "cairosvg" or "replay". Raises ValueError for a document it cannot read.
+        """
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if "<svg" not in text or "</svg>" not in text:
+            raise ValueError(f"{path} contains no <svg> element")
+        svg = text[text.index("<svg"):text.rindex("</svg>") + len("</svg>")]
+        try:
+            import cairosvg
+            data = cairosvg.svg2png(bytestring=svg.encode("utf-8"), url=path)
+            with Image.open(io.BytesIO(data)) as image:
+                image = image.convert("RGBA")
+            canvas = Image.new("RGBA", image.size, "white")
+            return Image.alpha_composite(canvas, image).convert("RGB"), "cairosvg"
+        except (ImportError, OSError):
+            pass
+
+        namespaces = {"svg": "http://www.w3.org/2000/svg"}
+        link = "{http://www.w3.org/1999/xlink}href"
+        try:
+            root = ElementTree.fromstring(svg)
+        except ElementTree.ParseError as e:
+            raise ValueError(f"Could not read {path}: {e}")
+        css = "".join(element.text or "" for element in root.iter(f"{{{namespaces['svg']}}}style"))
+        fonts = {}
+        sizes = {}
+        for family, source in re.findall(
+                r"@font-face\s*\{\s*font-family:\s*['\"]?([\w-]+)['\"]?\s*;\s*src:\s*url\(\s*['\"]?([^)'\"]*)", css):
+            fonts[family] = io.BytesIO(base64.b64decode(source.split(",", 1)[1])) if source.startswith("data:") else self._resolve(source)
+        for style, family, size in re.findall(
+                r"\.([\w-]+)\s*\{\s*font-family:\s*['\"]?([\w-]+)['\"]?\s*;\s*font-size:\s*(\d+(?:\.\d+)?)px", css):
+            sizes[style] = (family, int(round(float(size))))
+
+        image = Image.new("RGB", (int(root.get("width")), int(root.get("height"))), "white")
+        draw = ImageDraw.Draw(image)
+        loaded = {}
+        for element in root:
+            tag = element.tag.split("}")[1]
+            if tag == "image":
+                source = self._resolve(element.get(link))
+                if element.get("clip-path"):
+                    slot = self.renderer.photos.get(source)
+                    image.paste(slot, (int(element.get("x")), int(element.get("y"))), slot)
+                else:
+                    with Image.open(source) as background:
+                        image.paste(background.convert("RGB"), (0, 0))
+            elif tag == "rect":
+                x, y = int(element.get("x")), int(element.get("y"))
+                draw.rectangle((x, y, x + int(element.get("width")) - 1, y + int(element.get("height")) - 1),
+                               fill=element.get("fill"))
+            elif tag == "text":
+                if element.get("class") not in sizes or sizes[element.get("class")][0] not in fonts:
+                    raise ValueError(f"{path}: no font is declared for text style {element.get('class')!r}")
+                family, size = sizes[element.get("class")]
+                direction = element.get("direction")
+                key = (family, size, direction is not None)
+                font = loaded.get(key)
+                if font is None:
+                    source = fonts[family]
+                    if isinstance(source, io.BytesIO):
+                        source.seek(0)
+                    engine = ImageFont.Layout.RAQM if direction and HAS_RAQM else ImageFont.Layout.BASIC
+                    font = loaded[key] = ImageFont.truetype(source, size, layout_engine=engine)
+                options = {}
+                if direction and HAS_RAQM:
+                    options = {"direction": direction, "language": element.get("{http://www.w3.org/XML/1998/namespace}lang")}
+                anchor = "rs" if direction == "rtl" else "ls"
+                draw.text((float(element.get("x")), int(element.get("y"))), element.text or "",
+                          fill=element.get("fill"), font=font, anchor=anchor, **options)
+        return image, "replay"
+
+    def compare(self, path, name, phone, photo="", texts=()):
+        """
+        Pixel-diff a written document against the raster renderer's flyer for the same contact.
+        Returns a dictionary with the method used, the largest and mean channel
+        difference and the fraction of pixels differing by more than DIFF_THRESHOLD.
+        """
+        raster = self.renderer.draw(name, phone, photo, texts).convert("RGB")
+        vector, method = self.rasterize(path)
+        if vector.size != raster.size:
+            vector = vector.resize(raster.size, Image.Resampling.LANCZOS)
+        difference = np.asarray(ImageChops.difference(raster, vector)).max(axis=2)
+        return {
+            "method": method,
+            "max": int(difference.max()),
+            "mean": float(difference.mean()),
+            "changed": float((difference > self.DIFF_THRESHOLD).mean()),
+        }
+
+
+class FlyerBatch:
+    """Renders a list of contacts to flyer files in the output directory.
+
+    Rows that would produce identical flyers are rendered once. The other
+    rows are materialized as set by ``duplicates``: "hardlink", "reflink",
+    "copy", or "index" to only record them in the manifest.
+    """
+
+    CHUNK_SIZE = 16
+    MANIFEST_NAME = "flyers_manifest.csv"
+    # Rows rendered by a dry run (see estimate)
+    ESTIMATE_SAMPLE = 24
+    DUPLICATE_MODES = ("hardlink", "reflink", "copy", "index")
+    PARTITIONS = ("range", "hash")
+
+    def __init__(self, settings, output_dir, workers=1, duplicates="hardlink"):
+        if duplicates not in self.DUPLICATE_MODES:
+            raise ValueError(f"Unknown duplicate mode: {duplicates}")
+        self.settings = dict(DEFAULT_RENDER_SETTINGS, **settings)
+        # Checks the output format before anything is rendered
+        FlyerEncoder.from_settings(self.settings)
+        if self.settings["output_format"] == "png8" and os.path.exists(self.settings["background"]):
+            PaletteMapper.check(load_base_image(self.settings))
+        self.extension = output_extension(self.settings["output_format"])
+        self.output_dir = output_dir
+        self.workers = max(1, int(workers))
+        self.duplicates = duplicates
+
+    def render_key(self, job):
+        """Everything that makes one row's flyer differ from another's under the batch settings."""
+        return (job["name"], job["phone"], job["photo"], *job["texts"])
+
+    def build_jobs(self, contacts):
+        """
+        Turn (row, name, phone[, photo[, texts]]) contacts into job dictionaries.
+        The first row with a given file name keeps it; later rows get the row number appended.
+        """
+        jobs = []
+        taken = set()
+        for position, (row, name, phone, *extra) in enumerate(contacts):
+            filename = flyer_filename(name, self.extension)
+            if filename in taken:
+                filename = flyer_filename(name, self.extension, suffix=f"_{row}")
+            taken.add(filename)
+            jobs.append({
+                "position": position,
+                "row": row,
+                "name": name,
+                "phone": phone,
+                "photo": extra[0] if extra else "",
+                "texts": tuple(extra[1]) if len(extra) > 1 else (),
+                "path": os.path.join(self.output_dir, filename),
+            })
+        return jobs
+
+    def group_jobs(self, jobs):
+        """Split jobs into unique renders and (duplicate, source) pairs."""
+        sources = {}
+        unique = []
+        duplicates = []
+        for job in jobs:
+            source = sources.setdefault(self.render_key(job), job)
+            if source is job:
+                unique.append(job)
+            else:
+                duplicates.append((job, source))
+        return unique, duplicates
+
+    def partition(self, jobs, count, by="range"):
+        """
+        Deterministically split jobs into ``count`` shards, either by contiguous row
+        ranges or by a hash of the render key (which keeps duplicates in one shard).
+        """
+        shards = [[] for _ in range(count)]
+        if by == "range":
+            for job in jobs:
+                shards[job["position"] * count // len(jobs)].append(job)
+        elif by == "hash":
+            for job in jobs:
+                shards[zlib.crc32(repr(self.render_key(job)).encode("utf-8")) % count].append(job)
+        else:
+            raise ValueError(f"Unknown partition: {by}")
+        return shards
+
+    @staticmethod
+    def shard_manifest_name(index, count):
+        return f"flyers_manifest.shard-{index + 1}-of-{count}.csv"
+
+    def run(self, contacts, progress=None, cancelled=None, shard=None):
+        """Render all contacts and return a summary dictionary.
+
+        ``progress(done, name)`` is called after each flyer and
+        ``cancelled()`` is polled to stop early. ``shard`` is an optional
+        (index, count, partition) tuple; only that shard's rows are rendered
+        and they get their own manifest.
+        """
+        # File names are assigned over the whole file so that shards never collide
+        jobs = self.build_jobs(contacts)
+        manifest_name = self.MANIFEST_NAME
+        if shard is not None:
+            index, count, by = shard
+            jobs = self.partition(jobs, count, by)[index]
+            manifest_name = self.shard_manifest_name(index, count)
+        unique, duplicates = self.group_jobs(jobs)
+        results = {}
+        summary = self.render_jobs(unique, duplicates, progress, cancelled, results)
+        self.write_manifest(jobs, results, os.path.join(self.output_dir, manifest_name))
+        return summary
+
+    @staticmethod
+    def _strata(jobs):
+        """Group jobs by text length (short, medium, long) and script (ASCII or not) for sampling."""
+        def length(job):
+            return len(job["name"]) + sum(len(text) for text in job["texts"])
+
+        lengths = sorted(length(job) for job in jobs)
+        short, long = lengths[len(lengths) // 3], lengths[2 * len(lengths) // 3]
+        strata = {}
+        for job in jobs:
+            size = "short" if length(job) <= short else "long" if length(job) >= long else "medium"
+            script = "ascii" if (job["name"] + "".join(job["texts"])).isascii() else "unicode"
+            strata.setdefault((size, script), []).append(job)
+        return strata
+
+    def estimate(self, contacts, sample_size=ESTIMATE_SAMPLE, shard=None, seed=0):
+        """
+        Dry run: render, encode and write a stratified sample of the rows (short,
+        medium and long text, ASCII and other scripts) to a scratch file with the
+        batch settings, then extrapolate to the whole batch. Nothing is left in
+        the output folder. Returns a dictionary for describe_estimate.
+        """
+        jobs = self.build_jobs(contacts)
+        if shard is not None:
+            index, count, by = shard
+            jobs = self.partition(jobs, count, by)[index]
+        unique, duplicates = self.group_jobs(jobs)
+        vector = self.settings["output_format"] in VECTOR_FORMATS
+        large_image = not vector and uses_large_image_mode(self.settings)
+        processes = not vector and self.workers > 1 and len(unique) > self.CHUNK_SIZE
+        workers = min(self.workers, os.cpu_count() or 1) if processes else 1
+        stages = ("document", "write") if vector else ("layout", "draw", "encode", "write")
+        estimate = {
+            "rows": len(jobs), "unique": len(unique), "duplicates": len(duplicates), "sampled": 0,
+            "workers": workers, "processes": processes, "format": self.settings["output_format"],
+            "stage_seconds": dict.fromkeys(stages, 0.0), "setup_seconds": 0.0, "seconds": 0.0,
+            "bytes": 0, "peak_memory": 0,
+        }
+        # Measure on the output disk without creating the output folder
+        scratch_dir = os.path.abspath(self.output_dir)
+        while not os.path.isdir(scratch_dir):
+            scratch_dir = os.path.dirname(scratch_dir)
+        estimate["free_bytes"] = shutil.disk_usage(scratch_dir).free
+        if not unique:
+            return estimate
+
+        start = time.perf_counter()
+        encoder = canvas = writer = None
+        if vector:
+            writer = VectorFlyerWriter(self.settings, self.output_dir)
+            if writer.embed_fonts and writer._font_tools() is None:
+                raise ValueError("Embedding fonts needs fontTools (pip install fonttools).")
+            writer.background_href = ""
+            writer.font_hrefs = dict.fromkeys(writer.renderer.font_paths, "")
+            renderer = writer.renderer
+        else:
+            renderer = FlyerRenderer(self.settings)
+            encoder = FlyerEncoder.from_settings(self.settings)
+            encoder.prepare(renderer.background, renderer.ink_colors())
+            canvas = WorkingCanvas(renderer.background)
+        setup = time.perf_counter() - start
+
+        scratch = os.path.join(scratch_dir, f".flyer-estimate-{os.getpid()}.tmp")
+        patch_bytes = 0
+
+        def measure(job):
+            nonlocal patch_bytes
+            times = []
+            started = time.perf_counter()
+            if vector:
+                data = writer.document(job["name"], job["phone"], job["photo"], job["texts"]).encode("utf-8")
+                times.append(time.perf_counter() - started)
+            else:
+                boxes = renderer.field_boxes(job["name"], job["phone"], job["photo"], job["texts"])
+                times.append(time.perf_counter() - started)
+                renderer.draw_into(canvas.image, job["name"], job["phone"], job["photo"], job["texts"])
+                times.append(time.perf_counter() - sum(times) - started)
+                data = encoder.encode(canvas.image, boxes)
+                times.append(time.perf_counter() - sum(times) - started)
+                canvas.restore(boxes)
+                regions = [_clip_box(box, canvas.image.size) for box in boxes]
+                patch_bytes = max(patch_bytes, sum((r[2] - r[0]) * (r[3] - r[1]) for r in regions if r) * 4)
+            with open(scratch, "wb") as f:
+                f.write(data)
+            times.append(time.perf_counter() - sum(times) - started)
+            return times, len(data)
+
+        rng = random.Random(seed)
+        run_cache = SHAPED_RUNS.size
+        link_seconds = 0.0
+        try:
+            strata = self._strata(unique)
+            # Font loading and first-use caches are a one-off cost, not a per-flyer one
+            started = time.perf_counter()
+            measure(unique[0])
+            setup += time.perf_counter() - started
+            run_cache = SHAPED_RUNS.size
+            if processes:
+                # Workers repeat that setup on their own, after the template is shared with them
+                setup = self._measure_worker_start(unique[0], scratch, large_image)
+            for members in strata.values():
+                count = min(len(members), max(1, round(sample_size * len(members) / len(unique))))
+                totals = [0.0] * len(stages)
+                size = 0
+                for job in rng.sample(members, count):
+                    times, length = measure(job)
+                    totals = [total + seconds for total, seconds in zip(totals, times)]
+                    size += length
+                for stage, total in zip(stages, totals):
+                    estimate["stage_seconds"][stage] += total / count * len(members) / len(unique)
+                estimate["bytes"] += size / count * len(members)
+                estimate["sampled"] += count
+            if duplicates and self.duplicates in ("hardlink", "reflink"):
+                started = time.perf_counter()
+                try:
+                    os.link(scratch, f"{scratch}.link")
+                    os.remove(f"{scratch}.link")
+                except OSError:
+                    pass
+                link_seconds = time.perf_counter() - started
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+
+        flyer_bytes = estimate["bytes"] / len(unique)
+        flyer_seconds = sum(estimate["stage_seconds"].values())
+        if self.duplicates == "copy":
+            estimate["bytes"] += flyer_bytes * len(duplicates)
+            link_seconds = estimate["stage_seconds"]["write"]
+        elif self.duplicates == "index":
+            link_seconds = 0.0
+        if vector:
+            estimate["bytes"] += os.path.getsize(self.settings["background"])
+        # A manifest line is about the path, name and number plus a few fields
+        estimate["bytes"] += sum(len(job["path"]) + len(job["name"]) + len(job["phone"]) + 24 for job in jobs)
+        if processes:
+            # Worker processes start in parallel, as far as there are CPUs for them
+            setup *= max(1.0, self.workers / (os.cpu_count() or 1))
+        estimate["setup_seconds"] = setup
+        estimate["seconds"] = setup + flyer_seconds * len(unique) / workers + link_seconds * len(duplicates)
+
+        width, height = renderer.background.size
+        image_bytes = width * height * len(renderer.background.getbands())
+        shaped = min(SHAPED_RUNS.max_bytes, (SHAPED_RUNS.size - run_cache) / max(1, estimate["sampled"]) * len(unique))
+        if vector:
+            estimate["peak_memory"] = image_bytes
+        elif large_image:
+            # One shared mapping of the template, paged in as needed, and each worker's patches
+            estimate["peak_memory"] = image_bytes + workers * (patch_bytes + 2 * flyer_bytes + shaped)
+        elif processes:
+            estimate["peak_memory"] = image_bytes + workers * (image_bytes + 2 * flyer_bytes + shaped)
+        else:
+            estimate["peak_memory"] = 2 * image_bytes + 2 * flyer_bytes + shaped
+        estimate["bytes"] = int(estimate["bytes"])
+        estimate["peak_memory"] = int(estimate["peak_memory"])
+        return estimate
+
+    def _measure_worker_start(self, job, scratch, large_image):
+        """
+        Seconds from sharing the template to a fresh render process having written
+        its first flyer (``job``, to ``scratch``): the one-off cost of each worker.
+        """
+        started = time.perf_counter()
+        if large_image:
+            background = self._publish_large_background()
+        else:
+            background = MappedBackground(load_base_image(self.settings))
+        chunk = [(job["position"], job["name"], job["phone"], job["photo"], job["texts"], scratch)]
+        try:
+            with ProcessPoolExecutor(max_workers=1, initializer=_init_render_worker,
+                                     initargs=(self.settings, background.descriptor, large_image)) as executor:
+                executor.submit(_render_worker_jobs, chunk).result()
+        finally:
+            background.close()
+        return time.perf_counter() - started
+
+    @staticmethod
+    def describe_estimate(estimate):
+        """A few lines summarizing an estimate() for a confirmation dialog or the console."""
+        def size(count):
+            for unit in ("bytes", "KB", "MB", "GB"):
+                if count < 1024:
+                    return f"{count:.0f} {unit}" if unit == "bytes" else f"{count:.1f} {unit}"
+                count /= 1024
+            return f"{count:.1f} TB"
+
+        def duration(seconds):
+            if seconds < 10:
+                return f"{seconds:.1f} s"
+            if seconds < 60:
+                return f"{seconds:.0f} s"
+            if seconds < 3600:
+                return f"{seconds / 60:.0f} min"
+            return f"{seconds // 3600:.0f} h {seconds % 3600 / 60:.0f} min"
+
+        workers = estimate["workers"]
+        stages = ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in estimate["stage_seconds"].items())
+        setup = "start the worker processes" if estimate["processes"] else "load the template"
+        lines = [
+            f"Estimated time: about {duration(estimate['seconds'])}" + (f" with {workers} workers" if workers > 1 else "")
+            + f", including {duration(estimate['setup_seconds'])} to {setup}",
+            f"Disk: about {size(estimate['bytes'])} ({size(estimate['free_bytes'])} free)",
+            f"Peak memory: about {size(estimate['peak_memory'])}",
+            f"Per {estimate['format'].upper()} flyer: {stages}",
+            f"Based on {estimate['sampled']} sample renders of {estimate['unique']:,} unique flyers"
+            + (f"; {estimate['duplicates']:,} duplicate rows are not rendered again." if estimate["duplicates"] else "."),
+        ]
+        if estimate["bytes"] > estimate["free_bytes"]:
+            lines.append("WARNING: the output disk does not have enough free space.")
+        return "\n".join(lines)
+
+    def render_jobs(self, unique, duplicates, progress=None, cancelled=None, results=None):
+        """
+        Render ``unique`` jobs and materialize the (duplicate, source) pairs.
+        ``results`` maps job positions to how their file was made; it is filled in
+        place and may already hold rows finished earlier, such as unchanged sources.
+        """
+        summary = {
+            "total": len(unique) + len(duplicates),
+            "unique": len(unique),
+            "generated": 0,
+            "renders_saved": 0,
+            "failed": [],
+            "cancelled": False,
+        }
+        results = {} if results is None else results
+        progress = progress or (lambda done, name: None)
+        cancelled = cancelled or (lambda: False)
+
+        if self.settings["output_format"] in VECTOR_FORMATS:
+            # Documents are a few string joins each; processes would only add start-up time
+            if unique:
+                self._run_vector(unique, results, summary, progress, cancelled)
+        elif self.workers > 1 and len(unique) > self.CHUNK_SIZE:
+            self._run_processes(unique, results, summary, progress, cancelled)
+        elif unique:
+            self._run_in_process(unique, results, summary, progress, cancelled)
+
+        if not summary["cancelled"]:
+            self._materialize_duplicates(duplicates, results, summary, progress)
+        return summary
+
+    def _record(self, job, method, error, results, summary, progress):
+        if error is None:
+            results[job["position"]] = method
+            summary["generated"] += 1
+        else:
+            summary["failed"].append(f"{job['name']} ({error})")
+        progress(summary["generated"] + len(summary["failed"]) - 1, job["name"])
+
+    def _run_in_process(self, jobs, results, summary, progress, cancelled):
+        if uses_large_image_mode(self.settings):
+            self._run_in_place(jobs, results, summary, progress, cancelled)
+            return
+        renderer = FlyerRenderer(self.settings)
+        encoder = FlyerEncoder.from_settings(self.settings)
+        encoder.prepare(renderer.background, renderer.ink_colors())
+        # One working copy for the whole batch; each flyer only copies back its text regions
+        canvas = WorkingCanvas(renderer.background)
+        for job in jobs:
+            if cancelled():
+                summary["cancelled"] = True
+                break
+            boxes = []
+            try:
+                boxes = renderer.field_boxes(job["name"], job["phone"], job["photo"], job["texts"])
+                renderer.draw_into(canvas.image, job["name"], job["phone"], job["photo"], job["texts"])
+                save_flyer(canvas.image, job["path"], encoder, boxes)
+                self._record(job, "rendered", None, results, summary, progress)
+            except Exception as e:
+                self._record(job, None, e, results, summary, progress)
+            finally:
+                canvas.restore(boxes)
+
+    def _run_vector(self, jobs, results, summary, progress, cancelled):
+        writer = VectorFlyerWriter(self.settings, self.output_dir)
+        writer.prepare(jobs)
+        for job in jobs:
+            if cancelled():
+                summary["cancelled"] = True
+                break
+            try:
+                writer.write(job["path"], job["name"], job["phone"], job["photo"], job["texts"])
+                self._record(job, "rendered", None, results, summary, progress)
+            except Exception as e:
+                self._record(job, None, e, results, summary, progress)
+
+    def _run_in_place(self, jobs, results, summary, progress, cancelled):
+        """
+        Large-image mode: every flyer is drawn onto, saved from and restored in
+        a copy-on-write mapping of the background, so only the text regions
+        ever take up private memory.
+        """
+        background = self._publish_large_background()
+        try:
+            canvas = PatchCanvas(MappedBackground.attach(background.descriptor, copy_on_write=True))
+            renderer = FlyerRenderer(self.settings, background=canvas.image)
+            encoder = FlyerEncoder.from_settings(self.settings)
+            encoder.prepare(canvas.image, renderer.ink_colors())
+            for job in jobs:
+                if cancelled():
+                    summary["cancelled"] = True
+                    break
+                try:
+                    boxes = renderer.field_boxes(job["name"], job["phone"], job["photo"], job["texts"])
+                    canvas.prepare(boxes)
+                    renderer.draw_into(canvas.image, job["name"], job["phone"], job["photo"], job["texts"])
+                    save_flyer(canvas.image, job["path"], encoder, boxes)
+                    self._record(job, "rendered", None, results, summary, progress)
+                except Exception as e:
+                    self._record(job, None, e, results, summary, progress)
+                finally:
+                    canvas.restore()
+        finally:
+            # Drop the mapping before its file is removed
+            canvas = renderer = None
+            background.close()
+
+    def _publish_large_background(self):
+        # A private decode that is dropped as soon as it is written out. The file goes
+        # next to the output rather than into a temp directory that may live in RAM.
+        background = decode_background(self.settings["background"])
+        if self.settings["overlays"]:
+            if background.mode not in ("RGB", "RGBA"):
+                background = background.convert("RGB")
+            flatten_overlays(background, self.settings)
+        return MappedBackground(background, directory=self.output_dir)
+
+    def _run_processes(self, jobs, results, summary, progress, cancelled):
+        large_image = uses_large_image_mode(self.settings)
+        if large_image:
+            background = self._publish_large_background()
+        else:
+            background = MappedBackground(load_base_image(self.settings))
+        chunks = [
+            [(job["position"], job["name"], job["phone"], job["photo"], job["texts"], job["path"])
+             for job in jobs[i:i + self.CHUNK_SIZE]]
+            for i in range(0, len(jobs), self.CHUNK_SIZE)
+        ]
+        by_position = {job["position"]: job for job in jobs}
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_render_worker,
+                initargs=(self.settings, background.descriptor, large_image),
+            ) as executor:
+                futures = [executor.submit(_render_worker_jobs, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    if cancelled():
+                        summary["cancelled"] = True
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    for position, name, ok, error in future.result():
+                        self._record(by_position[position], "rendered", None if ok else error,
+                                     results, summary, progress)
+        finally:
+            background.close()
+
+    def _materialize_duplicates(self, duplicates, results, summary, progress):
+        for job, source in duplicates:
+            if source["position"] not in results:
+                self._record(job, None, "duplicate of a failed row", results, summary, progress)
+                continue
+            try:
+                method = materialize_duplicate(source["path"], job["path"], self.duplicates)
+                self._record(job, method, None, results, summary, progress)
+                summary["renders_saved"] += 1
+            except OSError as e:
+                self._record(job, None, e, results, summary, progress)
+
+    def merge_shards(self, contacts, count, by="range"):
+        """
+        Check that every shard rendered all of its rows and combine the shard manifests.
+
+        Returns a report of missing shards, rows and files. The combined manifest
+        is only written when nothing is missing.
+        """
+        report = {"rows": 0, "missing_shards": [], "missing_rows": [], "missing_files": []}
+        lines = []
+        for index, jobs in enumerate(self.partition(self.build_jobs(contacts), count, by)):
+            path = os.path.join(self.output_dir, self.shard_manifest_name(index, count))
+            if not os.path.exists(path):
+                report["missing_shards"].append(index + 1)
+                report["missing_rows"].extend(job["row"] for job in jobs)
+                continue
+            with open(path, newline="", encoding="utf-8") as f:
+                finished = {int(line["row"]): line for line in csv.DictReader(f)}
+            for job in jobs:
+                line = finished.get(job["row"])
+                if line is None:
+                    report["missing_rows"].append(job["row"])
+                elif not os.path.exists(os.path.join(self.output_dir, line["file"])):
+                    report["missing_files"].append(line["file"])
+                else:
+                    lines.append(line)
+
+        report["rows"] = len(lines)
+        report["complete"] = not (report["missing_shards"] or report["missing_rows"] or report["missing_files"])
+        if report["complete"]:
+            lines.sort(key=lambda line: int(line["row"]))
+            with open(os.path.join(self.output_dir, self.MANIFEST_NAME), "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=["row", "name", "number", "file", "method"])
+                writer.writeheader()
+                writer.writerows(lines)
+        return report
+
+    @classmethod
+    def read_manifest(cls, output_dir):
+        """Return {row: flyer path} from a batch manifest, or an empty dict if there is none."""
+        path = os.path.join(output_dir, cls.MANIFEST_NAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, newline="", encoding="utf-8") as f:
+            return {int(line["row"]): os.path.join(output_dir, line["file"]) for line in csv.DictReader(f)}
+
+    def write_manifest(self, jobs, results, path):
+        """Write one CSV line per finished row: which file holds its flyer and how it got there."""
+        sources = {}
+        for job in jobs:
+            sources.setdefault(self.render_key(job), job)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["row", "name", "number", "file", "method"])
+            for job in jobs:
+                method = results.get(job["position"])
+                if method is None:
+                    continue
+                holder = sources[self.render_key(job)] if method == "index" else job
+                writer.writerow([job["row"], job["name"], job["phone"], os.path.basename(holder["path"]), method])
+
+
+class FlyerWatcher:
+    """Keeps an output folder in step with a contact file that is being edited.
+
+    The data file, background and font files are polled for changes. Rows
+    are matched to the previous snapshot by their E.164 phone number and
+    only added or changed rows are rendered; flyers of deleted rows are
+    removed. A change to the background, the fonts or the render settings
+    re-renders every row. The snapshot is kept in the output folder, so a
+    restarted watcher carries on incrementally.
+    """
+
+    STATE_NAME = "watch_state.json"
+
+    def __init__(self, batch, data_path, validator, interval=1.0, row_filter=None, table=None):
+        self.batch = batch
+        self.data_path = data_path
+        self.validator = validator
+        self.interval = interval
+        self.row_filter = row_filter
+        self.table = table
+        self.state_path = os.path.join(batch.output_dir, self.STATE_NAME)
+        self._seen = None
+        self._synced = None
+        self._pending_settings = None
+        self._lock = threading.Lock()
+
+    def update_settings(self, settings):
+        """Switch to new render settings from another thread; they apply at the next poll."""
+        with self._lock:
+            self._pending_settings = dict(DEFAULT_RENDER_SETTINGS, **settings)
+
+    def style_files(self):
+        return template_files(self.batch.settings)
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def style_key(self):
+        """Fingerprint of everything every flyer depends on: the settings plus the background and font files."""
+        signatures = [self._signature(path) for path in self.style_files()]
+        payload = json.dumps([self.batch.settings, signatures], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def row_keys(phones):
+        """Key rows by phone number; repeats of a number are told apart by their occurrence."""
+        seen = {}
+        keys = []
+        for phone in phones:
+            count = seen[phone] = seen.get(phone, 0) + 1
+            keys.append(phone if count == 1 else f"{phone}#{count}")
+        return keys
+
+    def poll(self):
+        """
+        Sync if a watched file or the settings changed and the files have settled
+        (unchanged since the previous poll, so half-saved files are skipped).
+        Returns the sync summary, or None if there was nothing to do.
+        """
+        with self._lock:
+            settings, self._pending_settings = self._pending_settings, None
+        if settings is not None and settings != self.batch.settings:
+            self.batch.settings = settings
+            self._synced = None
+
+        signatures = [self._signature(path) for path in [self.data_path] + self.style_files()]
+        if signatures == self._synced:
+            return None
+        if signatures != self._seen:
+            self._seen = signatures
+            return None
+        # A file that fails to load stays failed until it changes again, so it is not retried
+        self._synced = signatures
+        try:
+            return self.sync()
+        except (ValueError, OSError) as e:
+            return {"error": str(e)}
+
+    def run(self, stop=None, on_sync=None):
+        """Poll every ``interval`` seconds until the ``stop`` event is set, reporting syncs to ``on_sync``."""
+        stop = stop or threading.Event()
+        while True:
+            summary = self.poll()
+            if summary is not None and on_sync:
+                on_sync(summary)
+            if stop.wait(self.interval):
+                return
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def sync(self, progress=None, cancelled=None):
+        """Bring the output folder up to date with the data file and return a summary dictionary."""
+        batch = self.batch
+        valid, rejected = self.validator.load(self.data_path, report_dir=batch.output_dir,
+                                              row_filter=self.row_filter, table=self.table)
+        contacts = batch_contacts(
+            valid, batch.settings["photo_column"], base_dir=os.path.dirname(os.path.abspath(self.data_path)),
+            text_columns=paragraph_columns(batch.settings)
+        )
+        jobs = batch.build_jobs(contacts)
+        keys = self.row_keys(valid['phone'])
+        state = self._load_state()
+        style = self.style_key()
+        full = state.get("style") != style
+        previous = {} if full else state.get("rows", {})
+
+        unique, duplicates = batch.group_jobs(jobs)
+        source_of = {job["position"]: source for job, source in duplicates}
+        fingerprints = {job["position"]: [list(batch.render_key(job)), job["path"]] for job in jobs}
+        results = {}
+        dirty = set()
+        for job, key in zip(jobs, keys):
+            old = previous.get(key)
+            is_source = job["position"] not in source_of
+            clean = (
+                old is not None
+                and old[0] == fingerprints[job["position"]]
+                and old[1] is not None
+                # A row that used to point at another row's file now needs its own
+                and not (is_source and old[1] == "index")
+                and (old[1] == "index" or os.path.exists(job["path"]))
+            )
+            if clean:
+                results[job["position"]] = old[1]
+            else:
+                dirty.add(job["position"])
+        # Duplicates follow their source, e.g. hard links to a file that was replaced
+        for job, source in duplicates:
+            if source["position"] in dirty and job["position"] not in dirty:
+                dirty.add(job["position"])
+                del results[job["position"]]
+
+        summary = batch.render_jobs(
+            [job for job in unique if job["position"] in dirty],
+            [(job, source) for job, source in duplicates if job["position"] in dirty],
+            progress=progress, cancelled=cancelled, results=results,
+        )
+
+        # Remove flyers whose rows are gone (or whose file name changed)
+        current_paths = {job["path"] for job in jobs}
+        removed = 0
+        for old_fingerprint, method in state.get("rows", {}).values():
+            path = old_fingerprint[1]
+            if method not in (None, "index") and path not in current_paths and os.path.exists(path):
+                os.remove(path)
+                removed += 1
+
+        batch.write_manifest(jobs, results, os.path.join(batch.output_dir, batch.MANIFEST_NAME))
+        rows = {key: [fingerprints[job["position"]], results.get(job["position"])] for job, key in zip(jobs, keys)}
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"style": style, "rows": rows}, f)
+
+        old_keys = set(state.get("rows", {}))
+        summary.update({
+            "full": full,
+            "rows": len(jobs),
+            "added": sum(1 for key in keys if key not in old_keys),
+            "changed": sum(1 for job, key in zip(jobs, keys) if job["position"] in dirty and key in old_keys),
+            "removed": len(old_keys - set(keys)),
+            "files_removed": removed,
+            "rejected": len(rejected),
+        })
+        return summary
+
+    @staticmethod
+    def describe(summary):
+        """One line for the status bar or console."""
+        stamp = time.strftime("%H:%M:%S")
+        if "error" in summary:
+            return f"{stamp} Could not update: {summary['error']}"
+        if summary["full"]:
+            text = f"{stamp} Rebuilt all {summary['rows']} rows"
+        else:
+            text = f"{stamp} {summary['added']} added, {summary['changed']} changed, {summary['removed']} removed"
+        text += f" ({summary['generated']} flyers written"
+        if summary["failed"]:
+            text += f", {len(summary['failed'])} failed"
+        return text + ")"
+
+
+class PreviewRowCache:
+    """Preview images of data rows for the row browser.
+
+    The selected row is drawn on demand; its neighbours are drawn on a
+    background thread into a small LRU, so stepping through the sheet only
+    has to display an image that already exists. Everything is dropped
+    when the renderer or the preview size changes.
+    """
+
+    CAPACITY = 16
+
+    def __init__(self):
+        self._images = OrderedDict()
+        self._key = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _use(self, renderer, size):
+        # Called with the lock held
+        if self._key != (renderer, size):
+            self._key = (renderer, size)
+            self._images.clear()
+
+    def get(self, renderer, size, contact):
+        """Return the preview of one (name, phone, photo, texts) contact, rendering it if needed."""
+        with self._lock:
+            self._use(renderer, size)
+            image = self._images.get(contact)
+            if image is not None:
+                self._images.move_to_end(contact)
+                return image
+        image = self._render(renderer, size, contact)
+        self._store(renderer, size, contact, image)
+        return image
+
+    def prefetch(self, renderer, size, contacts):
+        """Queue contacts for background rendering, replacing any earlier queue."""
+        with self._lock:
+            self._use(renderer, size)
+            # Rows queued for an earlier selection are no longer the neighbours
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            for contact in contacts:
+                if contact not in self._images:
+                    self._queue.put((renderer, size, contact))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            renderer, size, contact = self._queue.get()
+            with self._lock:
+                if self._key != (renderer, size) or contact in self._images:
+                    continue
+            try:
+                image = self._render(renderer, size, contact)
+            except Exception:
+                # The error shows up when the row is actually selected
+                continue
+            self._store(renderer, size, contact, image)
+
+    def _store(self, renderer, size, contact, image):
+        with self._lock:
+            if self._key == (renderer, size):
+                self._images[contact] = image
+                self._images.move_to_end(contact)
+                while len(self._images) > self.CAPACITY:
+                    self._images.popitem(last=False)
+
+    @staticmethod
+    def _render(renderer, size, contact):
+        name, phone, photo, texts = contact
+        if not photo and renderer.photos:
+            photo = renderer.photos.placeholder()
+        image = renderer.draw(name, phone, photo=photo, texts=texts)
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        return image
+
+
+class ContactSheet:
+    """Thumbnails of many rows, for checking a batch before running it.
+
+    Tiles are drawn directly at thumbnail scale: the background is decoded
+    once at tile size and the renderer uses scaled fonts and positions, so
+    a tile costs a few milliseconds instead of a full render and a
+    downscale. Tiles are rendered on a thread pool.
+    """
+
+    FILE_NAME = "contact_sheet.png"
+    TILE_WIDTH = 160
+    GAP = 8
+    LABEL_HEIGHT = 18
+
+    def __init__(self, settings, tile_width=TILE_WIDTH, workers=None):
+        settings = dict(DEFAULT_RENDER_SETTINGS, **settings)
+        width, height = image_size(settings["background"])
+        self.scale = tile_width / width
+        self.tile_size = (tile_width, max(1, int(round(height * self.scale))))
+        background = load_base_image(settings, self.tile_size)
+        self.renderer = FlyerRenderer.for_scale(settings, self.scale, background)
+        self._placeholder = self.renderer.photos.placeholder() if self.renderer.photos else None
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="contact-sheet")
+
+    @staticmethod
+    def select(contacts, count, sample=False, seed=None):
+        """The first ``count`` contacts, or a random sample of them in sheet order."""
+        if not sample or count >= len(contacts):
+            return list(contacts[:count])
+        return sorted(random.Random(seed).sample(list(contacts), count))
+
+    def render_tile(self, contact):
+        """Draw one (row, name, number[, photo[, texts]]) contact at tile size."""
+        _, name, number, *extra = contact
+        photo = extra[0] if extra and extra[0] and os.path.exists(extra[0]) else self._placeholder
+        return self.renderer.draw(name, number, photo=photo, texts=extra[1] if len(extra) > 1 else ())
+
+    def submit(self, contact):
+        return self.executor.submit(self.render_tile, contact)
+
+    def mosaic(self, contacts, columns=10):
+        """Render the contacts into one grid image, each tile labelled with its row."""
+        width, height = self.tile_size
+        cell_width, cell_height = width + self.GAP, height + self.LABEL_HEIGHT + self.GAP
+        rows = max(1, -(-len(contacts) // columns))
+        sheet = Image.new("RGB", (columns * cell_width + self.GAP, rows * cell_height + self.GAP), "white")
+        draw = ImageDraw.Draw(sheet)
+        for index, (contact, tile) in enumerate(zip(contacts, self.executor.map(self.render_tile, contacts))):
+            x = self.GAP + (index % columns) * cell_width
+            y = self.GAP + (index // columns) * cell_height
+            sheet.paste(tile.convert("RGB"), (x, y))
+            draw.text((x, y + height + 3), f"Row {contact[0]}", fill="black")
+        return sheet
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FontSampleCache:
+    """Small samples of text drawn in each font, for the font gallery.
+
+    Samples are drawn on a thread pool and kept in an LRU keyed by (font,
+    text, size, colour); the pending render is cached too, so a sample asked
+    for twice is drawn once, and scrolling back or reopening the gallery
+    shows finished images straight away.
+    """
+
+    SIZE = 28
+    PADDING = 6
+    MAX_WIDTH = 480
+    CAPACITY = 512
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                           thread_name_prefix="font-sample")
+        self._samples = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def row_height(cls, size=SIZE):
+        """Room for a sample of ``size``: most fonts' line height plus padding."""
+        return int(size * 1.5) + 2 * cls.PADDING
+
+    def render(self, font_path, text, size=SIZE, color="#000000"):
+        """Draw ``text`` in a font on a background that contrasts with ``color``."""
+        red, green, blue = ImageColor.getrgb(color)[:3]
+        background = "#303030" if 0.299 * red + 0.587 * green + 0.114 * blue > 186 else "white"
+        font = ImageFont.truetype(font_path, size)
+        right = font.getbbox(text)[2] if text else 0
+        ascent, descent = font.getmetrics()
+        image = Image.new("RGB", (min(self.MAX_WIDTH, max(1, right) + 2 * self.PADDING),
+                                  ascent + descent + 2 * self.PADDING), background)
+        ImageDraw.Draw(image).text((self.PADDING, self.PADDING), text, font=font, fill=color)
+        return image
+
+    def submit(self, font_path, text, size=SIZE, color="#000000"):
+        """A future for the sample image; finished and pending samples are shared."""
+        key = (font_path, text, size, color)
+        with self._lock:
+            future = self._samples.get(key)
+            if future is not None and not future.cancelled():
+                self._samples.move_to_end(key)
+                return future
+            future = self._samples[key] = self.executor.submit(self.render, font_path, text, size, color)
+            while len(self._samples) > self.CAPACITY:
+                self._samples.popitem(last=False)
+        return future
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FlyerService:
+    """Renders flyers on demand for the HTTP server mode.
+
+    Every template's renderer is built once and kept warm, so decoded
+    backgrounds, fonts and shaped text runs stay in memory between
+    requests. Renders run on a thread pool; identical requests arriving
+    together share one render, and recent outputs are kept in an LRU
+    bounded by bytes. ETags are derived from the render key, so clients
+    can revalidate without anything being drawn; an edited background or
+    font changes the key and rebuilds the renderer. Each render thread draws
+    on its own WorkingCanvas per template, so a request copies only its
+    text regions, not the whole background.
+    """
+
+    # Outputs are cached as served, at the fast compression level: a full-size
+    # flyer is 1-2 MB, so this holds a few dozen of them
+    CACHE_BYTES = 48 * 1024 * 1024
+    # On-demand responses favour latency over file size
+    PNG_COMPRESS_LEVEL = 1
+
+    def __init__(self, templates, workers=None, cache_bytes=CACHE_BYTES):
+        if not templates:
+            raise ValueError("At least one template is required.")
+        self.templates = {name: dict(DEFAULT_RENDER_SETTINGS, **settings) for name, settings in templates.items()}
+        self.cache_bytes = cache_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="render")
+        self.stats = {"requests": 0, "rendered": 0, "cache_hits": 0, "not_modified": 0}
+        self._outputs = OrderedDict()
+        self._output_bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._renderers = {}
+        self._canvases = threading.local()
+        for name in self.templates:
+            # Warm up: decode the background and load the fonts before the first request
+            self._template(name)
+
+    @staticmethod
+    def _signatures(settings):
+        return [(os.path.getmtime(path), os.path.getsize(path)) if os.path.exists(path) else None
+                for path in template_files(settings)]
+
+    def _template(self, template):
+        """
+        The (renderer, style key) of a template. The template's files are checked on
+        every call, so an edited background or font is picked up by the next request.
+        """
+        settings = self.templates[template]
+        signatures = self._signatures(settings)
+        with self._lock:
+            current = self._renderers.get(template)
+        if current is not None and current[2] == signatures:
+            return current[:2]
+        payload = json.dumps([settings, signatures], sort_keys=True, default=str)
+        current = (FlyerRenderer(settings), hashlib.sha1(payload.encode("utf-8")).hexdigest(), signatures)
+        with self._lock:
+            self._renderers[template] = current
+        return current[:2]
+
+    def etag(self, template, name, number, texts=(), style=None):
+        """The entity tag of a flyer: a hash of its template and text."""
+        key = "\0".join([style or self._template(template)[1], name, number, *texts])
+        return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def render(self, template, name, number, texts=()):
+        """Return (etag, png_bytes) for a flyer, from the cache when possible."""
+        renderer, style = self._template(template)
+        etag = self.etag(template, name, number, texts, style)
+        with self._lock:
+            self.stats["requests"] += 1
+            data = self._outputs.get(etag)
+            if data is not None:
+                self._outputs.move_to_end(etag)
+                self.stats["cache_hits"] += 1
+                return etag, data
+            future = self._pending.get(etag)
+            if future is None:
+                future = self._pending[etag] = self.executor.submit(self._render, renderer, template, name, number, texts)
+        try:
+            data = future.result()
+        finally:
+            with self._lock:
+                self._pending.pop(etag, None)
+        with self._lock:
+            if etag not in self._outputs:
+                self._outputs[etag] = data
+                self._output_bytes += len(data)
+                while self._output_bytes > self.cache_bytes and len(self._outputs) > 1:
+                    self._output_bytes -= len(self._outputs.popitem(last=False)[1])
+        return etag, data
+
+    def _canvas(self, renderer, template):
+        """The calling render thread's working copy of a template's current background."""
+        canvases = getattr(self._canvases, "by_template", None)
+        if canvases is None:
+            canvases = self._canvases.by_template = {}
+        canvas = canvases.get(template)
+        if canvas is None or canvas.pristine is not renderer.background:
+            canvas = canvases[template] = WorkingCanvas(renderer.background)
+        return canvas
+
+    def _render(self, renderer, template, name, number, texts):
+        canvas = self._canvas(renderer, template)
+        boxes = renderer.field_boxes(name, number, texts=texts)
+        try:
+            renderer.draw_into(canvas.image, name, number, texts=texts)
+            buffer = io.BytesIO()
+            canvas.image.save(buffer, format="PNG", compress_level=self.PNG_COMPRESS_LEVEL)
+        finally:
+            canvas.restore(boxes)
+        self.count("rendered")
+        return buffer.getvalue()
+
+
+class FlyerRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of FlyerService.
+
+    GET /flyer?name=...&number=...&template=... returns a PNG; repeated
+    text=... parameters fill the template's paragraph boxes in order.
+    GET /healthz returns the service counters as JSON.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        service = self.server.service
+        if url.path == "/healthz":
+            with service._lock:
+                stats = dict(service.stats, cached_outputs=len(service._outputs), cached_bytes=service._output_bytes)
+            self._send(200, json.dumps(stats).encode("utf-8"), "application/json")
+            return
+        if url.path != "/flyer":
+            self._send(404, b"Not found\n")
+            return
+
+        query = parse_qs(url.query)
+        name = query.get("name", [""])[0].strip()
+        number = query.get("number", [""])[0].strip()
+        template = query.get("template", ["default"])[0]
+        texts = tuple(query.get("text", []))
+        if not name or not number:
+            self._send(400, b"Both name and number are required\n")
+            return
+        if template not in service.templates:
+            self._send(404, f"Unknown template: {template}\n".encode("utf-8"))
+            return
+
+        etag = service.etag(template, name, number, texts)
+        if_none_match = self.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+            service.count("not_modified")
+            self._send(304, b"", headers={"ETag": etag})
+            return
+
+        try:
+            etag, data = service.render(template, name, number, texts)
+        except Exception as e:
+            self._send(500, f"Render failed: {e}\n".encode("utf-8"))
+            return
+        self._send(200, data, "image/png", {"ETag": etag, "Cache-Control": "no-cache"})
+
+    def _send(self, status, body, content_type="text/plain; charset=utf-8", headers=None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per-request logging would dominate the cost of cached responses
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ModernFlyerGeneratorApp:
+    """Enhanced flyer generation application with coordinate-based positioning and improved styling."""
+    
+    PREVIEW_NAME = "Coreprix"
+    PREVIEW_PHONE = "+91 90000 XXXXX"
+    PREVIEW_PARAGRAPH = ("Text from the data sheet is wrapped inside the paragraph box, "
+                         "aligned and cut off with an ellipsis once it runs out of lines.")
+    # Rows on each side of the selected one rendered ahead in the background
+    PREVIEW_PREFETCH = 3
+    
+    PARAGRAPH_ALIGN_OPTIONS = {
+        "Left": "left",
+        "Center": "center",
+        "Right": "right",
+    }
+    
+    PHOTO_SHAPE_OPTIONS = {
+        "Circle": "circle",
+        "Rounded rectangle": "rounded",
+    }
+    
+    DUPLICATE_OPTIONS = {
+        "Hard link": "hardlink",
+        "Reflink (copy-on-write)": "reflink",
+        "Copy": "copy",
+        "Manifest only": "index",
+    }
+    
+    OUTPUT_FORMAT_OPTIONS = {
+        "PNG": "png",
+        "PNG (8-bit palette)": "png8",
+        "JPEG": "jpeg",
+        "WebP": "webp",
+        "SVG (shared background)": "svg",
+        "HTML (shared background)": "html",
+    }
+    
+    LARGE_IMAGE_OPTIONS = {
+        "Auto": "auto",
+        "Always": "on",
+        "Never": "off",
+    }
+    
+    def __init__(self):
+        try:
+            ctk.set_appearance_mode("system")
+            ctk.set_default_color_theme("blue")
+        except AttributeError:
+            pass
+
+        # Create main window
+        self.root = ctk.CTk()
+        self.root.title("Enhanced Flyer Generator with WhatsApp")
+        self.root.geometry("1500x950")
+
+        # Configure grid layout
+        self.root.grid_columnconfigure(1, weight=1)
+        self.root.grid_rowconfigure(0, weight=1)
+
+        # State variables
+        self.bg_image_path = ctk.StringVar()
+        self.data_path = ctk.StringVar()
+        self.output_dir = ctk.StringVar()
+        
+        self.font_size = ctk.StringVar(value="36")
+        self.text_color = ctk.StringVar(value="#000000")
+        self.selected_font = ctk.StringVar()
+        
+        # Enhanced WhatsApp variables
+        self.whatsapp_message = ctk.StringVar(value="Hi {name}! Here's your personalized flyer.")
+        self.use_custom_message = ctk.BooleanVar(value=False)
+        self.image_caption = ctk.StringVar(value="Your personalized flyer!")
+        self.use_custom_caption = ctk.BooleanVar(value=False)
+        
+        # Text styling variables
+        self.text_bold = ctk.BooleanVar(value=False)
+        self.text_italic = ctk.BooleanVar(value=False)
+        self.text_underline = ctk.BooleanVar(value=False)
+        self.text_shadow = ctk.BooleanVar(value=False)
+        self.shadow_color = ctk.StringVar(value="#808080")
+        self.auto_contrast = ctk.BooleanVar(value=False)
+        
+        self.name_x = ctk.StringVar(value="500")
+        self.name_y = ctk.StringVar(value="1900")
+        self.phone_x = ctk.StringVar(value="490")
+        self.phone_y = ctk.StringVar(value="1970")
+        
+        self.default_country_code = ctk.StringVar(value="+91")
+        self.row_filter = ctk.StringVar(value="")
+        self.data_table = ctk.StringVar(value="")
+        self.fallback_fonts = ctk.StringVar(value="")
+        
+        # Photo slot settings
+        self.photo_column = ctk.StringVar(value="")
+        self.photo_x = ctk.StringVar(value="300")
+        self.photo_y = ctk.StringVar(value="1880")
+        self.photo_width = ctk.StringVar(value="150")
+        self.photo_height = ctk.StringVar(value="150")
+        self.photo_shape = ctk.StringVar(value="Circle")
+        self.paragraph_column = ctk.StringVar(value="")
+        self.paragraph_x = ctk.StringVar(value="100")
+        self.paragraph_y = ctk.StringVar(value="100")
+        self.paragraph_width = ctk.StringVar(value="600")
+        self.paragraph_height = ctk.StringVar(value="0")
+        self.paragraph_align = ctk.StringVar(value="Left")
+        self.paragraph_spacing = ctk.StringVar(value="1.2")
+        self.paragraph_max_lines = ctk.StringVar(value="3")
+        
+        # Output settings
+        self.worker_count = ctk.StringVar(value="1")
+        self.estimate_first = ctk.BooleanVar(value=True)
+        self.duplicate_mode = ctk.StringVar(value="Hard link")
+        self.large_image_mode = ctk.StringVar(value="Auto")
+        self.output_format = ctk.StringVar(value="PNG")
+        self.output_quality = ctk.StringVar(value="90")
+        self.max_file_kb = ctk.StringVar(value="")
+        self.allow_downscale = ctk.BooleanVar(value=False)
+        self.embed_fonts = ctk.BooleanVar(value=False)
+        self.watch_enabled = ctk.BooleanVar(value=False)
+        self.preview_row = ctk.StringVar(value="")
+        self.contact_sheet_count = ctk.StringVar(value="500")
+        self.contact_sheet_sample = ctk.BooleanVar(value=False)
+        self.preview_search = ctk.StringVar(value="")
+        
+        # WhatsApp automation - now using multi-instance manager
+        self.whatsapp_manager = WhatsAppAutomationManager(num_instances=4)  # Changed from 2 to 4
+        self.whatsapp_automation = self.whatsapp_manager.instances[0]  # For backward compatibility
+        
+        # Store the original image size for coordinate calculation
+        self.original_image_size = (0, 0)
+        self.scale_factor = 1.0
+        self.preview_offset = (0, 0)
+        self.preview_size = (0, 0)
+        self.preview_image_tk = None
+        self.progress_modal = None
+        self._renderer = None
+        self._preview_renderer = None
+        self._preview_background_cache = None
+        self._preview_images = PreviewRowCache()
+        self._font_samples = None
+        self._font_gallery = None
+        # Set while a batch estimate runs in the background, so Generate isn't started twice
+        self._estimating = False
+        self.overlays = []
+        self._preview_rows = None
+        self._preview_rows_key = None
+        self._preview_index = None
+        self._drag = None
+        self._position_vars = [(self.name_x, self.name_y), (self.phone_x, self.phone_y)]
+        self._watcher = None
+        self._watch_stop = None
+
+        # Define application folders
+        self.BASE_DIR = Path(__file__).parent
+        self.FONT_FOLDER = self.BASE_DIR / "fonts"
+        
+        # Create folders if they don't exist
+        self.FONT_FOLDER.mkdir(exist_ok=True)
+        
+        # Load all font files
+        self.font_options = []
+        for ext in ['*.ttf', '*.TTF', '*.otf', '*.OTF']:
+            self.font_options.extend([f.name for f in self.FONT_FOLDER.glob(ext)])
+        
+        # Add system fonts fallback
+        if not self.font_options:
+            self.font_options = ["arial.ttf", "calibri.ttf", "times.ttf", "helvetica.ttf"]
+
+        # Set default font
+        if self.font_options:
+            self.selected_font.set(str(self.FONT_FOLDER / self.font_options[0]))
+        else:
+            self.selected_font.set("arial.ttf")
+
+        self._setup_ui()
+        self.root.bind("<Configure>", self._on_resize)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
+
+    def _on_closing(self):
+        """Handle application closing."""
+        if self._font_samples is not None:
+            self._font_samples.close()
+        self.whatsapp_manager.close_all()
+        self.root.destroy()
+
+    def _load_background_image(self):
+        """Opens a file dialog for the user to select a background image."""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Image files", "*.jpg *.jpeg *.png *.gif *.bmp")]
+        )
+        if file_path:
+            self.bg_image_path.set(file_path)
+            self._update_preview()
+    
+    def _load_data_file(self):
+        """Opens a file dialog to select a data file (CSV, XLSX, SQLite or Parquet)."""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Data files", "*.csv *.xlsx *.db *.sqlite *.sqlite3 *.parquet")]
+        )
+        if file_path:
+            self.data_path.set(file_path)
+            self._preview_rows = None
+            self._preview_index = None
+            self._update_preview_row_label()
+    
+    def _select_output_dir(self):
+        """Opens a directory dialog for the user to select an output folder."""
+        dir_path = filedialog.askdirectory()
+        if dir_path:
+            self.output_dir.set(dir_path)
+    
+    def _add_fallback_font(self):
+        """Append a font file to the fallback font list."""
+        file_path = filedialog.askopenfilename(
+            initialdir=self.FONT_FOLDER,
+            filetypes=[("Font files", "*.ttf *.otf *.ttc")]
+        )
+        if file_path:
+            fonts = [name for name in self.fallback_fonts.get().split(";") if name.strip()]
+            self.fallback_fonts.set(";".join(fonts + [file_path]))
+            self._update_preview()
+
+    def _choose_color(self):
+        """Opens a color chooser dialog for selecting the text color."""
+        color = colorchooser.askcolor(title="Choose text color")[1]
+        if color:
+            self.text_color.set(color)
+            self._update_preview()
+    
+    def _choose_shadow_color(self):
+        """Opens a color chooser dialog for selecting the shadow color."""
+        color = colorchooser.askcolor(title="Choose shadow color")[1]
+        if color:
+            self.shadow_color.set(color)
+            self._update_preview()
+    
+    def _on_resize(self, event):
+        """Handles window resizing by updating the flyer preview."""
+        if self.bg_image_path.get():
+            self._update_preview()
+    
+    def _update_coordinates(self):
+        """Update preview when coordinates change."""
+        self._update_preview()
+    
+    def _update_preview(self):
+        """
+        Updates the preview image on the canvas by drawing a full preview
+        image in memory using PIL and then displaying it.
+        """
+        if not self.bg_image_path.get() or not os.path.exists(self.bg_image_path.get()):
+            self.status_label.configure(text="Please select a background image.", text_color="orange")
+            return
+
+        canvas_width = self.preview_canvas.winfo_width()
+        canvas_height = self.preview_canvas.winfo_height()
+
+        if canvas_width <= 1 or canvas_height <= 1:
+            self.root.after(50, self._update_preview)
+            return
+
+        try:
+            try:
+                settings = self._get_render_settings()
+            except ValueError:
+                messagebox.showerror("Input Error", "Please enter valid numeric values for positions and font size.")
+                return
+
+            # The header is enough to fit the preview; pixels are decoded by the renderer
+            img_width, img_height = image_size(settings["background"])
+            self.original_image_size = (img_width, img_height)
+            self.scale_factor = min(canvas_width / img_width, canvas_height / img_height)
+            new_width = int(img_width * self.scale_factor)
+            new_height = int(img_height * self.scale_factor)
+            self.preview_size = (max(1, new_width), max(1, new_height))
+            
+            # Render the selected row just like the final flyer, at preview size
+            renderer, _ = self._get_preview_renderer(settings)
+            resized_preview_image = self._preview_images.get(renderer, self.preview_size, self._preview_item())
+            self._prefetch_preview_rows(renderer)
+            
+            # Convert to a format Tkinter can display
             self.preview_image_tk = ImageTk.PhotoImage(resized_preview_image)
             
             # Clear the old canvas contents and display the new image
@@ -915,13 +5044,248 @@ class ModernFlyerGeneratorApp:
                 anchor="center", 
                 image=self.preview_image_tk
             )
+            self.preview_offset = ((canvas_width - new_width) // 2, (canvas_height - new_height) // 2)
             
             self.status_label.configure(text="Preview updated successfully", text_color="gray")
+            if self._watcher is not None:
+                self._watcher.update_settings(settings)
             
         except Exception as e:
             messagebox.showerror("Preview Error", f"An error occurred while updating preview: {e}")
             self.status_label.configure(text="Error updating preview", text_color="red")
     
+    def _preview_contact(self):
+        """The (name, phone) shown in the preview: the selected row, or a sample contact."""
+        if self._preview_index is None:
+            return self.PREVIEW_NAME, self.PREVIEW_PHONE
+        _, name, number, _, _ = self._preview_rows[self._preview_index]
+        return name, number
+
+    def _preview_item(self, index=None):
+        """The (name, phone, photo, texts) drawn for a browsed row, or for the sample contact."""
+        index = self._preview_index if index is None else index
+        if index is None:
+            texts = (self.PREVIEW_PARAGRAPH,) * len(self._paragraph_settings())
+            return self.PREVIEW_NAME, self.PREVIEW_PHONE, "", texts
+        _, name, number, _, texts = self._preview_rows[index]
+        return name, number, self._preview_photo(index), texts
+
+    def _preview_photo(self, index=None):
+        """The photo path of a browsed row, or "" to show the placeholder slot."""
+        index = self._preview_index if index is None else index
+        if index is None:
+            return ""
+        photo = self._preview_rows[index][3]
+        return photo if photo and os.path.exists(photo) else ""
+
+    def _prefetch_preview_rows(self, renderer):
+        """Render the rows around the selected one in the background."""
+        if self._preview_index is None:
+            return
+        indexes = []
+        for distance in range(1, self.PREVIEW_PREFETCH + 1):
+            for index in (self._preview_index + distance, self._preview_index - distance):
+                if 0 <= index < len(self._preview_rows):
+                    indexes.append(index)
+        contacts = [self._preview_item(index) for index in indexes]
+        self._preview_images.prefetch(renderer, self.preview_size, contacts)
+
+    def _get_preview_rows(self):
+        """
+        The data file's contacts as (row, name, number, photo, texts) tuples for the row
+        browser, reloaded when the file, country code, photo or paragraph columns change.
+        Raises ValueError if the file can't be read.
+        """
+        path = self.data_path.get()
+        if not path or not os.path.exists(path):
+            raise ValueError("Please select a data file to browse its rows.")
+        stat = os.stat(path)
+        text_columns = paragraph_columns({"paragraphs": self._paragraph_settings()})
+        key = (os.path.abspath(path), stat.st_mtime, stat.st_size, self.default_country_code.get(),
+               self.row_filter.get().strip(), self.data_table.get().strip(),
+               self.photo_column.get().strip(), tuple(text_columns))
+        if self._preview_rows is None or self._preview_rows_key != key:
+            valid, _ = self._load_contacts()
+            rows = batch_contacts(valid, self.photo_column.get().strip(), base_dir=os.path.dirname(path),
+                                  text_columns=text_columns)
+            self._preview_rows = [(row, name, number, extra[0] if extra else "", extra[1] if len(extra) > 1 else ())
+                                  for row, name, number, *extra in rows]
+            self._preview_rows_key = key
+            self._preview_index = None
+        if not self._preview_rows:
+            raise ValueError("No valid contacts found in the data file.")
+        return self._preview_rows
+
+    def _show_preview_row(self, index):
+        self._preview_index = index
+        self._update_preview_row_label()
+        self._update_preview()
+
+    def _update_preview_row_label(self):
+        if self._preview_index is None:
+            self.preview_row_label.configure(text="Showing a sample contact")
+            return
+        row, name, number, _, _ = self._preview_rows[self._preview_index]
+        self.preview_row_label.configure(
+            text=f"Row {row} ({self._preview_index + 1} of {len(self._preview_rows)}): {name}, {number}"
+        )
+        self.preview_row.set(str(row))
+
+    def _step_preview_row(self, step):
+        """Show the next (step=1) or previous (step=-1) row of the data file."""
+        try:
+            rows = self._get_preview_rows()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if self._preview_index is None:
+            index = 0 if step > 0 else len(rows) - 1
+        else:
+            index = min(max(self._preview_index + step, 0), len(rows) - 1)
+        self._show_preview_row(index)
+
+    def _jump_to_preview_row(self):
+        """Show the spreadsheet row typed in the row box, or the next valid one after it."""
+        try:
+            rows = self._get_preview_rows()
+            target = int(self.preview_row.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e) if self.data_path.get() else "Please select a data file.")
+            return
+        for index, (row, *_) in enumerate(rows):
+            if row >= target:
+                if row != target:
+                    self.status_label.configure(text=f"Row {target} was rejected; showing row {row}", text_color="orange")
+                self._show_preview_row(index)
+                return
+        messagebox.showerror("Error", f"There are no valid rows after row {target}.")
+
+    def _search_preview_rows(self):
+        """Show the next row whose name or number contains the search text."""
+        query = self.preview_search.get().strip().lower()
+        if not query:
+            return
+        try:
+            rows = self._get_preview_rows()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        digits = re.sub(r"\D", "", query)
+        start = 0 if self._preview_index is None else self._preview_index + 1
+        for offset in range(len(rows)):
+            index = (start + offset) % len(rows)
+            _, name, number, _, _ = rows[index]
+            if query in str(name).lower() or (digits and digits in re.sub(r"\D", "", str(number))):
+                self._show_preview_row(index)
+                return
+        self.status_label.configure(text=f"No row matches '{query}'", text_color="orange")
+
+    def _canvas_to_image(self, x, y):
+        """Convert preview canvas coordinates to background image coordinates."""
+        offset_x, offset_y = self.preview_offset
+        return (x - offset_x) / self.scale_factor, (y - offset_y) / self.scale_factor
+
+    def _image_to_canvas(self, x, y):
+        """Convert background image coordinates to preview canvas coordinates."""
+        offset_x, offset_y = self.preview_offset
+        return offset_x + x * self.scale_factor, offset_y + y * self.scale_factor
+
+    def _scaled_preview_background(self, renderer):
+        """The background scaled to the preview, cached until the background or scale changes."""
+        key = (id(renderer.background), self.preview_size, renderer.settings["photo_box"])
+        if self._preview_background_cache is None or self._preview_background_cache[0] != key:
+            scaled = renderer.background
+            if renderer.photos:
+                scaled = scaled.copy()
+                renderer.paste_photo(scaled, renderer.photos.placeholder())
+            if scaled.size != self.preview_size:
+                scaled = scaled.resize(self.preview_size, Image.Resampling.LANCZOS)
+            self._preview_background_cache = (key, ImageTk.PhotoImage(scaled))
+        return self._preview_background_cache[1]
+
+    def _on_preview_press(self, event):
+        """Start dragging a text field if the click lands on one."""
+        if self.preview_image_tk is None:
+            return
+        try:
+            settings = self._get_render_settings()
+            renderer, renderer_scale = self._get_preview_renderer(settings)
+        except (ValueError, OSError):
+            return
+        
+        # The renderer may work at preview resolution; sprites only need the remaining scaling
+        sprite_scale = self.scale_factor / renderer_scale
+        image_x, image_y = self._canvas_to_image(event.x, event.y)
+        image_x, image_y = image_x * renderer_scale, image_y * renderer_scale
+        fields = renderer.text_fields(*self._preview_contact())
+        sprites = [renderer.text_sprite(text, position) for text, position in fields]
+        hit = None
+        for index, (_, (left, top, right, bottom)) in enumerate(sprites):
+            if left <= image_x <= right and top <= image_y <= bottom:
+                hit = index
+        if hit is None:
+            return
+        
+        # Swap the full render for the cached background plus one movable sprite per field
+        self.preview_canvas.delete("all")
+        background_x, background_y = self._image_to_canvas(0, 0)
+        self.preview_canvas.create_image(
+            background_x, background_y, anchor="nw", image=self._scaled_preview_background(renderer)
+        )
+        items = []
+        photos = []
+        for sprite, (left, top, right, bottom) in sprites:
+            size = (max(1, int(sprite.width * sprite_scale)), max(1, int(sprite.height * sprite_scale)))
+            if size != sprite.size:
+                sprite = sprite.resize(size, Image.Resampling.LANCZOS)
+            photo = ImageTk.PhotoImage(sprite)
+            canvas_x, canvas_y = self._image_to_canvas(left / renderer_scale, top / renderer_scale)
+            items.append(self.preview_canvas.create_image(canvas_x, canvas_y, anchor="nw", image=photo))
+            photos.append(photo)
+        
+        self._drag = {
+            "field": hit,
+            "item": items[hit],
+            "photos": photos,
+            "origin": tuple(settings[("name_pos", "phone_pos")[hit]]),
+            "start": (event.x, event.y),
+            "last": (event.x, event.y),
+        }
+        self.preview_canvas.configure(cursor="fleur")
+
+    def _dragged_position(self, event):
+        start_x, start_y = self._drag["start"]
+        origin_x, origin_y = self._drag["origin"]
+        return (
+            int(round(origin_x + (event.x - start_x) / self.scale_factor)),
+            int(round(origin_y + (event.y - start_y) / self.scale_factor)),
+        )
+
+    def _on_preview_drag(self, event):
+        """Move the dragged sprite; no flyer rendering happens while dragging."""
+        if not self._drag:
+            return
+        last_x, last_y = self._drag["last"]
+        self.preview_canvas.move(self._drag["item"], event.x - last_x, event.y - last_y)
+        self._drag["last"] = (event.x, event.y)
+        
+        x_var, y_var = self._position_vars[self._drag["field"]]
+        x, y = self._dragged_position(event)
+        x_var.set(str(x))
+        y_var.set(str(y))
+
+    def _on_preview_release(self, event):
+        """Finish a drag and render the full-quality preview at the new position."""
+        if not self._drag:
+            return
+        x_var, y_var = self._position_vars[self._drag["field"]]
+        x, y = self._dragged_position(event)
+        x_var.set(str(x))
+        y_var.set(str(y))
+        self._drag = None
+        self.preview_canvas.configure(cursor="")
+        self._update_preview()
+
     def _get_text_bounds(self, text, font):
         """Calculate the actual bounds of the text for proper positioning."""
         try:
@@ -935,41 +5299,6 @@ class ModernFlyerGeneratorApp:
             # Fallback for font errors
             return len(text) * int(self.font_size.get()) * 0.6, int(self.font_size.get())
 
-    def _apply_text_effects(self, draw, text, position, font, color):
-        """Apply text effects like shadow, bold, underline, etc."""
-        x, y = position
-        
-        # Apply shadow effect
-        if self.text_shadow.get():
-            shadow_offset = max(2, int(self.font_size.get()) // 15)
-            draw.text((x + shadow_offset, y + shadow_offset), text, 
-                      fill=self.shadow_color.get(), font=font)
-        
-        # Simulate bold by drawing text multiple times with slight offsets
-        if self.text_bold.get():
-            for dx in range(1, 3):
-                for dy in range(1, 3):
-                    draw.text((x + dx, y + dy), text, fill=color, font=font)
-        
-        # Draw main text
-        draw.text((x, y), text, fill=color, font=font)
-        
-        # Apply underline effect
-        if self.text_underline.get():
-            try:
-                bbox = draw.textbbox((x, y), text, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                
-                underline_y = y + text_height + 2
-                underline_thickness = max(1, int(self.font_size.get()) // 20)
-                
-                for i in range(underline_thickness):
-                    draw.line([(x, underline_y + i), (x + text_width, underline_y + i)], 
-                              fill=color, width=1)
-            except:
-                pass
-    
     def _create_italic_font_image(self, text, font, color):
         """Create an italicized version of text by skewing the image."""
         try:
@@ -995,82 +5324,133 @@ class ModernFlyerGeneratorApp:
 
     def _generate_flyers(self):
         """Generate flyers and save them to the output directory."""
+        if self._estimating:
+            return
         if not all([self.bg_image_path.get(), self.data_path.get(), self.output_dir.get()]):
             messagebox.showerror("Error", "Please select a background image, a data file, and an output directory.")
             return
 
         try:
-            if self.data_path.get().endswith('.csv'):
-                df = pd.read_csv(self.data_path.get())
-            elif self.data_path.get().endswith('.xlsx'):
-                df = pd.read_excel(self.data_path.get())
-            else:
-                messagebox.showerror("Error", "Unsupported file type. Please select a .csv or .xlsx file.")
+            try:
+                valid, rejected = self._load_contacts(report_dir=self.output_dir.get())
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 return
 
-            df.columns = df.columns.str.lower().str.strip()
-            
-            if 'name' not in df.columns or 'number' not in df.columns:
-                messagebox.showerror("Error", 
-                    f"The data file must contain 'name' and 'number' columns.\n"
-                    f"Found columns: {', '.join(df.columns.tolist())}")
+            try:
+                settings = self._get_render_settings()
+                workers = int(self.worker_count.get() or 1)
+            except ValueError:
+                messagebox.showerror("Input Error", "Please enter valid numeric values for positions, font size and workers.")
                 return
-
-            if df.empty:
-                messagebox.showerror("Error", "The data file appears to be empty.")
+            
+            try:
+                valid_contacts = batch_contacts(
+                    valid, settings["photo_column"], base_dir=os.path.dirname(self.data_path.get()),
+                    text_columns=paragraph_columns(settings)
+                )
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 return
-
-            # Count valid contacts
-            valid_contacts = []
-            for index, row in df.iterrows():
-                name = str(row['name']).strip()
-                phone = str(row['number']).strip()
-                
-                if not name or name.lower() == 'nan' or not phone or phone.lower() == 'nan':
-                    continue
-                
-                valid_contacts.append((index, name, phone))
             
             if not valid_contacts:
                 messagebox.showerror("Error", "No valid contacts found in the data file.")
                 return
             
-            # Create and show progress modal
-            self.progress_modal = GenerationProgressModal(self.root, len(valid_contacts))
+            uncovered = ContactValidator().check_coverage(
+                valid, [settings["font_path"]] + settings["fallback_fonts"], report_dir=self.output_dir.get()
+            )
+            if len(uncovered):
+                example = uncovered.iloc[0]
+                if not messagebox.askyesno(
+                    "Missing Characters",
+                    f"{len(uncovered)} rows contain characters that no configured font can draw, "
+                    f"e.g. row {example['row']} ({example['missing']}). They would show as empty boxes.\n\n"
+                    f"See {ContactValidator.UNCOVERED_REPORT_NAME} and consider adding a fallback font. Continue anyway?"
+                ):
+                    return
+            
+            batch = FlyerBatch(
+                settings, self.output_dir.get(), workers=workers,
+                duplicates=self.DUPLICATE_OPTIONS[self.duplicate_mode.get()]
+            )
+            
+            def start_generation():
+                # Create and show progress modal
+                self.progress_modal = GenerationProgressModal(self.root, len(valid_contacts))
             
-            # Generate flyers in a separate thread to keep UI responsive
-            def generate_thread():
-                total_count = 0
-                cancelled = False
+                # Generate flyers in a separate thread to keep UI responsive
+                def generate_thread():
+                    try:
+                        summary = batch.run(
+                            valid_contacts,
+                            progress=lambda i, n: self.root.after(0, lambda: self.progress_modal.update_progress(i, n)),
+                            cancelled=lambda: self.progress_modal.cancelled,
+                        )
+                    except Exception as e:
+                        error_msg = f"Flyer generation failed: {e}"
+                        self.root.after(0, lambda: [
+                            self.progress_modal.destroy(),
+                            messagebox.showerror("Error", error_msg)
+                        ])
+                        return
                 
-                for index, name, phone in valid_contacts:
-                    if self.progress_modal.cancelled:
-                        cancelled = True
-                        break
-                    
-                    # Update progress in the UI thread
-                    self.root.after(0, lambda i=index, n=name: self.progress_modal.update_progress(i, n))
-                    
-                    flyer_image = self._draw_flyer(name, phone)
-                    if flyer_image:
-                        sanitized_name = re.sub(r'[^a-zA-Z0-9]', '', name)
-                        flyer_path = os.path.join(self.output_dir.get(), f"{sanitized_name}_flyer.png")
-                        flyer_image.save(flyer_path)
-                        total_count += 1
+                    total_count = summary["generated"]
+                    cancelled = summary["cancelled"]
+                    saved_note = (
+                        f"\n{summary['unique']} unique flyers rendered, {summary['renders_saved']} renders saved."
+                        if summary["renders_saved"] else ""
+                    )
+                    rejected_note = (
+                        f"\n\n{len(rejected)} rows were skipped, see {ContactValidator.REPORT_NAME}."
+                        if len(rejected) else ""
+                    )
                 
-                # Close the modal and show results in the UI thread
-                self.root.after(0, lambda: [
-                    self.progress_modal.destroy(),
-                    messagebox.showinfo(
-                        "Generation Complete", 
-                        f"Generated {total_count} flyers successfully!" if not cancelled 
-                        else f"Generation cancelled. {total_count} flyers were generated."
-                    ) if not cancelled or total_count > 0 else None
-                ])
+                    # Close the modal and show results in the UI thread
+                    self.root.after(0, lambda: [
+                        self.progress_modal.destroy(),
+                        messagebox.showinfo(
+                            "Generation Complete", 
+                            (f"Generated {total_count} flyers successfully!" if not cancelled 
+                             else f"Generation cancelled. {total_count} flyers were generated.") + saved_note + rejected_note
+                        ) if not cancelled or total_count > 0 else None
+                    ])
             
-            # Start the generation thread
-            thread = threading.Thread(target=generate_thread, daemon=True)
-            thread.start()
+                # Start the generation thread
+                thread = threading.Thread(target=generate_thread, daemon=True)
+                thread.start()
+
+            if not self.estimate_first.get():
+                start_generation()
+                return
+
+            def confirm(estimate):
+                self._estimating = False
+                self.status_label.configure(text="")
+                if messagebox.askyesno(
+                    "Batch Estimate",
+                    f"{FlyerBatch.describe_estimate(estimate)}\n\nGenerate {len(valid_contacts)} flyers now?",
+                    icon="warning" if estimate["bytes"] > estimate["free_bytes"] else "question"
+                ):
+                    start_generation()
+
+            def failed(error):
+                self._estimating = False
+                self.status_label.configure(text="")
+                messagebox.showerror("Error", f"Could not estimate the batch: {error}")
+
+            # Sample renders and the template encode take seconds on print-size templates
+            def estimate_thread():
+                try:
+                    estimate = batch.estimate(valid_contacts)
+                except Exception as e:
+                    self.root.after(0, lambda error=e: failed(error))
+                    return
+                self.root.after(0, lambda: confirm(estimate))
+
+            self._estimating = True
+            self.status_label.configure(text="Estimating time and disk use from a sample of rows...", text_color="gray")
+            threading.Thread(target=estimate_thread, daemon=True).start()
 
         except Exception as e:
             if hasattr(self, 'progress_modal') and self.progress_modal:
@@ -1125,38 +5505,21 @@ class ModernFlyerGeneratorApp:
         
         def send_messages():
             start_time = time.time()
+            sent_count = 0
+            failed_contacts = []
             try:
-                if self.data_path.get().endswith('.csv'):
-                    df = pd.read_csv(self.data_path.get())
-                elif self.data_path.get().endswith('.xlsx'):
-                    df = pd.read_excel(self.data_path.get())
-                else:
-                    self.root.after(0, lambda: self.progress_modal.show_final_report(0, [], time.time() - start_time))
-                    return
-
-                df.columns = df.columns.str.lower().str.strip()
-                
-                if 'name' not in df.columns or 'number' not in df.columns:
+                if not valid_contacts:
                     self.root.after(0, lambda: self.progress_modal.show_final_report(0, [], time.time() - start_time))
                     return
 
-                total_contacts = len(df)
-                sent_count = 0
-                failed_contacts = []
-                
                 # Use ThreadPoolExecutor to send messages in parallel using multiple instances
                 with ThreadPoolExecutor(max_workers=len(self.whatsapp_manager.instances)) as executor:
                     # Create a list of futures for each contact
                     futures = {}
-                    for index, row in df.iterrows():
-                        name = str(row['name']).strip()
-                        phone = str(row['number']).strip()
-                        
-                        if not name or name.lower() == 'nan' or not phone or phone.lower() == 'nan':
-                            continue
-                        
+                    flyer_files = FlyerBatch.read_manifest(self.output_dir.get())
+                    for index, (row, name, phone, e164) in enumerate(valid_contacts):
                         # Submit the task to the executor
-                        future = executor.submit(self._send_single_flyer, index, name, phone)
+                        future = executor.submit(self._send_single_flyer, index, name, phone, e164, flyer_files.get(row))
                         futures[future] = (index, name, phone)
                     
                     # Process completed futures as they finish
@@ -1194,7 +5557,7 @@ class ModernFlyerGeneratorApp:
         thread = threading.Thread(target=send_messages, daemon=True)
         thread.start()
     
-    def _send_single_flyer(self, index, name, phone):
+    def _send_single_flyer(self, index, name, phone, e164=None, flyer_path=None):
         """Send a single flyer to a contact using the next available instance."""
         # Get the next available WhatsApp instance
         instance = self.whatsapp_manager.get_next_instance()
@@ -1202,8 +5565,12 @@ class ModernFlyerGeneratorApp:
         if not instance.is_logged_in:
             return False
             
-        sanitized_name = re.sub(r'[^a-zA-Z0-9_\-]', '', name)
-        flyer_path = os.path.join(self.output_dir.get(), f"{sanitized_name}_flyer.png")
+        if not flyer_path:
+            # No manifest: look for the flyer in any of the output formats
+            sanitized_name = re.sub(r'[^a-zA-Z0-9_\-]', '', name)
+            candidates = [os.path.join(self.output_dir.get(), f"{sanitized_name}_flyer.{extension}")
+                          for _, extension in OUTPUT_FORMATS.values()]
+            flyer_path = next((path for path in candidates if os.path.exists(path)), candidates[0])
         
         if not os.path.exists(flyer_path):
             return False
@@ -1225,11 +5592,12 @@ class ModernFlyerGeneratorApp:
         # Method 3: If search fails, try direct URL method as last resort
         if not chat_opened:
             print(f"🔍 INSTANCE {instance.instance_id}: Search failed, trying URL method for: {phone}")
-            # Clean the phone number (remove spaces, special chars)
-            clean_phone = re.sub(r'[^\d+]', '', phone)
-            if not clean_phone.startswith('+'):
-                clean_phone = '+91' + clean_phone  # Assuming India, adjust as needed
-            chat_opened = instance.open_chat_via_url(clean_phone)
+            clean_phone = e164
+            if not clean_phone:
+                validator = ContactValidator(self.default_country_code.get())
+                clean_phone = validator.normalize_phones(pd.Series([phone]))[0]
+            if clean_phone:
+                chat_opened = instance.open_chat_via_url(clean_phone)
         
         if chat_opened:
             print(f"✅ INSTANCE {instance.instance_id}: Chat opened successfully for {name} ({phone})")
@@ -1292,76 +5660,123 @@ class ModernFlyerGeneratorApp:
             print(f"❌ INSTANCE {instance.instance_id}: Could not find {name} ({phone}) with any method")
             return False
         
+    def _get_row_filter(self):
+        """The RowFilter typed in the Files tab, or None; raises ValueError if it doesn't parse."""
+        expression = self.row_filter.get().strip()
+        return RowFilter(expression) if expression else None
+
+    def _load_contacts(self, report_dir=None):
+        """Read and validate the matching rows of the selected data file; returns (valid, rejected) DataFrames."""
+        validator = ContactValidator(self.default_country_code.get())
+        return validator.load(self.data_path.get(), report_dir=report_dir,
+                              row_filter=self._get_row_filter(), table=self.data_table.get().strip() or None)
+
     def _get_valid_contacts(self):
-        """Helper to get the number of valid contacts for the progress bar."""
+        """Helper to get the valid (row, name, number, E.164 phone) contacts for sending."""
         try:
-            if self.data_path.get().endswith('.csv'):
-                df = pd.read_csv(self.data_path.get())
-            elif self.data_path.get().endswith('.xlsx'):
-                df = pd.read_excel(self.data_path.get())
-            else:
-                return []
-            
-            df.columns = df.columns.str.lower().str.strip()
-            if 'name' not in df.columns or 'number' not in df.columns:
-                return []
-            
-            valid_contacts = []
-            for _, row in df.iterrows():
-                name = str(row['name']).strip()
-                phone = str(row['number']).strip()
-                if name and name.lower() != 'nan' and phone and phone.lower() != 'nan':
-                    valid_contacts.append(row)
-            return valid_contacts
+            valid, _ = self._load_contacts()
+            return list(zip(valid.index + 2, valid['name'], valid['number'], valid['phone']))
         except:
             return []
 
-    def _draw_flyer(self, name, phone):
+    def _get_render_settings(self):
         """
-        Enhanced flyer drawing with coordinate-based positioning and styling.
-        Draws directly to a Pillow Image object.
+        Snapshot the current UI state into a plain settings dictionary for FlyerRenderer.
+        Raises ValueError if a numeric field is invalid.
         """
-        try:
-            bg_image = Image.open(self.bg_image_path.get()).convert("RGBA")
-            draw = ImageDraw.Draw(bg_image)
-            
-            self.original_image_size = bg_image.size
-            
-            try:
-                font_size = int(self.font_size.get() or 36)
-                name_x = int(float(self.name_x.get() or 0))
-                name_y = int(float(self.name_y.get() or 0))
-                phone_x = int(float(self.phone_x.get() or 0))
-                phone_y = int(float(self.phone_y.get() or 0))
-            except ValueError:
-                messagebox.showerror("Input Error", "Please enter valid numeric values for positions and font size.")
-                return None
+        return {
+            "background": self.bg_image_path.get(),
+            "font_path": self._resolve_font(self.selected_font.get()),
+            "font_size": int(self.font_size.get() or 36),
+            "text_color": self.text_color.get(),
+            "shadow_color": self.shadow_color.get(),
+            "bold": self.text_bold.get(),
+            "italic": self.text_italic.get(),
+            "underline": self.text_underline.get(),
+            "shadow": self.text_shadow.get(),
+            "auto_contrast": self.auto_contrast.get(),
+            "name_pos": (int(float(self.name_x.get() or 0)), int(float(self.name_y.get() or 0))),
+            "phone_pos": (int(float(self.phone_x.get() or 0)), int(float(self.phone_y.get() or 0))),
+            "large_image": self.LARGE_IMAGE_OPTIONS[self.large_image_mode.get()],
+            "fallback_fonts": [
+                self._resolve_font(name.strip()) for name in self.fallback_fonts.get().split(";") if name.strip()
+            ],
+            "photo_column": self.photo_column.get().strip(),
+            "photo_box": (
+                int(float(self.photo_x.get() or 0)), int(float(self.photo_y.get() or 0)),
+                max(1, int(float(self.photo_width.get() or 1))), max(1, int(float(self.photo_height.get() or 1))),
+            ) if self.photo_column.get().strip() else None,
+            "photo_shape": self.PHOTO_SHAPE_OPTIONS[self.photo_shape.get()],
+            "overlays": [dict(layer) for layer in self.overlays],
+            "paragraphs": self._paragraph_settings(),
+            "output_format": self.OUTPUT_FORMAT_OPTIONS[self.output_format.get()],
+            "quality": int(float(self.output_quality.get() or 90)),
+            "max_bytes": int(float(self.max_file_kb.get() or 0) * 1024),
+            "allow_downscale": self.allow_downscale.get(),
+            "embed_fonts": self.embed_fonts.get(),
+        }
 
-            font_path = self.selected_font.get()
-            try:
-                font_file = Path(font_path)
-                if not font_file.exists():
-                    font_file = self.FONT_FOLDER / font_file.name
-                
-                font = ImageFont.truetype(str(font_file), font_size)
-            except Exception as e:
-                print(f"Font loading error: {e}. Using default font.")
-                font = ImageFont.load_default()
-            
-            text_color = self.text_color.get()
-            
-            # Apply styling to the text and draw it on the image
-            name_pos = (name_x, name_y)
-            phone_pos = (phone_x, phone_y)
-            
-            self._apply_text_effects(draw, name, name_pos, font, text_color)
-            self._apply_text_effects(draw, phone, phone_pos, font, text_color)
+    def _paragraph_settings(self):
+        """The paragraph box from the Position tab as a "paragraphs" setting (empty without a column)."""
+        if not self.paragraph_column.get().strip():
+            return []
+        return [{
+            "column": self.paragraph_column.get().strip(),
+            "box": [int(float(self.paragraph_x.get() or 0)), int(float(self.paragraph_y.get() or 0)),
+                    max(1, int(float(self.paragraph_width.get() or 1))), max(0, int(float(self.paragraph_height.get() or 0)))],
+            "align": self.PARAGRAPH_ALIGN_OPTIONS[self.paragraph_align.get()],
+            "line_spacing": float(self.paragraph_spacing.get() or 1.2),
+            "max_lines": max(0, int(float(self.paragraph_max_lines.get() or 0))),
+        }]
 
-            return bg_image
+    def _resolve_font(self, name):
+        """Return the path of a font given as a path or as a file name in the fonts folder."""
+        font_file = Path(name)
+        if not font_file.exists():
+            font_file = self.FONT_FOLDER / font_file.name
+        return str(font_file)
 
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during image processing: {e}")
-            return None
+    def _export_settings(self):
+        """Save the current render settings as JSON for the command-line interface."""
+        try:
+            settings = self._get_render_settings()
+        except ValueError:
+            messagebox.showerror("Input Error", "Please enter valid numeric values for positions and font size.")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json")]
+        )
+        if file_path:
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(settings, f, indent=2)
+            self.status_label.configure(text=f"Settings saved to {os.path.basename(file_path)}", text_color="gray")
+
+    def _get_renderer(self, settings):
+        """Return a renderer for the given settings, reusing the previous one if nothing changed."""
+        if self._renderer is None or self._renderer.settings != dict(DEFAULT_RENDER_SETTINGS, **settings):
+            self._renderer = FlyerRenderer(settings)
+        return self._renderer
+
+    def _get_preview_renderer(self, settings):
+        """
+        Return (renderer, scale) for drawing the preview at the current preview size.
+        Backgrounds larger than the preview are decoded straight to preview resolution
+        and drawn with scaled fonts and positions, so browsing rows only draws
+        preview-sized images and the preview never holds the full-size image.
+        """
+        if not uses_large_image_mode(settings) and self.scale_factor >= 1:
+            return self._get_renderer(settings), 1.0
+        
+        # Release any full-resolution background kept from an earlier preview
+        self._renderer = None
+        key = (settings, self.preview_size)
+        if self._preview_renderer is None or self._preview_renderer[0] != key:
+            background = load_base_image(settings, self.preview_size)
+            renderer = FlyerRenderer.for_scale(settings, self.scale_factor, background)
+            self._preview_renderer = (key, renderer, self.scale_factor)
+        return self._preview_renderer[1], self._preview_renderer[2]
 
     def _setup_ui(self):
         """Sets up the enhanced graphical user interface elements."""
@@ -1382,6 +5797,7 @@ class ModernFlyerGeneratorApp:
             ("Files", self._create_files_tab),
             ("Text Style", self._create_text_tab),
             ("Position", self._create_position_tab),
+            ("Output", self._create_output_tab),
             ("WhatsApp", self._create_whatsapp_tab)
         ]
 
@@ -1455,19 +5871,40 @@ class ModernFlyerGeneratorApp:
             highlightthickness=0
         )
         self.preview_canvas.grid(row=0, column=0, sticky="nsew")
+        self.preview_canvas.bind("<ButtonPress-1>", self._on_preview_press)
+        self.preview_canvas.bind("<B1-Motion>", self._on_preview_drag)
+        self.preview_canvas.bind("<ButtonRelease-1>", self._on_preview_release)
         
         self.instructions_label = ctk.CTkLabel(
             self.preview_frame,
-            text="Use X,Y coordinates in Position tab to move text elements",
+            text="Drag the name or phone on the preview, or use X,Y coordinates in the Position tab",
             text_color="gray"
         )
         self.instructions_label.grid(row=1, column=0, pady=5)
 
+        browser_frame = ctk.CTkFrame(self.preview_frame, fg_color="transparent")
+        browser_frame.grid(row=2, column=0, pady=(0, 5))
+        
+        ctk.CTkButton(browser_frame, text="< Prev", width=70, command=lambda: self._step_preview_row(-1)).pack(side="left", padx=5)
+        ctk.CTkLabel(browser_frame, text="Row:").pack(side="left")
+        row_entry = ctk.CTkEntry(browser_frame, textvariable=self.preview_row, width=60)
+        row_entry.pack(side="left", padx=5)
+        row_entry.bind("<Return>", lambda e: self._jump_to_preview_row())
+        ctk.CTkButton(browser_frame, text="Go", width=40, command=self._jump_to_preview_row).pack(side="left", padx=(0, 10))
+        search_entry = ctk.CTkEntry(browser_frame, textvariable=self.preview_search, width=160, placeholder_text="Name or number")
+        search_entry.pack(side="left", padx=5)
+        search_entry.bind("<Return>", lambda e: self._search_preview_rows())
+        ctk.CTkButton(browser_frame, text="Find", width=50, command=self._search_preview_rows).pack(side="left", padx=(0, 10))
+        ctk.CTkButton(browser_frame, text="Next >", width=70, command=lambda: self._step_preview_row(1)).pack(side="left", padx=5)
+        
+        self.preview_row_label = ctk.CTkLabel(self.preview_frame, text="Showing a sample contact", text_color="gray")
+        self.preview_row_label.grid(row=3, column=0, pady=(0, 5))
+
     def _create_files_tab(self, master):
         """Sets up the controls for file selection."""
         controls = [
             ("Background Image", self.bg_image_path, self._load_background_image),
-            ("Data File (.csv/.xlsx)", self.data_path, self._load_data_file),
+            ("Data File (.csv/.xlsx/.db/.parquet)", self.data_path, self._load_data_file),
             ("Output Directory", self.output_dir, self._select_output_dir)
         ]
 
@@ -1490,6 +5927,26 @@ class ModernFlyerGeneratorApp:
             width=80
         ).pack(side="right")
 
+        country_frame = ctk.CTkFrame(master, fg_color="transparent")
+        country_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(country_frame, text="Default Country Code", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        ctk.CTkEntry(country_frame, textvariable=self.default_country_code, width=80).pack(anchor="w")
+
+        filter_frame = ctk.CTkFrame(master, fg_color="transparent")
+        filter_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(filter_frame, text="Row Filter (optional)", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        ctk.CTkEntry(filter_frame, textvariable=self.row_filter,
+                     placeholder_text="city == 'Pune' and segment in ('gold', 'silver')").pack(fill="x")
+        ctk.CTkLabel(filter_frame, text="SQLite Table (optional)", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=(8, 2))
+        ctk.CTkEntry(filter_frame, textvariable=self.data_table, width=160, placeholder_text="contacts").pack(anchor="w")
+        ctk.CTkLabel(
+            country_frame,
+            text="Added to numbers without a +country prefix",
+            text_color="gray"
+        ).pack(anchor="w", pady=2)
+
     def _create_text_tab(self, master):
         """Enhanced text styling controls."""
         font_frame = ctk.CTkFrame(master, fg_color="transparent")
@@ -1509,9 +5966,36 @@ class ModernFlyerGeneratorApp:
             font_menu.pack(fill="x")
             if self.font_options:
                 font_menu.set(self.font_options[0])
+            self.font_menu = font_menu
+            ctk.CTkButton(font_frame, text="Browse Fonts...", command=self._show_font_gallery).pack(fill="x", pady=(5, 0))
         else:
             ctk.CTkLabel(font_frame, text="No fonts found in 'fonts' folder", text_color="red").pack()
 
+        fallback_frame = ctk.CTkFrame(master, fg_color="transparent")
+        fallback_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(fallback_frame, text="Fallback Fonts", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        
+        fallback_entry_frame = ctk.CTkFrame(fallback_frame, fg_color="transparent")
+        fallback_entry_frame.pack(fill="x")
+        
+        fallback_entry = ctk.CTkEntry(fallback_entry_frame, textvariable=self.fallback_fonts)
+        fallback_entry.pack(side="left", expand=True, fill="x", padx=(0, 5))
+        fallback_entry.bind("<FocusOut>", lambda e: self._update_preview())
+        
+        ctk.CTkButton(
+            fallback_entry_frame,
+            text="Add",
+            command=self._add_fallback_font,
+            width=80
+        ).pack(side="right")
+        ctk.CTkLabel(
+            fallback_frame,
+            text="Separate fonts with ';'. Characters the main font lacks\nare drawn with the first of these that has them.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
         size_frame = ctk.CTkFrame(master, fg_color="transparent")
         size_frame.pack(pady=10, fill="x")
         
@@ -1586,6 +6070,13 @@ class ModernFlyerGeneratorApp:
             width=100
         ).pack(side="right")
 
+        ctk.CTkCheckBox(
+            shadow_frame,
+            text="Auto contrast (colours picked from the background)",
+            variable=self.auto_contrast,
+            command=self._update_preview
+        ).pack(anchor="w", pady=2)
+
     def _create_position_tab(self, master):
         """Create coordinate-based positioning controls."""
         ctk.CTkLabel(master, text="Text Positioning", font=ctk.CTkFont(size=14, weight="bold")).pack(pady=10)
@@ -1655,6 +6146,161 @@ class ModernFlyerGeneratorApp:
         for i in range(3):
             positions_grid.grid_columnconfigure(i, weight=1)
 
+        photo_frame = ctk.CTkFrame(master, fg_color="transparent")
+        photo_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(photo_frame, text="Photo Slot", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w")
+        
+        photo_column_frame = ctk.CTkFrame(photo_frame, fg_color="transparent")
+        photo_column_frame.pack(fill="x", pady=5)
+        
+        ctk.CTkLabel(photo_column_frame, text="Column:", width=60).pack(side="left")
+        photo_column_entry = ctk.CTkEntry(photo_column_frame, textvariable=self.photo_column, placeholder_text="e.g. photo")
+        photo_column_entry.pack(side="left", expand=True, fill="x", padx=5)
+        photo_column_entry.bind("<KeyRelease>", lambda e: self._update_coordinates())
+        
+        for row_vars in (((" X:", self.photo_x), ("Y:", self.photo_y)),
+                         (("W:", self.photo_width), ("H:", self.photo_height))):
+            photo_coords_frame = ctk.CTkFrame(photo_frame, fg_color="transparent")
+            photo_coords_frame.pack(fill="x", pady=2)
+            for i, (label, variable) in enumerate(row_vars):
+                ctk.CTkLabel(photo_coords_frame, text=label.strip(), width=20).pack(side="left", padx=(10 if i else 0, 0))
+                entry = ctk.CTkEntry(photo_coords_frame, textvariable=variable, width=80)
+                entry.pack(side="left", padx=5)
+                entry.bind("<KeyRelease>", lambda e: self._update_coordinates())
+        
+        ctk.CTkComboBox(
+            photo_frame,
+            values=list(self.PHOTO_SHAPE_OPTIONS),
+            variable=self.photo_shape,
+            state="readonly",
+            command=lambda _: self._update_preview()
+        ).pack(fill="x", pady=5)
+        ctk.CTkLabel(
+            photo_frame,
+            text="Name a data column holding image paths (relative to\nthe data file) to add each contact's photo or logo.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+        paragraph_frame = ctk.CTkFrame(master, fg_color="transparent")
+        paragraph_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(paragraph_frame, text="Paragraph Box", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w")
+        
+        paragraph_column_frame = ctk.CTkFrame(paragraph_frame, fg_color="transparent")
+        paragraph_column_frame.pack(fill="x", pady=5)
+        
+        ctk.CTkLabel(paragraph_column_frame, text="Column:", width=60).pack(side="left")
+        paragraph_column_entry = ctk.CTkEntry(paragraph_column_frame, textvariable=self.paragraph_column, placeholder_text="e.g. offer")
+        paragraph_column_entry.pack(side="left", expand=True, fill="x", padx=5)
+        paragraph_column_entry.bind("<KeyRelease>", lambda e: self._update_coordinates())
+        
+        for row_vars in ((("X:", self.paragraph_x), ("Y:", self.paragraph_y)),
+                         (("W:", self.paragraph_width), ("H:", self.paragraph_height)),
+                         (("Lines:", self.paragraph_max_lines), ("Spacing:", self.paragraph_spacing))):
+            paragraph_coords_frame = ctk.CTkFrame(paragraph_frame, fg_color="transparent")
+            paragraph_coords_frame.pack(fill="x", pady=2)
+            for i, (label, variable) in enumerate(row_vars):
+                ctk.CTkLabel(paragraph_coords_frame, text=label, width=20).pack(side="left", padx=(10 if i else 0, 0))
+                entry = ctk.CTkEntry(paragraph_coords_frame, textvariable=variable, width=70)
+                entry.pack(side="left", padx=5)
+                entry.bind("<KeyRelease>", lambda e: self._update_coordinates())
+        
+        ctk.CTkComboBox(
+            paragraph_frame,
+            values=list(self.PARAGRAPH_ALIGN_OPTIONS),
+            variable=self.paragraph_align,
+            state="readonly",
+            command=lambda _: self._update_preview()
+        ).pack(fill="x", pady=5)
+        ctk.CTkLabel(
+            paragraph_frame,
+            text="Wraps a data column (offers, addresses) inside the box.\nH 0 = no height limit; Lines 0 = no line limit.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+        layers_frame = ctk.CTkFrame(master, fg_color="transparent")
+        layers_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(layers_frame, text="Static Layers", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w")
+        layer_buttons = ctk.CTkFrame(layers_frame, fg_color="transparent")
+        layer_buttons.pack(fill="x", pady=5)
+        ctk.CTkButton(layer_buttons, text="Add Image", width=90, command=self._add_image_layer).pack(side="left", padx=(0, 5))
+        ctk.CTkButton(layer_buttons, text="Add Text", width=90, command=self._add_text_layer).pack(side="left", padx=5)
+        ctk.CTkButton(layer_buttons, text="Remove Last", width=90, command=self._remove_last_layer).pack(side="left", padx=5)
+        self.layers_label = ctk.CTkLabel(
+            layers_frame,
+            text="Logos, QR codes or badges drawn on every flyer.\nThey are flattened into the background once per batch.",
+            text_color="gray",
+            justify="left"
+        )
+        self.layers_label.pack(anchor="w", pady=2)
+
+    def _ask_layer_box(self, prompt):
+        """Ask for "x,y" (or "x,y,width,height" when allowed); returns the numbers or None."""
+        value = ctk.CTkInputDialog(text=prompt, title="Layer Position").get_input()
+        if not value:
+            return None
+        try:
+            numbers = [int(float(part)) for part in value.split(",")]
+        except ValueError:
+            numbers = []
+        if len(numbers) not in (2, 4):
+            messagebox.showerror("Input Error", "Please enter x,y or x,y,width,height.")
+            return None
+        return numbers
+
+    def _add_image_layer(self):
+        """Add a logo, QR code or badge image drawn on every flyer."""
+        file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png *.jpg *.jpeg *.gif *.bmp *.webp")])
+        if not file_path:
+            return
+        box = self._ask_layer_box("Position as x,y (or x,y,width,height to resize):")
+        if box is None:
+            return
+        layer = {"type": "image", "path": file_path, "position": box[:2]}
+        if len(box) == 4:
+            layer["size"] = box[2:]
+        self.overlays.append(layer)
+        self._refresh_layers()
+
+    def _add_text_layer(self):
+        """Add fixed text, such as an offer's validity, in the current font and colour."""
+        text = ctk.CTkInputDialog(text="Text to show on every flyer:", title="Text Layer").get_input()
+        if not text:
+            return
+        box = self._ask_layer_box("Position as x,y:")
+        if box is None:
+            return
+        self.overlays.append({
+            "type": "text",
+            "text": text,
+            "position": box[:2],
+            "font_path": self._resolve_font(self.selected_font.get()),
+            "font_size": int(self.font_size.get() or 36),
+            "color": self.text_color.get(),
+        })
+        self._refresh_layers()
+
+    def _remove_last_layer(self):
+        if self.overlays:
+            self.overlays.pop()
+            self._refresh_layers()
+
+    def _refresh_layers(self):
+        descriptions = [
+            f"{os.path.basename(layer['path']) if layer['type'] == 'image' else repr(layer['text'])} "
+            f"at {tuple(layer['position'])}"
+            for layer in self.overlays
+        ]
+        self.layers_label.configure(
+            text="\n".join(descriptions) if descriptions else
+            "Logos, QR codes or badges drawn on every flyer.\nThey are flattened into the background once per batch."
+        )
+        self._update_preview()
+
     def _set_quick_position(self, position):
         """Set quick positioning presets."""
         if not self.bg_image_path.get():
@@ -1683,6 +6329,232 @@ class ModernFlyerGeneratorApp:
         except Exception as e:
             print(f"Error setting quick position: {e}")
 
+    def _create_output_tab(self, master):
+        """Controls for how flyers are rendered and written."""
+        workers_frame = ctk.CTkFrame(master, fg_color="transparent")
+        workers_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(workers_frame, text="Worker Processes", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        ctk.CTkEntry(workers_frame, textvariable=self.worker_count).pack(fill="x")
+        ctk.CTkLabel(
+            workers_frame,
+            text=f"Use more than 1 to render in parallel ({os.cpu_count()} CPUs detected).\n"
+                 "Workers share one memory-mapped copy of the background.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+        ctk.CTkCheckBox(
+            workers_frame, text="Estimate time and disk use before generating", variable=self.estimate_first
+        ).pack(anchor="w", pady=(5, 0))
+
+        format_frame = ctk.CTkFrame(master, fg_color="transparent")
+        format_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(format_frame, text="File Format", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        ctk.CTkComboBox(
+            format_frame,
+            values=list(self.OUTPUT_FORMAT_OPTIONS),
+            variable=self.output_format,
+            state="readonly"
+        ).pack(fill="x")
+        format_options = ctk.CTkFrame(format_frame, fg_color="transparent")
+        format_options.pack(fill="x", pady=5)
+        ctk.CTkLabel(format_options, text="Quality:").pack(side="left")
+        ctk.CTkEntry(format_options, textvariable=self.output_quality, width=50).pack(side="left", padx=5)
+        ctk.CTkLabel(format_options, text="Max KB:").pack(side="left")
+        ctk.CTkEntry(format_options, textvariable=self.max_file_kb, width=70).pack(side="left", padx=5)
+        ctk.CTkCheckBox(format_frame, text="Downscale if needed to fit", variable=self.allow_downscale).pack(anchor="w")
+        ctk.CTkCheckBox(format_frame, text="Embed fonts in each SVG/HTML file", variable=self.embed_fonts).pack(anchor="w", pady=(5, 0))
+        ctk.CTkLabel(
+            format_frame,
+            text="With Max KB, JPEG/WebP quality is lowered per flyer\njust enough to stay under the limit. SVG/HTML flyers\nlink one background file and hold only their text.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+        duplicates_frame = ctk.CTkFrame(master, fg_color="transparent")
+        duplicates_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(duplicates_frame, text="Duplicate Rows", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        ctk.CTkComboBox(
+            duplicates_frame,
+            values=list(self.DUPLICATE_OPTIONS),
+            variable=self.duplicate_mode,
+            state="readonly"
+        ).pack(fill="x")
+        ctk.CTkLabel(
+            duplicates_frame,
+            text=f"Identical flyers are rendered once. Every row is listed\nin {FlyerBatch.MANIFEST_NAME}.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+        large_frame = ctk.CTkFrame(master, fg_color="transparent")
+        large_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(large_frame, text="Large Images", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        ctk.CTkComboBox(
+            large_frame,
+            values=list(self.LARGE_IMAGE_OPTIONS),
+            variable=self.large_image_mode,
+            state="readonly",
+            command=lambda _: self._update_preview()
+        ).pack(fill="x")
+        ctk.CTkLabel(
+            large_frame,
+            text=f"Print-size backgrounds (over {LARGE_IMAGE_PIXELS // 1_000_000} MP on Auto) are\n"
+                 "previewed at screen size and drawn in place to save memory.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+        watch_frame = ctk.CTkFrame(master, fg_color="transparent")
+        watch_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkSwitch(
+            watch_frame,
+            text="Watch for changes",
+            variable=self.watch_enabled,
+            command=self._toggle_watch
+        ).pack(anchor="w")
+        ctk.CTkLabel(
+            watch_frame,
+            text="Re-renders only added or changed rows whenever the\ndata file, background or fonts are saved.",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+        sheet_frame = ctk.CTkFrame(master, fg_color="transparent")
+        sheet_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkLabel(sheet_frame, text="Contact Sheet", font=ctk.CTkFont(size=12, weight="bold")).pack(anchor="w", pady=2)
+        sheet_options = ctk.CTkFrame(sheet_frame, fg_color="transparent")
+        sheet_options.pack(fill="x")
+        ctk.CTkLabel(sheet_options, text="Rows:", width=40).pack(side="left")
+        ctk.CTkEntry(sheet_options, textvariable=self.contact_sheet_count, width=70).pack(side="left", padx=5)
+        ctk.CTkCheckBox(sheet_options, text="Random sample", variable=self.contact_sheet_sample).pack(side="left", padx=5)
+        ctk.CTkButton(
+            sheet_frame,
+            text="Show Contact Sheet",
+            command=self._show_contact_sheet
+        ).pack(fill="x", pady=5)
+
+        export_frame = ctk.CTkFrame(master, fg_color="transparent")
+        export_frame.pack(pady=10, fill="x")
+        
+        ctk.CTkButton(
+            export_frame,
+            text="Export Settings",
+            command=self._export_settings
+        ).pack(fill="x")
+        ctk.CTkLabel(
+            export_frame,
+            text="For headless or sharded runs:\nflyer_final generate --settings FILE --data ... --output ...",
+            text_color="gray",
+            justify="left"
+        ).pack(anchor="w", pady=2)
+
+    def _select_font(self, name):
+        """Use a font from the fonts folder, as if it had been picked in the font list."""
+        self.selected_font.set(str(self.FONT_FOLDER / name))
+        self.font_menu.set(name)
+        self._update_preview()
+
+    def _show_font_gallery(self):
+        """Open a list of every font drawing the preview name, rendered in the background as it scrolls."""
+        if self._font_gallery is not None and self._font_gallery.winfo_exists():
+            self._font_gallery.lift()
+            return
+        if self._font_samples is None:
+            self._font_samples = FontSampleCache()
+        color = self.text_color.get()
+        try:
+            ImageColor.getrgb(color)
+        except ValueError:
+            color = "#000000"
+        fonts = [(name, str(self.FONT_FOLDER / name)) for name in self.font_options]
+        self._font_gallery = FontGalleryWindow(
+            self.root, self._font_samples, fonts, self._preview_contact()[0], color,
+            selected=self._resolve_font(self.selected_font.get()), on_select=self._select_font
+        )
+
+    def _show_contact_sheet(self):
+        """Open a scrollable grid of thumbnails for the first N (or a random sample of) rows."""
+        if not all([self.bg_image_path.get(), self.data_path.get()]):
+            messagebox.showerror("Error", "Please select a background image and a data file.")
+            return
+        try:
+            settings = self._get_render_settings()
+            count = int(self.contact_sheet_count.get() or 0)
+        except ValueError:
+            messagebox.showerror("Input Error", "Please enter valid numeric values for positions, font size and rows.")
+            return
+        try:
+            valid, _ = self._load_contacts()
+            contacts = batch_contacts(valid, settings["photo_column"], base_dir=os.path.dirname(self.data_path.get()),
+                                      text_columns=paragraph_columns(settings))
+            sheet = ContactSheet(settings)
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if not contacts:
+            messagebox.showerror("Error", "No valid contacts found in the data file.")
+            return
+        
+        contacts = ContactSheet.select(contacts, max(1, count), sample=self.contact_sheet_sample.get())
+        ContactSheetWindow(self.root, sheet, contacts)
+
+    def _toggle_watch(self):
+        """Start or stop keeping the output folder in sync with the data file."""
+        if not self.watch_enabled.get():
+            if self._watch_stop is not None:
+                self._watch_stop.set()
+            self._watcher = self._watch_stop = None
+            self.status_label.configure(text="Stopped watching for changes", text_color="gray")
+            return
+        
+        if not all([self.bg_image_path.get(), self.data_path.get(), self.output_dir.get()]):
+            messagebox.showerror("Error", "Please select a background image, a data file, and an output directory.")
+            self.watch_enabled.set(False)
+            return
+        try:
+            settings = self._get_render_settings()
+            workers = int(self.worker_count.get() or 1)
+        except ValueError:
+            messagebox.showerror("Input Error", "Please enter valid numeric values for positions, font size and workers.")
+            self.watch_enabled.set(False)
+            return
+        
+        try:
+            batch = FlyerBatch(
+                settings, self.output_dir.get(), workers=workers,
+                duplicates=self.DUPLICATE_OPTIONS[self.duplicate_mode.get()]
+            )
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            self.watch_enabled.set(False)
+            return
+        try:
+            row_filter = self._get_row_filter()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            self.watch_enabled.set(False)
+            return
+        self._watcher = FlyerWatcher(batch, self.data_path.get(), ContactValidator(self.default_country_code.get()),
+                                     row_filter=row_filter, table=self.data_table.get().strip() or None)
+        self._watch_stop = threading.Event()
+        
+        def report(summary):
+            color = "red" if "error" in summary or summary.get("failed") else "gray"
+            self.root.after(0, lambda: self.status_label.configure(
+                text=f"Watching: {FlyerWatcher.describe(summary)}", text_color=color
+            ))
+        
+        threading.Thread(
+            target=self._watcher.run, kwargs={"stop": self._watch_stop, "on_sync": report}, daemon=True
+        ).start()
+        self.status_label.configure(text=f"Watching {os.path.basename(self.data_path.get())} for changes", text_color="gray")
+
     def _create_whatsapp_tab(self, master):
         """Enhanced WhatsApp automation controls with on/off switches."""
         instructions = ctk.CTkTextbox(master, height=100, wrap="word")
@@ -1830,8 +6702,408 @@ def check_dependencies():
     return True
 
 
+def _parse_point(value):
+    x, y = value.split(",")
+    return (int(float(x)), int(float(y)))
+
+
+def _parse_box(value):
+    x, y, width, height = value.split(",")
+    return (int(float(x)), int(float(y)), int(float(width)), int(float(height)))
+
+
+def build_arg_parser():
+    """Command-line interface for rendering without the GUI."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="flyer_final",
+        description="Enhanced Flyer Generator. Run without arguments to start the GUI."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_data_arguments(command):
+        command.add_argument("--data", required=True, help="Contact file (.csv, .xlsx, .db/.sqlite or .parquet)")
+        command.add_argument("--output", required=True, help="Output directory")
+        command.add_argument("--country-code", default="+91", help="Default country code for phone numbers")
+        command.add_argument("--photo-column", help="Data column with contact photo paths")
+        command.add_argument("--filter", dest="row_filter",
+                             help="Only use matching rows, e.g. \"city == 'Pune' and segment in ('gold', 'silver')\"")
+        command.add_argument("--table", help=f"Table of a SQLite file (default: its only table, "
+                                             f"or '{ContactValidator.DEFAULT_TABLE}')")
+
+    def add_shard_arguments(command):
+        command.add_argument("--shards", type=int, default=1, help="Total number of shards")
+        command.add_argument("--partition", choices=FlyerBatch.PARTITIONS, default="range",
+                             help="Split rows into shards by row range or by hash of the flyer content")
+
+    def add_render_arguments(command):
+        command.add_argument("--settings", help="JSON settings file exported from the GUI")
+        command.add_argument("--background", help="Background image")
+        command.add_argument("--font", help="Font file")
+        command.add_argument("--font-size", type=int)
+        command.add_argument("--text-color")
+        command.add_argument("--name-pos", type=_parse_point, help="X,Y of the name")
+        command.add_argument("--phone-pos", type=_parse_point, help="X,Y of the phone number")
+        command.add_argument("--photo-box", type=_parse_box, help="X,Y,WIDTH,HEIGHT of the photo slot")
+        command.add_argument("--photo-shape", choices=PhotoSlotCache.SHAPES)
+        command.add_argument("--fallback-font", dest="fallback_fonts", action="append",
+                             help="Font for characters the main font lacks (repeatable, tried in order)")
+        for effect in ("bold", "underline", "shadow"):
+            command.add_argument(f"--{effect}", action="store_true", default=None)
+        command.add_argument("--format", choices=list(OUTPUT_FORMATS) + list(VECTOR_FORMATS),
+                             help="Flyer file format (default png); svg and html share one background file")
+        command.add_argument("--auto-contrast", action="store_true", default=None,
+                             help="Choose each field's text and shadow colour from the background under it")
+        command.add_argument("--embed-fonts", action="store_true", default=None,
+                             help="Embed a font subset in every svg/html flyer instead of shared font files")
+        command.add_argument("--quality", type=int, help="JPEG/WebP quality, the most used under --max-kb")
+        command.add_argument("--max-kb", type=float, help="Keep each JPEG/WebP flyer under this many kilobytes")
+        command.add_argument("--allow-downscale", action="store_true", default=None,
+                             help="Shrink flyers that don't fit --max-kb even at the lowest quality")
+
+    def add_batch_arguments(command):
+        command.add_argument("--workers", type=int, default=1, help="Worker processes per shard")
+        command.add_argument("--duplicates", choices=FlyerBatch.DUPLICATE_MODES, default="hardlink")
+
+    generate = commands.add_parser("generate", help="Render flyers for a contact file")
+    add_data_arguments(generate)
+    add_shard_arguments(generate)
+    add_render_arguments(generate)
+    add_batch_arguments(generate)
+    generate.add_argument("--shard-index", type=int, help="Render only this shard (0-based)")
+    generate.add_argument("--local-shards", action="store_true",
+                          help="Run every shard as a separate local process, then merge")
+    generate.add_argument("--check-rows", type=int, default=0,
+                          help="Pixel-diff this many svg/html flyers against the raster renderer "
+                                "(needs cairosvg; exits with 2 if it is missing)")
+    generate.add_argument("--dry-run", action="store_true",
+                          help="Render a sample of rows and estimate time, disk and memory instead of generating")
+    generate.add_argument("--sample-rows", type=int, default=FlyerBatch.ESTIMATE_SAMPLE,
+                          help="Rows rendered by --dry-run")
+
+    merge = commands.add_parser("merge-shards", help="Check shard manifests and combine them")
+    add_data_arguments(merge)
+    add_shard_arguments(merge)
+    merge.add_argument("--text-column", action="append", default=[], dest="text_columns",
+                       help="Paragraph column the shards were rendered with (repeatable, in box order)")
+    merge.add_argument("--format", choices=list(OUTPUT_FORMATS) + list(VECTOR_FORMATS), default="png",
+                       help="Flyer file format of the shards")
+
+    watch = commands.add_parser("watch", help="Keep the output up to date while the data file is edited")
+    add_data_arguments(watch)
+    add_render_arguments(watch)
+    add_batch_arguments(watch)
+    watch.add_argument("--interval", type=float, default=1.0, help="Seconds between checks for changes")
+
+    sheet = commands.add_parser("contact-sheet", help="Render a grid of thumbnails for checking a batch")
+    add_data_arguments(sheet)
+    add_render_arguments(sheet)
+    sheet.add_argument("--count", type=int, default=500, help="Number of rows on the sheet")
+    sheet.add_argument("--sample", action="store_true", help="Pick a random sample of rows instead of the first ones")
+    sheet.add_argument("--seed", type=int, help="Random seed for --sample")
+    sheet.add_argument("--columns", type=int, default=10)
+    sheet.add_argument("--tile-width", type=int, default=ContactSheet.TILE_WIDTH, help="Thumbnail width in pixels")
+
+    serve = commands.add_parser("serve", help="Render flyers on demand over HTTP")
+    add_render_arguments(serve)
+    serve.add_argument("--template", action="append", default=[], metavar="NAME=SETTINGS",
+                       help="Named template from a JSON settings file (repeatable); "
+                            "the render options above form the 'default' template")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--threads", type=int, help="Concurrent renders (default: CPU count)")
+    serve.add_argument("--cache-mb", type=int, default=FlyerService.CACHE_BYTES // (1024 * 1024),
+                       help="Memory for recently rendered flyers")
+    serve.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+
+def _settings_from_args(args):
+    settings = dict(DEFAULT_RENDER_SETTINGS)
+    if args.settings:
+        with open(args.settings, encoding="utf-8") as f:
+            settings.update(json.load(f))
+    overrides = {
+        "background": args.background,
+        "font_path": args.font,
+        "font_size": args.font_size,
+        "text_color": args.text_color,
+        "name_pos": args.name_pos,
+        "phone_pos": args.phone_pos,
+        "bold": args.bold,
+        "underline": args.underline,
+        "shadow": args.shadow,
+        "auto_contrast": args.auto_contrast,
+        "fallback_fonts": args.fallback_fonts,
+        "photo_column": getattr(args, "photo_column", None),
+        "photo_box": args.photo_box,
+        "photo_shape": args.photo_shape,
+        "output_format": args.format,
+        "quality": args.quality,
+        "max_bytes": int(args.max_kb * 1024) if args.max_kb else None,
+        "allow_downscale": args.allow_downscale,
+        "embed_fonts": args.embed_fonts,
+    }
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    if not settings["background"]:
+        raise SystemExit("A background image is required (--background or --settings).")
+    if settings["photo_column"] and not settings["photo_box"]:
+        raise SystemExit("A photo column needs a photo slot (--photo-box or --settings).")
+    return settings
+
+
+def _run_local_shards(argv, args):
+    """Run each shard of a generate command as its own process and merge the results."""
+    command = [sys.executable] if getattr(sys, "frozen", False) else [sys.executable, os.path.abspath(__file__)]
+    shard_argv = [arg for arg in argv if arg != "--local-shards"]
+    processes = [
+        subprocess.Popen(command + shard_argv + ["--shard-index", str(index)])
+        for index in range(args.shards)
+    ]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        print(f"Shards {failed} exited with an error.")
+    merge_argv = ["merge-shards", "--data", args.data, "--output", args.output,
+                  "--country-code", args.country_code, "--shards", str(args.shards),
+                  "--partition", args.partition]
+    if args.row_filter:
+        merge_argv += ["--filter", args.row_filter]
+    if args.table:
+        merge_argv += ["--table", args.table]
+    settings = _settings_from_args(args)
+    if settings["photo_column"]:
+        merge_argv += ["--photo-column", settings["photo_column"]]
+    for column in paragraph_columns(settings):
+        merge_argv += ["--text-column", column]
+    merge_argv += ["--format", settings["output_format"]]
+    return run_command_line(merge_argv) or (1 if failed else 0)
+
+
+def _run_watch(args):
+    """Re-render changed rows whenever the data, background or font files change, until Ctrl+C."""
+    settings = _settings_from_args(args)
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        batch = FlyerBatch(settings, args.output, workers=args.workers, duplicates=args.duplicates)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    try:
+        row_filter = RowFilter(args.row_filter) if args.row_filter else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    watcher = FlyerWatcher(batch, args.data, ContactValidator(args.country_code), interval=args.interval,
+                           row_filter=row_filter, table=args.table)
+    print(f"Watching {args.data} for changes. Press Ctrl+C to stop.")
+    try:
+        watcher.run(on_sync=lambda summary: print(FlyerWatcher.describe(summary)))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    return 0
+
+
+def _write_contact_sheet(args, settings, contacts):
+    start_time = time.time()
+    sheet = ContactSheet(settings, tile_width=args.tile_width)
+    contacts = ContactSheet.select(contacts, args.count, sample=args.sample, seed=args.seed)
+    try:
+        image = sheet.mosaic(contacts, columns=max(1, args.columns))
+    finally:
+        sheet.close()
+    path = os.path.join(args.output, ContactSheet.FILE_NAME)
+    image.save(path)
+    print(f"Wrote {len(contacts)} thumbnails to {path} in {time.time() - start_time:.1f}s.")
+    return 0
+
+
+def _run_service(args):
+    """Serve flyers over HTTP until Ctrl+C."""
+    templates = {}
+    if args.settings or args.background:
+        templates["default"] = _settings_from_args(args)
+    for template in args.template:
+        name, _, path = template.partition("=")
+        if not name or not path:
+            print(f"Error: --template expects NAME=SETTINGS, got {template!r}")
+            return 1
+        with open(path, encoding="utf-8") as f:
+            templates[name] = json.load(f)
+    try:
+        service = FlyerService(templates, workers=args.threads, cache_bytes=args.cache_mb * 1024 * 1024)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    server = ThreadingHTTPServer((args.host, args.port), FlyerRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = args.verbose
+    print(f"Serving templates {', '.join(sorted(templates))} on http://{args.host}:{server.server_port}/flyer "
+          "(Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping server.")
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False)
+    return 0
+
+
+def run_command_line(argv):
+    """Run a headless command; returns the process exit code."""
+    args = build_arg_parser().parse_args(argv)
+    if args.command == "serve":
+        return _run_service(args)
+    if args.command == "watch":
+        return _run_watch(args)
+    if args.command in ("generate", "merge-shards") and args.shards < 1:
+        print("Error: --shards must be at least 1.")
+        return 1
+    if args.command == "generate" and args.shard_index is not None and not 0 <= args.shard_index < args.shards:
+        print(f"Error: --shard-index must be between 0 and {args.shards - 1}.")
+        return 1
+    if args.command == "generate" and args.local_shards and not args.dry_run:
+        return _run_local_shards(argv, args)
+
+    sharded = args.command == "generate" and args.shard_index is not None
+    try:
+        validator = ContactValidator(args.country_code)
+        row_filter = RowFilter(args.row_filter) if args.row_filter else None
+        # Every shard reads the same file, so only the first one writes the rejection report
+        report_dir = args.output if args.command == "generate" and not args.shard_index and not args.dry_run else None
+        valid, rejected = validator.load(args.data, report_dir=report_dir, row_filter=row_filter, table=args.table)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    base_dir = os.path.dirname(os.path.abspath(args.data))
+
+    if args.command == "merge-shards":
+        try:
+            contacts = batch_contacts(valid, args.photo_column, base_dir=base_dir, text_columns=args.text_columns)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return 1
+        batch = FlyerBatch(dict(DEFAULT_RENDER_SETTINGS, output_format=args.format), args.output)
+        report = batch.merge_shards(contacts, args.shards, args.partition)
+        print(f"Merged {report['rows']} rows from {args.shards} shards.")
+        if report["missing_shards"]:
+            print(f"Missing shard manifests: {report['missing_shards']}")
+        if report["missing_rows"]:
+            print(f"{len(report['missing_rows'])} rows missing, e.g. rows {report['missing_rows'][:10]}")
+        if report["missing_files"]:
+            print(f"{len(report['missing_files'])} flyer files missing, e.g. {report['missing_files'][:5]}")
+        return 0 if report["complete"] else 1
+
+    settings = _settings_from_args(args)
+    try:
+        contacts = batch_contacts(valid, settings["photo_column"], base_dir=base_dir,
+                                  text_columns=paragraph_columns(settings))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if args.command == "generate" and args.dry_run:
+        return _estimate_batch(args, settings, contacts)
+    os.makedirs(args.output, exist_ok=True)
+    if args.command == "contact-sheet":
+        return _write_contact_sheet(args, settings, contacts)
+    if report_dir:
+        uncovered = validator.check_coverage(
+            valid, [settings["font_path"]] + list(settings["fallback_fonts"]), report_dir=report_dir
+        )
+        if len(uncovered):
+            print(f"Warning: {len(uncovered)} rows contain characters no configured font can draw, "
+                  f"see {ContactValidator.UNCOVERED_REPORT_NAME}.")
+    try:
+        batch = FlyerBatch(settings, args.output, workers=args.workers, duplicates=args.duplicates)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    shard = (args.shard_index, args.shards, args.partition) if sharded else None
+    label = f"Shard {args.shard_index + 1}/{args.shards}: " if sharded else ""
+
+    def progress(done, name):
+        if (done + 1) % 100 == 0:
+            print(f"{label}{done + 1} flyers done")
+
+    start_time = time.time()
+    summary = batch.run(contacts, progress=progress, shard=shard)
+    print(f"{label}Generated {summary['generated']} of {summary['total']} flyers "
+          f"({summary['renders_saved']} renders saved) in {time.time() - start_time:.1f}s.")
+    if len(rejected) and report_dir:
+        print(f"{len(rejected)} rows were skipped, see {ContactValidator.REPORT_NAME}.")
+    for failure in summary["failed"][:10]:
+        print(f"  Failed: {failure}")
+    checked = 0
+    if args.check_rows and settings["output_format"] in VECTOR_FORMATS:
+        jobs = batch.build_jobs(contacts)
+        if shard is not None:
+            jobs = batch.partition(jobs, args.shards, args.partition)[args.shard_index]
+        checked = _check_vector_output(settings, args.output, jobs, args.check_rows)
+    return 1 if summary["failed"] else checked
+
+
+def _estimate_batch(args, settings, contacts):
+    """Print a dry-run estimate for a generate command without writing any flyers."""
+    # Local shards run side by side, each with its own workers
+    workers = args.workers * (args.shards if args.local_shards else 1)
+    shard = (args.shard_index, args.shards, args.partition) if args.shard_index is not None else None
+    try:
+        batch = FlyerBatch(settings, args.output, workers=workers, duplicates=args.duplicates)
+        estimate = batch.estimate(contacts, sample_size=args.sample_rows, shard=shard)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    print(FlyerBatch.describe_estimate(estimate))
+    return 1 if estimate["bytes"] > estimate["free_bytes"] else 0
+
+
+def _check_vector_output(settings, output_dir, jobs, count):
+    """
+    Pixel-diff ``count`` evenly spread documents against raster renders. Returns the
+    exit code: 0 if all match, 1 if any differs too much or cannot be read, and
+    2 if rows could only be replayed with Pillow because cairosvg is unavailable,
+    which does not verify a renderer's own output.
+    """
+    writer = VectorFlyerWriter(settings, output_dir)
+    # Only documents already written are read back, so no assets are published
+    writer.background_href = ""
+    writer.font_hrefs = dict.fromkeys(writer.renderer.font_paths, "")
+    jobs = [job for job in jobs if os.path.exists(job["path"])]
+    picked = [jobs[i * len(jobs) // count] for i in range(min(count, len(jobs)))]
+    failed = unverified = 0
+    for job in picked:
+        try:
+            result = writer.compare(job["path"], job["name"], job["phone"], job["photo"], job["texts"])
+        except (ValueError, OSError) as e:
+            failed += 1
+            print(f"  FAIL row {job['row']}: {e}")
+            continue
+        measured = (f"{result['changed']:.3%} of pixels differ "
+                    f"(max {result['max']}, mean {result['mean']:.3f}, {result['method']})")
+        if result["method"] != "cairosvg":
+            unverified += 1
+            print(f"  ---- row {job['row']}: not verified: cairosvg unavailable; replay: {measured}")
+        elif result["changed"] <= VectorFlyerWriter.MAX_CHANGED:
+            print(f"  OK   row {job['row']}: {measured}")
+        else:
+            failed += 1
+            print(f"  DIFF row {job['row']}: {measured}")
+    if failed:
+        return 1
+    if unverified:
+        print(f"{unverified} rows were not verified; install cairosvg to check --check-rows output.")
+        return 2
+    return 0
+
+
 def main():
-    """Initialize and run the enhanced application."""
+    """Initialize and run the enhanced application, or a headless command if arguments are given."""
+    if len(sys.argv) > 1:
+        sys.exit(run_command_line(sys.argv[1:]))
+    
     if not check_dependencies():
         input("Press Enter to exit...")
         return
@@ -1846,4 +7118,5 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
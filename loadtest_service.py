@@ -0,0 +1,97 @@
+"""Load test for the flyer HTTP service started with `flyer_final.py serve`.
+
+Sends GET /flyer requests from several threads over keep-alive connections
+and reports requests/sec and latency percentiles.
+
+Example:
+    python loadtest_service.py http://127.0.0.1:8080 --requests 2000 --concurrency 8 --distinct 50
+"""
+import argparse
+import http.client
+import math
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlparse
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def run_load_test(url, requests, concurrency, distinct, template, revalidate):
+    parsed = urlparse(url)
+    latencies = []
+    statuses = {}
+    errors = []
+    etags = {}
+    lock = threading.Lock()
+
+    def worker(count, seed):
+        rng = random.Random(seed)
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=120)
+        for _ in range(count):
+            index = rng.randrange(distinct)
+            query = urlencode({"name": f"Customer {index}", "number": f"+91 90000 {index:05d}",
+                               "template": template})
+            headers = {}
+            if revalidate and index in etags:
+                headers["If-None-Match"] = etags[index]
+            start = time.perf_counter()
+            try:
+                connection.request("GET", f"/flyer?{query}", headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=120)
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.getheader("ETag"):
+                    etags[index] = response.getheader("ETag")
+        connection.close()
+
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(count, i)) for i, count in enumerate(per_thread)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Requests:     {len(latencies)} ok, {len(errors)} failed in {wall:.2f}s")
+    print(f"Throughput:   {len(latencies) / wall:.1f} requests/sec")
+    print(f"Latency p50:  {percentile(latencies, 0.50) * 1000:.1f} ms")
+    print(f"Latency p99:  {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"Latency max:  {(latencies[-1] if latencies else 0) * 1000:.1f} ms")
+    print("Status codes: " + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())))
+    if errors:
+        print(f"First error:  {errors[0]}")
+    return 0 if not errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the flyer HTTP service")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8080")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=50, help="Number of different contacts requested")
+    parser.add_argument("--template", default="default")
+    parser.add_argument("--revalidate", action="store_true",
+                        help="Send If-None-Match with ETags already seen, as a browser would")
+    args = parser.parse_args()
+    return run_load_test(args.url, args.requests, args.concurrency, args.distinct, args.template, args.revalidate)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PIL import Image
+
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "font", "Roboto-Regular.ttf")
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """Render settings for a small plain template."""
+    background = tmp_path / "background.png"
+    Image.new("RGB", (320, 200), "#f0e8d0").save(background)
+    return {"background": str(background), "font_path": FONT, "font_size": 20,
+            "name_pos": (20, 40), "phone_pos": (20, 120)}
+
+
+def write_contacts(path, rows):
+    """Write (name, number) rows as a contact CSV."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("name,number\n")
+        for name, number in rows:
+            f.write(f"{name},{number}\n")
+    return str(path)
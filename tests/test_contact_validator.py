@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from flyer_final import ContactValidator
+
+
+@pytest.mark.parametrize("number, expected", [
+    ("9876543210", "+919876543210"),
+    ("+91 98765 43210", "+919876543210"),
+    ("(987) 654-3210", "+919876543210"),
+    ("98765-43210 ext", "+919876543210"),
+    # Trunk prefix and the 00 international prefix
+    ("09876543210", "+919876543210"),
+    ("0091 9876543210", "+919876543210"),
+    ("001 415 555 2671", "+14155552671"),
+    # Country code without a plus
+    ("919876543210", "+919876543210"),
+    # Excel stores long numbers as floats
+    (9876543210.0, "+919876543210"),
+    ("+1 415 555 2671", "+14155552671"),
+    ("+44 20 7946 0958", "+442079460958"),
+])
+def test_valid_numbers_become_e164(number, expected):
+    valid, rejected = ContactValidator("+91").validate(pd.DataFrame({"name": ["A"], "number": [number]}))
+    assert rejected.empty
+    assert valid["phone"].tolist() == [expected]
+
+
+@pytest.mark.parametrize("name, number, reason", [
+    ("A", "12345", "invalid number"),
+    ("A", "abc", "invalid number"),
+    ("A", "", "missing number"),
+    ("A", "nan", "missing number"),
+    ("", "9876543210", "missing name"),
+])
+def test_rejection_reasons(name, number, reason):
+    valid, rejected = ContactValidator("+91").validate(pd.DataFrame({"name": [name], "number": [number]}))
+    assert valid.empty
+    assert rejected[["row", "reason"]].values.tolist() == [[2, reason]]
+
+
+def test_default_country_code_applies_to_national_numbers_only():
+    phones = ContactValidator("+1").normalize_phones(pd.Series(["4155552671", "14155552671", "+14155552671"]))
+    assert phones.tolist() == ["+14155552671"] * 3
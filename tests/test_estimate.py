@@ -0,0 +1,29 @@
+import os
+
+from flyer_final import FlyerBatch
+
+
+def contacts(count):
+    return [(row + 2, f"Person {row}", f"+9198765{row:05d}") for row in range(count)]
+
+
+def test_estimate_includes_the_one_off_setup(settings, tmp_path):
+    batch = FlyerBatch(settings, str(tmp_path / "out"))
+    estimate = batch.estimate(contacts(10), sample_size=4)
+    per_flyer = sum(estimate["stage_seconds"].values())
+    assert not estimate["processes"] and estimate["setup_seconds"] > 0
+    assert abs(estimate["seconds"] - estimate["setup_seconds"] - 10 * per_flyer) < 1e-9
+    assert "to load the template" in FlyerBatch.describe_estimate(estimate)
+    assert not os.path.exists(tmp_path / "out")
+
+
+def test_estimate_with_processes_includes_worker_startup(settings, tmp_path):
+    batch = FlyerBatch(settings, str(tmp_path / "out"), workers=2)
+    rows = 2 * FlyerBatch.CHUNK_SIZE + 1
+    estimate = batch.estimate(contacts(rows), sample_size=4)
+    assert estimate["processes"]
+    # A process start alone costs more than loading the template in place
+    single = FlyerBatch(settings, str(tmp_path / "out")).estimate(contacts(rows), sample_size=4)
+    assert estimate["setup_seconds"] > single["setup_seconds"]
+    assert "to start the worker processes" in FlyerBatch.describe_estimate(estimate)
+    assert not os.path.exists(tmp_path / "out")
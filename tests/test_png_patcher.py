@@ -0,0 +1,93 @@
+import io
+import os
+import random
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from flyer_final import FlyerRenderer, PngPatcher, _adler32_combine
+
+
+@pytest.mark.parametrize("first, second", [
+    (b"", b""),
+    (b"", b"flyer"),
+    (b"flyer", b""),
+    (b"name,number\n", b"Asha,9876543210\n"),
+    (b"\xff" * 5551, b"\xff" * 5553),
+    (os.urandom(7000), os.urandom(70000)),
+    (os.urandom(65521), os.urandom(65522)),
+])
+def test_adler32_combine_matches_adler32_of_the_joined_data(first, second):
+    combined = _adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second))
+    assert combined == zlib.adler32(first + second)
+
+
+def template(mode, height=70):
+    """A noisy template, so every PNG filter gets used, spanning several bands and a partial last one."""
+    rng = np.random.default_rng(0)
+    bands = len(Image.new(mode, (1, 1)).getbands())
+    gradient = np.linspace(0, 200, 90, dtype=np.uint8)[None, :, None]
+    pixels = (gradient + rng.integers(0, 40, (height, 90, bands), dtype=np.uint8)).astype(np.uint8)
+    return Image.fromarray(pixels[:, :, 0] if bands == 1 else pixels, mode)
+
+
+def idat_stream(data):
+    offset, idat = 8, []
+    while offset < len(data):
+        length = int.from_bytes(data[offset:offset + 4], "big")
+        kind = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        assert zlib.crc32(kind + body) == int.from_bytes(data[offset + 8 + length:offset + 12 + length], "big")
+        if kind == b"IDAT":
+            idat.append(body)
+        offset += 12 + length
+    return b"".join(idat)
+
+
+BOXES = {
+    "untouched": [],
+    "first band": [(4, 0, 40, 6)],
+    "last band": [(10, 64, 80, 70)],
+    "across bands": [(20, 10, 60, 50)],
+    "band edges": [(0, 15, 90, 17), (30, 31, 31, 33)],
+    "clipped": [(-10, -10, 20, 5), (70, 60, 200, 200)],
+}
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L"])
+@pytest.mark.parametrize("where", list(BOXES))
+def test_patched_png_decodes_like_image_save(mode, where):
+    background = template(mode)
+    patcher = PngPatcher(background)
+    assert PngPatcher.BAND_ROWS == 16 and len(patcher.bands) == 5
+    rng = random.Random(where)
+    for _ in range(2):
+        image = background.copy()
+        draw = ImageDraw.Draw(image)
+        for box in BOXES[where]:
+            color = tuple(rng.randrange(256) for _ in image.getbands())
+            draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1), fill=color[0] if mode == "L" else color)
+        patched = patcher.encode(image, BOXES[where])
+
+        # zlib checks the combined Adler-32 of the stream
+        zlib.decompress(idat_stream(patched))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        with Image.open(io.BytesIO(patched)) as decoded, Image.open(buffer) as saved:
+            assert decoded.mode == saved.mode == mode
+            assert decoded.tobytes() == saved.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize("name_pos, phone_pos", [((5, 0), (5, 180)), ((20, 40), (20, 120))])
+def test_patched_flyer_text_decodes_like_image_save(settings, name_pos, phone_pos):
+    renderer = FlyerRenderer(dict(settings, name_pos=name_pos, phone_pos=phone_pos))
+    patcher = PngPatcher(renderer.background)
+    for name, number in [("Asha", "+91 98765 00001"), ("Ravi Kumar", "+91 98765 00002")]:
+        image = renderer.background.copy()
+        boxes = renderer.draw_into(image, name, number)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        with Image.open(io.BytesIO(patcher.encode(image, boxes))) as decoded, Image.open(buffer) as saved:
+            assert decoded.tobytes() == saved.tobytes()
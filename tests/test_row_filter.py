@@ -0,0 +1,67 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from flyer_final import ContactValidator, RowFilter
+
+FILTERS = [
+    "city == 'Pune'",
+    "city != 'Pune'",
+    "not (city == 'Pune')",
+    "city in ('Pune', 'Delhi')",
+    "city not in ('Pune',)",
+    "city not in ()",
+    "not (city not in ())",
+    "city in ()",
+    "segment not in ('gold',) or city == 'Delhi'",
+    "number > 9000012345",
+    "number <= 9000000050",
+    "number in (9000000007, 'n/a')",
+    "not (number != 9000000014)",
+    "city == 'Pune' and not (segment in ('gold', 'silver'))",
+]
+
+
+def contact_rows():
+    cities = ["Pune", "Mumbai", "", " Pune ", "Delhi", "   "]
+    segments = ["gold", "silver", "", "bronze"]
+    numbers = ["9000000000", "", "n/a", " 9000099999 ", "9000012345.0", "90000e5"]
+    return pd.DataFrame({
+        "name": [f"Person {row}" for row in range(200)],
+        "number": [numbers[row % 6] if row % 7 else str(9000000000 + row) for row in range(200)],
+        "city": [cities[row % 6] for row in range(200)],
+        "segment": [segments[row % 4] for row in range(200)],
+    })
+
+
+@pytest.fixture
+def sources(tmp_path):
+    rows = contact_rows()
+    csv = str(tmp_path / "contacts.csv")
+    rows.to_csv(csv, index=False)
+    # Read back the way a spreadsheet export arrives: every cell text, blanks as ''
+    rows = pd.read_csv(csv, dtype=str, keep_default_na=False)
+    parquet = str(tmp_path / "contacts.parquet")
+    rows.to_parquet(parquet, index=False, row_group_size=16)
+    database = str(tmp_path / "contacts.db")
+    with sqlite3.connect(database) as connection:
+        rows.to_sql("contacts", connection, index=False)
+    return csv, parquet, database
+
+
+@pytest.mark.parametrize("expression", FILTERS)
+def test_csv_parquet_and_sqlite_select_the_same_rows(sources, expression):
+    validator = ContactValidator()
+    selected = [list(validator.read(path, RowFilter(expression)).index) for path in sources]
+    assert selected[0] == selected[1] == selected[2]
+
+
+def test_blank_and_non_numeric_cells_never_match(sources):
+    csv = sources[0]
+    rows = contact_rows()
+    selected = ContactValidator().read(csv, RowFilter("city not in ()"))
+    assert list(selected.index) == [row for row in range(200) if rows["city"][row].strip()]
+    selected = ContactValidator().read(csv, RowFilter("not (number < 0)"))
+    assert set(selected["number"].str.strip()) == {"9000000000", "9000099999", "9000012345.0", "90000e5"} | {
+        str(9000000000 + row) for row in range(0, 200, 7)}
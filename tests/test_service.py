@@ -0,0 +1,37 @@
+import io
+import os
+
+from PIL import Image
+
+from flyer_final import FlyerService
+
+
+def test_edited_template_changes_etag_and_output(settings):
+    service = FlyerService({"default": settings}, workers=1)
+    try:
+        etag, data = service.render("default", "Asha", "+91 98765 00001")
+        assert service.etag("default", "Asha", "+91 98765 00001") == etag
+        assert service.render("default", "Asha", "+91 98765 00001") == (etag, data)
+        assert service.stats["rendered"] == 1
+
+        Image.new("RGB", (320, 200), "#203040").save(settings["background"])
+        stat = os.stat(settings["background"])
+        os.utime(settings["background"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        new_etag, new_data = service.render("default", "Asha", "+91 98765 00001")
+        assert new_etag != etag
+        assert service.etag("default", "Asha", "+91 98765 00001") == new_etag
+        assert service.stats["rendered"] == 2
+        assert Image.open(io.BytesIO(new_data)).convert("RGB").getpixel((300, 190)) == (0x20, 0x30, 0x40)
+    finally:
+        service.executor.shutdown()
+
+
+def test_output_cache_stays_within_its_byte_budget(settings):
+    service = FlyerService({"default": settings}, workers=1, cache_bytes=1)
+    try:
+        for index in range(3):
+            service.render("default", f"Person {index}", f"+91 98765 0000{index}")
+        assert len(service._outputs) == 1
+    finally:
+        service.executor.shutdown()
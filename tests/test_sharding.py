@@ -0,0 +1,58 @@
+import os
+from collections import Counter
+
+from conftest import write_contacts
+from flyer_final import FlyerBatch, run_command_line
+
+
+def contacts_with_duplicates():
+    contacts = []
+    for row in range(60):
+        # Every fourth distinct contact appears three times, far apart
+        person = row % 20 if row % 4 == 0 else row
+        contacts.append((row + 2, f"Person {person}", f"+9198765{person:05d}"))
+    return contacts
+
+
+def test_hash_partition_places_every_job_once_and_keeps_duplicates_together(settings, tmp_path):
+    batch = FlyerBatch(settings, str(tmp_path / "out"))
+    jobs = batch.build_jobs(contacts_with_duplicates())
+    for count in (1, 2, 3, 7):
+        shards = batch.partition(jobs, count, "hash")
+        placed = Counter(job["row"] for shard in shards for job in shard)
+        assert sorted(placed) == sorted(job["row"] for job in jobs)
+        assert set(placed.values()) == {1}
+        homes = {}
+        for index, shard in enumerate(shards):
+            for job in shard:
+                homes.setdefault(batch.render_key(job), set()).add(index)
+        assert all(len(indexes) == 1 for indexes in homes.values())
+
+
+def test_range_partition_places_every_job_once(settings, tmp_path):
+    batch = FlyerBatch(settings, str(tmp_path / "out"))
+    jobs = batch.build_jobs(contacts_with_duplicates())
+    shards = batch.partition(jobs, 4, "range")
+    assert [job["row"] for shard in shards for job in shard] == [job["row"] for job in jobs]
+
+
+def test_merge_fails_when_a_shard_manifest_is_missing(settings, tmp_path):
+    output = tmp_path / "out"
+    os.makedirs(output)
+    contacts = contacts_with_duplicates()[:12]
+    batch = FlyerBatch(settings, str(output))
+    batch.run(contacts, shard=(0, 2, "hash"))
+
+    report = batch.merge_shards(contacts, 2, "hash")
+    assert not report["complete"]
+    assert report["missing_shards"] == [2]
+    assert not os.path.exists(output / FlyerBatch.MANIFEST_NAME)
+
+    data = write_contacts(tmp_path / "contacts.csv", [(name, number) for _, name, number in contacts])
+    assert run_command_line(["merge-shards", "--data", data, "--output", str(output),
+                             "--shards", "2", "--partition", "hash"]) == 1
+
+    batch.run(contacts, shard=(1, 2, "hash"))
+    assert batch.merge_shards(contacts, 2, "hash")["complete"]
+    assert run_command_line(["merge-shards", "--data", data, "--output", str(output),
+                             "--shards", "2", "--partition", "hash"]) == 0
@@ -0,0 +1,41 @@
+import sys
+
+import pytest
+
+from conftest import write_contacts
+from flyer_final import VectorFlyerWriter, run_command_line
+
+
+def test_check_rows_without_cairosvg_is_reported_as_not_verified(settings, tmp_path, capsys, monkeypatch):
+    # Make sure the check runs on the Pillow replay, whether or not cairosvg is installed
+    monkeypatch.setitem(sys.modules, "cairosvg", None)
+    data = write_contacts(tmp_path / "contacts.csv", [("Asha", "9876500001"), ("Ravi", "9876500002")])
+    output = tmp_path / "out"
+    status = run_command_line(["generate", "--data", data, "--output", str(output),
+                               "--background", settings["background"], "--font", settings["font_path"],
+                               "--format", "svg", "--check-rows", "2"])
+    printed = capsys.readouterr().out
+    assert status == 2
+    assert printed.count("not verified: cairosvg unavailable") == 2
+    assert "OK " not in printed
+
+
+def test_replay_accepts_spaced_styles_and_rejects_documents_without_them(settings, tmp_path):
+    writer = VectorFlyerWriter(dict(settings, output_format="svg"), str(tmp_path))
+    writer.prepare()
+    path = str(tmp_path / "flyer.svg")
+    writer.write(path, "Asha", "+91 98765 00001")
+    with open(path, encoding="utf-8") as f:
+        document = f.read()
+
+    spaced = document.replace("{font-family:", " { font-family: ").replace(";font-size:", "; font-size: ")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(spaced)
+    image, method = writer.rasterize(path)
+    assert (image.size, method) == ((320, 200), "replay")
+
+    start, end = document.index("<style>"), document.index("</style>") + len("</style>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(document[:start] + document[end:])
+    with pytest.raises(ValueError, match="no font is declared"):
+        writer.rasterize(path)
@@ -0,0 +1,44 @@
+import json
+import os
+
+from conftest import write_contacts
+from flyer_final import ContactValidator, FlyerBatch, FlyerWatcher
+
+
+def test_sync_rerenders_changed_rows_and_removes_deleted_ones(settings, tmp_path):
+    output = tmp_path / "out"
+    os.makedirs(output)
+    data = tmp_path / "contacts.csv"
+    write_contacts(data, [("Asha", "9876500001"), ("Ravi", "9876500002"), ("Meera", "9876500003")])
+    watcher = FlyerWatcher(FlyerBatch(settings, str(output)), str(data), ContactValidator())
+
+    summary = watcher.sync()
+    assert summary["full"] and summary["generated"] == 3 and summary["added"] == 3
+    flyers = sorted(name for name in os.listdir(output) if name.endswith("_flyer.png"))
+    assert flyers == ["Asha_flyer.png", "Meera_flyer.png", "Ravi_flyer.png"]
+
+    # Mark the existing files, so a rewritten flyer can be told from one left alone
+    for name in flyers:
+        (output / name).write_bytes(b"untouched")
+    # Ravi is renamed, Meera is deleted and Kiran is added; Asha stays as she was
+    write_contacts(data, [("Asha", "9876500001"), ("Ravi Kumar", "9876500002"), ("Kiran", "9876500004")])
+
+    summary = watcher.sync()
+    assert not summary["full"]
+    assert (summary["generated"], summary["added"], summary["changed"]) == (2, 1, 1)
+    assert (summary["removed"], summary["files_removed"]) == (1, 2)
+    assert sorted(name for name in os.listdir(output) if name.endswith("_flyer.png")) == [
+        "Asha_flyer.png", "Kiran_flyer.png", "RaviKumar_flyer.png"]
+    assert (output / "Asha_flyer.png").read_bytes() == b"untouched"
+    for name in ("Kiran_flyer.png", "RaviKumar_flyer.png"):
+        assert (output / name).read_bytes().startswith(b"\x89PNG")
+
+    with open(output / FlyerWatcher.STATE_NAME, encoding="utf-8") as f:
+        state = json.load(f)
+    assert sorted(state["rows"]) == ["+919876500001", "+919876500002", "+919876500004"]
+    assert state["rows"]["+919876500002"][0][1] == str(output / "RaviKumar_flyer.png")
+    assert {method for _, method in state["rows"].values()} == {"rendered"}
+
+    # Nothing changed, so nothing is rendered or removed
+    summary = watcher.sync()
+    assert (summary["generated"], summary["added"], summary["changed"], summary["files_removed"]) == (0, 0, 0, 0)